@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+
+"""
+Read the Packages indices of the Ubuntu archive used by a chisel release.
+"""
+
+import gzip
+import hashlib
+import logging
+import lzma
+import os
+import re
+import tempfile
+import urllib.parse
+
+import requests
+
+from dataclasses import dataclass
+from typing import Iterator
+
+
+UBUNTU_URL = "http://archive.ubuntu.com/ubuntu"
+UBUNTU_PORTS_URL = "http://ports.ubuntu.com/ubuntu-ports"
+CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class PackageInfo:
+    """
+    Minimal data class to store the fields of a Packages index entry.
+    """
+
+    package: str
+    version: str
+    arch: str
+    suite: str
+    component: str
+    filename: str
+    sha256: str
+    size: int
+    # In bytes, while the Installed-Size field is in KiB.
+    installed_size: int
+
+
+def archive_url(arch: str) -> str:
+    """
+    Return the URL of the Ubuntu archive that chisel uses for arch.
+    """
+    if arch in ("amd64", "i386"):
+        return UBUNTU_URL
+    return UBUNTU_PORTS_URL
+
+
+def _version_order(c: str) -> int:
+    """
+    Return the sort weight of a character in a Debian version string.
+    """
+    if c == "~":
+        return -1
+    if c.isdigit():
+        return 0
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+def _compare_version_part(a: str, b: str) -> int:
+    """
+    Compare an upstream version or Debian revision as dpkg does.
+    """
+    while a or b:
+        a_str, a = re.match(r"(\D*)(.*)", a).groups()
+        b_str, b = re.match(r"(\D*)(.*)", b).groups()
+        for i in range(max(len(a_str), len(b_str))):
+            a_ord = _version_order(a_str[i]) if i < len(a_str) else 0
+            b_ord = _version_order(b_str[i]) if i < len(b_str) else 0
+            if a_ord != b_ord:
+                return a_ord - b_ord
+        a_num, a = re.match(r"(\d*)(.*)", a).groups()
+        b_num, b = re.match(r"(\d*)(.*)", b).groups()
+        if int(a_num or 0) != int(b_num or 0):
+            return int(a_num or 0) - int(b_num or 0)
+    return 0
+
+
+def compare_versions(a: str, b: str) -> int:
+    """
+    Compare two Debian package versions. Return a negative number, zero or a
+    positive number if a is lower, equal or greater than b.
+    """
+
+    def split(version: str) -> tuple[int, str, str]:
+        epoch, _, rest = version.partition(":") if ":" in version else ("0", "", version)
+        upstream, _, revision = rest.rpartition("-") if "-" in rest else (rest, "", "")
+        return int(epoch or 0), upstream, revision
+
+    a_epoch, a_upstream, a_revision = split(a)
+    b_epoch, b_upstream, b_revision = split(b)
+    if a_epoch != b_epoch:
+        return a_epoch - b_epoch
+    return _compare_version_part(a_upstream, b_upstream) or _compare_version_part(
+        a_revision, b_revision
+    )
+
+
+def parse_packages_index(
+    text: str, arch: str, suite: str, component: str
+) -> list[PackageInfo]:
+    """
+    Parse the content of a Packages index file.
+    """
+    packages = []
+    for stanza in text.split("\n\n"):
+        fields = {}
+        for line in stanza.splitlines():
+            if not line or line[0].isspace():
+                continue
+            key, _, value = line.partition(":")
+            fields[key] = value.strip()
+        if "Package" not in fields:
+            continue
+        packages.append(
+            PackageInfo(
+                package=fields["Package"],
+                version=fields.get("Version", ""),
+                arch=fields.get("Architecture", arch),
+                suite=suite,
+                component=component,
+                filename=fields.get("Filename", ""),
+                sha256=fields.get("SHA256", ""),
+                size=int(fields.get("Size", 0)),
+                installed_size=int(fields.get("Installed-Size", 0)) * 1024,
+            )
+        )
+    return packages
+
+
+def iter_archive_file(
+    base_url: str, path: str, session: requests.Session | None = None
+) -> Iterator[bytes]:
+    """
+    Read the file at path in the archive, which is either served at base_url
+    or, for a local mirror, stored in the base_url directory, in chunks.
+    """
+    if "://" not in base_url or base_url.startswith("file://"):
+        base_dir = urllib.parse.urlparse(base_url).path if "://" in base_url else base_url
+        with open(os.path.join(base_dir, path), "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                yield chunk
+        return
+    url = f"{base_url.rstrip('/')}/{path}"
+    with (session or requests).get(url, timeout=60, stream=True) as response:
+        response.raise_for_status()
+        yield from response.iter_content(CHUNK_SIZE)
+
+
+def read_archive_file(
+    base_url: str, path: str, session: requests.Session | None = None
+) -> bytes:
+    """
+    Read the file at path in the archive, see iter_archive_file().
+    """
+    return b"".join(iter_archive_file(base_url, path, session))
+
+
+def download_package(
+    info: PackageInfo,
+    base_url: str,
+    dest_dir: str | os.PathLike,
+    session: requests.Session | None = None,
+) -> int:
+    """
+    Download the package into dest_dir, named after its sha256 digest like in
+    the chisel cache. The file is written under a temporary name and renamed
+    once its digest is verified, so that it never shows up partially.
+    Return the number of bytes downloaded, 0 if the file was already there.
+    """
+    dest = os.path.join(dest_dir, info.sha256)
+    if os.path.exists(dest):
+        return 0
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, prefix=".download-")
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter_archive_file(base_url, info.filename, session):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        if digest.hexdigest() != info.sha256:
+            raise ValueError(
+                f"{info.filename}: expected sha256 {info.sha256}, got {digest.hexdigest()}"
+            )
+        os.replace(tmp_path, dest)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return size
+
+
+def read_packages_index(
+    suite: str,
+    component: str,
+    arch: str,
+    base_url: str,
+    session: requests.Session | None = None,
+) -> list[PackageInfo]:
+    """
+    Read and parse the Packages index of a suite and component for arch,
+    compressed with xz or, if there is none, gzip.
+    """
+    path = f"dists/{suite}/{component}/binary-{arch}/Packages"
+    logging.info("Fetching %s/%s...", base_url, path)
+    try:
+        data = lzma.decompress(read_archive_file(base_url, path + ".xz", session))
+    except (OSError, lzma.LZMAError, requests.RequestException):
+        data = gzip.decompress(read_archive_file(base_url, path + ".gz", session))
+    text = data.decode("utf-8", errors="replace")
+    return parse_packages_index(text, arch, suite, component)
+
+
+def fetch_packages_index(
+    suites: list[str],
+    components: list[str],
+    arch: str,
+    base_url: str | None = None,
+    session: requests.Session | None = None,
+) -> dict[str, PackageInfo]:
+    """
+    Fetch the Packages indices of every suite and component for arch, and
+    return the entry of each package that chisel would pick: the one with the
+    highest version across the suites.
+    """
+    base_url = base_url or archive_url(arch)
+    index: dict[str, PackageInfo] = {}
+    for suite in suites:
+        for component in components:
+            for info in read_packages_index(suite, component, arch, base_url, session):
+                current = index.get(info.package)
+                if current is None or compare_versions(info.version, current.version) > 0:
+                    index[info.package] = info
+    return index
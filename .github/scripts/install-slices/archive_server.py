@@ -0,0 +1,437 @@
+#!/usr/bin/python3
+
+"""
+Snapshot the part of the Ubuntu archive that a chisel release needs, and
+serve it locally, with throttling and fault injection, to benchmark the
+installation of the slices reproducibly and without the network.
+
+The server is also an HTTP proxy for the archives, so that chisel and
+install_slices fetch from the snapshot when http_proxy points to it.
+
+Usage
+-----
+archive_server snapshot [-h] --release RELEASE --arch ARCH
+                        [--archive-url ARCHIVE_URL] [--workers WORKERS]
+                        dir [file ...]
+archive_server serve [-h] [--port PORT] [--latency LATENCY]
+                     [--bandwidth BANDWIDTH] [--error-rate ERROR_RATE]
+                     [--reset-rate RESET_RATE]
+                     [--truncate-rate TRUNCATE_RATE] [--seed SEED]
+                     dir
+
+snapshot:
+  dir                 Directory to write the snapshot to
+  file                Only snapshot the packages of these slice definition
+                      files and of their essentials (default: the whole
+                      release)
+  --release RELEASE   chisel-releases directory
+  --arch ARCH         Package architecture(s), comma-separated
+  --archive-url ARCHIVE_URL
+                      URL or local directory of the Ubuntu archive (mirror) to
+                      snapshot (default: the archive used by chisel for
+                      --arch)
+  --workers WORKERS   Number of parallel downloads (default: 8)
+
+serve:
+  dir                 Snapshot directory to serve
+  --port PORT         Port to listen on, 0 to pick a free one (default: 8080)
+  --latency LATENCY   Seconds to wait before every response (default: 0)
+  --bandwidth BANDWIDTH
+                      Bytes per second of every response, 0 for no limit
+                      (default: 0)
+  --error-rate ERROR_RATE
+                      Fraction of the requests answered with a 503 error
+                      (default: 0)
+  --reset-rate RESET_RATE
+                      Fraction of the connections closed without a response
+                      (default: 0)
+  --truncate-rate TRUNCATE_RATE
+                      Fraction of the responses cut in the middle (default: 0)
+  --seed SEED         Seed of the fault injection (default: 0)
+
+Example
+-------
+archive_server snapshot --release ./ --arch amd64 /srv/snapshot
+archive_server serve --port 8080 --latency 0.05 --error-rate 0.01 /srv/snapshot &
+http_proxy=http://127.0.0.1:8080 install_slices --arch amd64 --release ./ ...
+"""
+
+import argparse
+import collections
+import hashlib
+import http.server
+import logging
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from archive_index import (
+    CHUNK_SIZE,
+    archive_url,
+    fetch_packages_index,
+    iter_archive_file,
+)
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from install_slices import (
+    essential_closures,
+    parse_archive,
+    parse_package,
+    parse_release_packages,
+)
+
+
+def snapshot_dir(dest: str, url: str) -> str:
+    """
+    Return the directory of the snapshot where the files of the archive at
+    url are stored: the host followed by the path of the url.
+    """
+    parts = urllib.parse.urlsplit(url)
+    return os.path.join(dest, parts.hostname or "", parts.path.strip("/"))
+
+
+def snapshot_file(
+    base_url: str, path: str, dest_dir: str, sha256: str | None = None
+) -> int:
+    """
+    Copy the file at path in the archive into dest_dir, under the same path,
+    checking its sha256 digest if given. The file is written under a
+    temporary name and renamed once complete, so that an interrupted
+    snapshot can be resumed.
+    Return the number of bytes copied, 0 if the file was already there.
+    """
+    dest = os.path.join(dest_dir, path)
+    if os.path.exists(dest):
+        return 0
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".snapshot-")
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter_archive_file(base_url, path):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        if sha256 and digest.hexdigest() != sha256:
+            raise ValueError(f"{path}: expected sha256 {sha256}, got {digest.hexdigest()}")
+        os.replace(tmp_path, dest)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return size
+
+
+def snapshot_archive(
+    dest: str,
+    release: str,
+    arches: list[str],
+    files: list[str] | None = None,
+    base_url: str | None = None,
+    workers: int = 8,
+) -> int:
+    """
+    Snapshot into dest the files of the Ubuntu archive that chisel fetches to
+    install the slices of the release on arches: the InRelease and Packages
+    indices of its suites and components, and the packages of the slice
+    definition files, or of the whole release, along with their essentials.
+    The files are laid out as in snapshot_dir(), for the archive chisel uses
+    on each architecture, even if they are read from the base_url mirror.
+    Return the number of bytes copied.
+    """
+    archive = parse_archive(release)
+    release_packages = parse_release_packages(release)
+    names = {p.package for p in release_packages}
+    if files:
+        names = set()
+        packages = [parse_package(f) for f in files]
+        for arch in arches:
+            closures = essential_closures(release_packages + packages, arch)
+            for pkg in packages:
+                for slice in pkg.slices:
+                    closure = closures.get(f"{pkg.package}_{slice}", set())
+                    names |= {name.split("_", 1)[0] for name in closure}
+                names.add(pkg.package)
+    copied = 0
+    for arch in arches:
+        source = base_url or archive_url(arch)
+        arch_dir = snapshot_dir(dest, archive_url(arch))
+        logging.info("Snapshotting the %s indices of %s...", arch, archive_url(arch))
+        for suite in archive.suites:
+            copied += snapshot_file(source, f"dists/{suite}/InRelease", arch_dir)
+            for component in archive.components:
+                path = f"dists/{suite}/{component}/binary-{arch}/Packages.gz"
+                copied += snapshot_file(source, path, arch_dir)
+        index = fetch_packages_index(archive.suites, archive.components, arch, arch_dir)
+        missing = sorted(names - index.keys())
+        if missing:
+            logging.warning("Not in the %s archive: %s", arch, " ".join(missing))
+        infos = [index[name] for name in sorted(names & index.keys())]
+        logging.info("Snapshotting %d %s packages...", len(infos), arch)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            copied += sum(
+                executor.map(
+                    lambda info: snapshot_file(source, info.filename, arch_dir, info.sha256),
+                    infos,
+                )
+            )
+    return copied
+
+
+@dataclass
+class Faults:
+    """
+    Throttling and faults of the responses of the archive server.
+    """
+
+    # Seconds to wait before every response.
+    latency: float = 0.0
+    # Bytes per second of every response, 0 for no limit.
+    bandwidth: int = 0
+    # Fractions of the requests answered with a 503 error, of the
+    # connections closed without a response and of the responses cut in the
+    # middle.
+    error_rate: float = 0.0
+    reset_rate: float = 0.0
+    truncate_rate: float = 0.0
+    seed: int = 0
+
+
+class ArchiveRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve the files of the snapshot, either by their path in the snapshot
+    or, as a proxy, by their URL in the archive.
+    """
+
+    server: "ArchiveServer"
+
+    def _snapshot_path(self) -> str | None:
+        url = urllib.parse.urlsplit(self.path)
+        if url.hostname:
+            # Proxy request for an archive URL.
+            path = os.path.join(url.hostname, url.path.lstrip("/"))
+        else:
+            path = url.path.lstrip("/")
+        root = os.path.realpath(self.server.root)
+        full_path = os.path.realpath(os.path.join(root, urllib.parse.unquote(path)))
+        if not full_path.startswith(root + os.sep) or not os.path.isfile(full_path):
+            return None
+        return full_path
+
+    def do_GET(self) -> None:
+        faults = self.server.faults
+        self.server.count("requests")
+        time.sleep(faults.latency)
+        fault = self.server.draw()
+        if fault == "reset":
+            self.server.count("resets")
+            self.close_connection = True
+            return
+        if fault == "error":
+            self.server.count("errors")
+            self.send_error(503, "Injected fault")
+            return
+        path = self._snapshot_path()
+        if path is None:
+            self.server.count("not found")
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        # A truncated response stops half way and closes the connection.
+        to_send = size // 2 if fault == "truncate" else size
+        if fault == "truncate":
+            self.server.count("truncated")
+            self.close_connection = True
+        chunk_size = min(CHUNK_SIZE, faults.bandwidth or CHUNK_SIZE)
+        with open(path, "rb") as f:
+            while to_send > 0:
+                chunk = f.read(min(chunk_size, to_send))
+                if not chunk:
+                    break
+                start = time.monotonic()
+                self.wfile.write(chunk)
+                to_send -= len(chunk)
+                self.server.count("bytes", len(chunk))
+                if faults.bandwidth:
+                    time.sleep(
+                        max(0.0, len(chunk) / faults.bandwidth - (time.monotonic() - start))
+                    )
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+
+class ArchiveServer(http.server.ThreadingHTTPServer):
+    """
+    HTTP server of an archive snapshot, see ArchiveRequestHandler.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], root: str, faults: Faults):
+        super().__init__(address, ArchiveRequestHandler)
+        self.root = root
+        self.faults = faults
+        self.stats: collections.Counter[str] = collections.Counter()
+        self._rng = random.Random(faults.seed)
+        self._lock = threading.Lock()
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += n
+
+    def draw(self) -> str | None:
+        """
+        Return the fault to inject in a response, if any.
+        """
+        with self._lock:
+            x = self._rng.random()
+        for fault, rate in [
+            ("reset", self.faults.reset_rate),
+            ("error", self.faults.error_rate),
+            ("truncate", self.faults.truncate_rate),
+        ]:
+            if x < rate:
+                return fault
+            x -= rate
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Snapshot the part of the Ubuntu archive that a chisel "
+        "release needs, and serve it locally."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    snapshot = subparsers.add_parser(
+        "snapshot", help="Snapshot the archive files needed by a release"
+    )
+    snapshot.add_argument("dir", help="Directory to write the snapshot to")
+    snapshot.add_argument(
+        "files",
+        metavar="file",
+        nargs="*",
+        help="Only snapshot the packages of these slice definition files and "
+        "of their essentials (default: the whole release)",
+    )
+    snapshot.add_argument("--release", required=True, help="chisel-releases directory")
+    snapshot.add_argument(
+        "--arch", required=True, help="Package architecture(s), comma-separated"
+    )
+    snapshot.add_argument(
+        "--archive-url",
+        default=None,
+        help="URL or local directory of the Ubuntu archive (mirror) to "
+        "snapshot (default: the archive used by chisel for --arch)",
+    )
+    snapshot.add_argument(
+        "--workers", type=int, default=8, help="Number of parallel downloads (default: 8)"
+    )
+    serve = subparsers.add_parser("serve", help="Serve a snapshot")
+    serve.add_argument("dir", help="Snapshot directory to serve")
+    serve.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="Port to listen on, 0 to pick a free one (default: 8080)",
+    )
+    serve.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds to wait before every response (default: 0)",
+    )
+    serve.add_argument(
+        "--bandwidth",
+        type=int,
+        default=0,
+        help="Bytes per second of every response, 0 for no limit (default: 0)",
+    )
+    serve.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the requests answered with a 503 error (default: 0)",
+    )
+    serve.add_argument(
+        "--reset-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the connections closed without a response (default: 0)",
+    )
+    serve.add_argument(
+        "--truncate-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the responses cut in the middle (default: 0)",
+    )
+    serve.add_argument(
+        "--seed", type=int, default=0, help="Seed of the fault injection (default: 0)"
+    )
+    cli_args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    if cli_args.command == "snapshot":
+        copied = snapshot_archive(
+            cli_args.dir,
+            cli_args.release,
+            cli_args.arch.split(","),
+            cli_args.files,
+            cli_args.archive_url,
+            cli_args.workers,
+        )
+        logging.info(
+            "Copied %.1f MB into %s (%.1f MB free)",
+            copied / 1e6,
+            cli_args.dir,
+            shutil.disk_usage(cli_args.dir).free / 1e6,
+        )
+        return
+
+    if not os.path.isdir(cli_args.dir):
+        logging.error("%s: not a directory", cli_args.dir)
+        sys.exit(1)
+    faults = Faults(
+        latency=cli_args.latency,
+        bandwidth=cli_args.bandwidth,
+        error_rate=cli_args.error_rate,
+        reset_rate=cli_args.reset_rate,
+        truncate_rate=cli_args.truncate_rate,
+        seed=cli_args.seed,
+    )
+    server = ArchiveServer(("127.0.0.1", cli_args.port), cli_args.dir, faults)
+    port = server.server_address[1]
+    logging.info("Serving %s on port %d", cli_args.dir, port)
+    logging.info("Point chisel and install_slices to it with:")
+    logging.info("  export http_proxy=http://127.0.0.1:%d", port)
+    # Report the stats when stopped by a signal as well.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logging.info(
+            "Served %d requests, %.1f MB: %d errors, %d resets, %d truncated, %d not found",
+            server.stats["requests"],
+            server.stats["bytes"] / 1e6,
+            server.stats["errors"],
+            server.stats["resets"],
+            server.stats["truncated"],
+            server.stats["not found"],
+        )
+
+
+if __name__ == "__main__":
+    main()
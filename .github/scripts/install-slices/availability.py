@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+
+"""
+Compute the availability matrix of the packages of a chisel release: the
+versions of each package in each suite of the archive, with the
+architectures they are built for. The matrix is computed once per release
+and shared by the install_slices jobs of its architectures, see
+install_slices --availability.
+
+The matrix is computed with rmadison, or from a package table built from
+the Packages indices of the archive or of a local mirror, see
+package_table.py.
+
+Usage
+-----
+availability table [-h] --release RELEASE [--arch ARCH]
+                   [--archive-url ARCHIVE_URL] [--output OUTPUT]
+availability compute [-h] --release RELEASE [--arch ARCH]
+                     [--packages-table PACKAGES_TABLE]
+                     [--output OUTPUT] [file ...]
+availability show [-h] matrix package [package ...]
+
+table:
+  --release RELEASE   chisel-releases branch name or directory
+  --arch ARCH         Architecture(s), comma-separated or repeated (default:
+                      all the architectures known to chisel)
+  --archive-url ARCHIVE_URL
+                      URL or local directory of the Ubuntu archive (mirror) to
+                      read the package indices from (default: the archive
+                      used by chisel for each architecture)
+  --output OUTPUT     Package table to write (default: packages.table)
+
+compute:
+  file                Slice definition files of the packages (default: all
+                      the packages of the release)
+  --release RELEASE   chisel-releases branch name or directory
+  --arch ARCH         Architecture(s), comma-separated or repeated (default:
+                      all the architectures known to chisel)
+  --packages-table PACKAGES_TABLE
+                      Package table to look the packages up in, instead of
+                      querying rmadison
+  --output OUTPUT     Matrix to write (default: availability.json)
+
+show:
+  matrix              Matrix written by availability compute
+  package             Packages to show
+"""
+
+import argparse
+import logging
+import sys
+
+from install_slices import (
+    CHISEL_ARCHES,
+    Availability,
+    parse_archive,
+    parse_package,
+    parse_release_packages,
+    query_availability,
+)
+from package_table import PackageTable, PackageTableError, build_package_table
+
+
+def compute_availability(
+    release: str, arches: list[str], files: list[str], table: PackageTable | None = None
+) -> Availability:
+    """
+    Compute the availability matrix of the packages of the slice definition
+    files, or of all the packages of the release, in one pass over the
+    archive, or from the package table if given.
+    """
+    archive = parse_archive(release)
+    packages = [parse_package(f) for f in files] if files else parse_release_packages(release)
+    names = sorted({p.package for p in packages})
+    if table is None:
+        return query_availability(names, archive, arches)
+    if table.release != f"ubuntu-{archive.version}" or not set(arches) <= set(table.arches):
+        raise PackageTableError(
+            f"{table.path} is for {', '.join(table.arches)} on {table.release}, "
+            f"not {', '.join(arches)} on ubuntu-{archive.version}"
+        )
+    return Availability.from_table(table, names, arches)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compute the availability matrix of the packages of a chisel release."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    table = subparsers.add_parser(
+        "table", help="Build the package table of the archive of a release"
+    )
+    table.add_argument(
+        "--release", required=True, help="chisel-releases branch name or directory"
+    )
+    table.add_argument(
+        "--arch",
+        action="append",
+        default=None,
+        help="Architecture(s), comma-separated or repeated (default: all the "
+        "architectures known to chisel)",
+    )
+    table.add_argument(
+        "--archive-url",
+        default=None,
+        help="URL or local directory of the Ubuntu archive (mirror) to read the "
+        "package indices from (default: the archive used by chisel for each "
+        "architecture)",
+    )
+    table.add_argument(
+        "--output",
+        default="packages.table",
+        help="Package table to write (default: %(default)s)",
+    )
+    compute = subparsers.add_parser(
+        "compute", help="Query the archive for the packages of a release"
+    )
+    compute.add_argument(
+        "--release", required=True, help="chisel-releases branch name or directory"
+    )
+    compute.add_argument(
+        "--arch",
+        action="append",
+        default=None,
+        help="Architecture(s), comma-separated or repeated (default: all the "
+        "architectures known to chisel)",
+    )
+    compute.add_argument(
+        "--packages-table",
+        default=None,
+        help="Package table to look the packages up in, instead of querying rmadison",
+    )
+    compute.add_argument(
+        "--output",
+        default="availability.json",
+        help="Matrix to write (default: %(default)s)",
+    )
+    compute.add_argument(
+        "files",
+        nargs="*",
+        help="Slice definition files of the packages (default: all the "
+        "packages of the release)",
+    )
+    show = subparsers.add_parser("show", help="Show the availability of packages")
+    show.add_argument("matrix", help="Matrix written by availability compute")
+    show.add_argument("package", nargs="+", help="Packages to show")
+    cli_args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    if cli_args.command == "table":
+        arches = [a for arg in cli_args.arch or CHISEL_ARCHES for a in arg.split(",")]
+        archive = parse_archive(cli_args.release)
+        count = build_package_table(
+            cli_args.output,
+            f"ubuntu-{archive.version}",
+            archive.suites,
+            archive.components,
+            arches,
+            cli_args.archive_url,
+        )
+        logging.info("%d packages written to %s", count, cli_args.output)
+        return
+
+    if cli_args.command == "compute":
+        arches = [a for arg in cli_args.arch or CHISEL_ARCHES for a in arg.split(",")]
+        try:
+            if cli_args.packages_table:
+                with PackageTable(cli_args.packages_table) as table:
+                    availability = compute_availability(
+                        cli_args.release, arches, cli_args.files, table
+                    )
+            else:
+                availability = compute_availability(cli_args.release, arches, cli_args.files)
+        except PackageTableError as e:
+            logging.error("%s", e)
+            sys.exit(1)
+        if not availability.packages:
+            logging.error("No packages to query in %s", cli_args.release)
+            sys.exit(1)
+        availability.save(cli_args.output)
+        logging.info(
+            "%d of %d packages are in %s, written to %s",
+            sum(1 for suites in availability.packages.values() if suites),
+            len(availability.packages),
+            availability.release,
+            cli_args.output,
+        )
+        return
+
+    availability = Availability.load(cli_args.matrix)
+    for pkg in cli_args.package:
+        if pkg not in availability.packages:
+            print(f"{pkg} | not queried")
+        elif not availability.packages[pkg]:
+            print(f"{pkg} | not in the archive")
+        for suite, versions in sorted(availability.packages.get(pkg, {}).items()):
+            for version, arches in sorted(versions.items()):
+                print(f"{pkg} | {version} | {suite} | {', '.join(arches)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+#!/usr/bin/python3
+
+"""
+Benchmark install_slices on synthetic releases, fully offline.
+
+The slices are cut by a stand-in chisel, which sleeps for a configurable
+time, fails with the errors that install_slices retries at a configurable
+rate and installs files of a configurable size, and rmadison is replaced by
+a stand-in that finds every package. The packages are served from a local
+mirror.
+
+Usage
+-----
+benchmark [-h] [--sizes SIZES] [--arch ARCH] [--latency LATENCY]
+          [--latency-per-slice LATENCY_PER_SLICE]
+          [--failure-rate FAILURE_RATE] [--output-size OUTPUT_SIZE]
+          [--seed SEED] [--output OUTPUT] [--verbose]
+          [install_slices options ...]
+
+options:
+  -h, --help          show this help message and exit
+  --sizes SIZES       Comma-separated numbers of slices of the synthetic
+                      releases (default: 100,1000)
+  --arch ARCH         Package architecture(s), comma-separated (default:
+                      amd64)
+  --latency LATENCY   Seconds each chisel cut takes (default: 0.01)
+  --latency-per-slice LATENCY_PER_SLICE
+                      Additional seconds per slice in a chisel cut (default:
+                      0.005)
+  --failure-rate FAILURE_RATE
+                      Fraction of the chisel cuts that fail with an error
+                      that is retried (default: 0.0)
+  --output-size OUTPUT_SIZE
+                      Bytes installed by chisel per slice (default: 4096)
+  --seed SEED         Seed of the synthetic releases and failures (default: 0)
+  --output OUTPUT     Write the results to this JSON file
+  --verbose           Show the logs of install_slices
+
+The other options are passed to install_slices, e.g. --workers or
+--batch-size.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import unittest.mock
+
+import install_slices
+
+
+# Both stand-ins run without the site packages, to start faster.
+FAKE_CHISEL = """\
+import os
+import random
+import sys
+import time
+
+env = os.environ
+args = sys.argv[2:]
+root, names = "", []
+while args:
+    arg = args.pop(0)
+    if arg in ("--arch", "--release", "--root"):
+        value = args.pop(0)
+        if arg == "--root":
+            root = value
+    elif not arg.startswith("--"):
+        names.append(arg)
+time.sleep(
+    float(env["BENCH_LATENCY"]) + float(env["BENCH_LATENCY_PER_SLICE"]) * len(names)
+)
+# Retries cut into the same root, where the attempts are counted so that
+# they do not all fail alike.
+attempts = os.path.join(root, ".bench-attempts")
+attempt = os.path.getsize(attempts) if os.path.exists(attempts) else 0
+random.seed(f"{env['BENCH_SEED']} {' '.join(names)} {attempt}")
+if random.random() < float(env["BENCH_FAILURE_RATE"]):
+    with open(attempts, "a") as f:
+        f.write(".")
+    errors = env["BENCH_RETRY_ERRORS"].split("\\n")
+    sys.stderr.write("error: " + random.choice(errors) + "\\n")
+    sys.exit(1)
+if attempt:
+    os.remove(attempts)
+for name in names:
+    # Install the copyright files of the slice and its essentials.
+    with open(os.path.join(env["BENCH_CLOSURES"], name)) as f:
+        pkgs = f.read().split()
+    for pkg in pkgs:
+        doc = os.path.join(root, "usr", "share", "doc", pkg)
+        os.makedirs(doc, exist_ok=True)
+        open(os.path.join(doc, "copyright"), "w").close()
+    lib = os.path.join(root, "usr", "lib")
+    os.makedirs(lib, exist_ok=True)
+    with open(os.path.join(lib, name), "wb") as f:
+        f.write(b"\\0" * int(env["BENCH_OUTPUT_SIZE"]))
+"""
+
+FAKE_RMADISON = """\
+import sys
+
+args = sys.argv[1:]
+options = {}
+while len(args) > 1:
+    arg = args.pop(0)
+    options[arg] = args.pop(0)
+arches = options.get("--architecture", "amd64").replace(",", ", ")
+suite = options.get("--suite", "jammy").split(",")[0]
+for pkg in args[0].split():
+    print(f"{pkg} | 1.0-1 | {suite} | {arches}")
+"""
+
+
+def write_release(release: str, n_slices: int, rng: random.Random) -> list[str]:
+    """
+    Write a synthetic release of n_slices slices in four-slice packages, each
+    slice having up to two essentials among the slices of the packages
+    before it. Return the slice definition files.
+    """
+    os.makedirs(os.path.join(release, "slices"))
+    with open(os.path.join(release, "chisel.yaml"), "w", encoding="utf-8") as f:
+        f.write(
+            "format: v1\n"
+            "archives:\n"
+            "  ubuntu:\n"
+            "    version: 22.04\n"
+            "    components: [main]\n"
+            "    suites: [jammy]\n"
+        )
+    files = []
+    names: list[str] = []
+    n_pkgs = (n_slices + 3) // 4
+    for i in range(n_pkgs):
+        pkg = f"pkg{i:05d}"
+        slices = [f"s{j}" for j in range(min(4, n_slices - 4 * i))]
+        lines = [f"package: {pkg}", "slices:"]
+        for slice in slices:
+            essentials = rng.sample(names, min(len(names), rng.randint(0, 2)))
+            lines.append(f"  {slice}: {{essential: [{', '.join(essentials)}]}}")
+        names += [f"{pkg}_{slice}" for slice in slices]
+        path = os.path.join(release, "slices", f"{pkg}.yaml")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        files.append(path)
+    return files
+
+
+def write_mirror(mirror: str, pkgs: list[str], arches: list[str]) -> None:
+    """
+    Write a local mirror with a small stand-in deb per package.
+    """
+    os.makedirs(os.path.join(mirror, "pool"))
+    stanzas = []
+    for pkg in pkgs:
+        content = f"!<arch>\n{pkg}\n".encode()
+        with open(os.path.join(mirror, "pool", f"{pkg}.deb"), "wb") as f:
+            f.write(content)
+        stanzas.append(
+            f"Package: {pkg}\n"
+            "Version: 1.0-1\n"
+            "Installed-Size: 4\n"
+            f"Filename: pool/{pkg}.deb\n"
+            f"Size: {len(content)}\n"
+            f"SHA256: {hashlib.sha256(content).hexdigest()}\n"
+        )
+    index = gzip.compress("\n".join(stanzas).encode())
+    for arch in arches:
+        path = os.path.join(mirror, "dists", "jammy", "main", f"binary-{arch}")
+        os.makedirs(path)
+        with open(os.path.join(path, "Packages.gz"), "wb") as f:
+            f.write(index)
+
+
+def write_tools(bindir: str) -> None:
+    """
+    Write the chisel and rmadison stand-ins.
+    """
+    os.makedirs(bindir)
+    for name, script in [("chisel", FAKE_CHISEL), ("rmadison", FAKE_RMADISON)]:
+        path = os.path.join(bindir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"#!{sys.executable} -S\n{script}")
+        os.chmod(path, 0o755)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Return the q-th percentile of values, by the nearest rank.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))]
+
+
+def run_benchmark(
+    n_slices: int,
+    arches: list[str],
+    latency: float = 0.01,
+    latency_per_slice: float = 0.005,
+    failure_rate: float = 0.0,
+    output_size: int = 4096,
+    seed: int = 0,
+    extra_args: list[str] | None = None,
+) -> dict[str, float | int]:
+    """
+    Run install_slices.main() over a synthetic release of n_slices slices,
+    and return its throughput, the latency percentiles of the slices and the
+    CPU time of the orchestrator, i.e. of this process, per slice.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        release = os.path.join(tmpdir, "release")
+        files = write_release(release, n_slices, rng)
+        packages = [install_slices.parse_package(f) for f in files]
+        write_mirror(os.path.join(tmpdir, "mirror"), [p.package for p in packages], arches)
+        write_tools(os.path.join(tmpdir, "bin"))
+        closures_dir = os.path.join(tmpdir, "closures")
+        os.makedirs(closures_dir)
+        for name, closure in install_slices.essential_closures(packages, arches[0]).items():
+            with open(os.path.join(closures_dir, name), "w", encoding="utf-8") as f:
+                f.write(" ".join(sorted({n.split("_", 1)[0] for n in closure})))
+        report = os.path.join(tmpdir, "report.json")
+        argv = [
+            "install_slices",
+            "--arch",
+            ",".join(arches),
+            "--release",
+            release + "/",
+            "--ensure-existence",
+            "--ignore-missing",
+            "--archive-url",
+            os.path.join(tmpdir, "mirror"),
+            "--cache-dir",
+            os.path.join(tmpdir, "cache"),
+            "--no-cache",
+            "--report",
+            report,
+            *(extra_args or []),
+            *files,
+        ]
+        env = {
+            "PATH": f"{tmpdir}/bin{os.pathsep}{os.environ.get('PATH', '')}",
+            "BENCH_LATENCY": str(latency),
+            "BENCH_LATENCY_PER_SLICE": str(latency_per_slice),
+            "BENCH_FAILURE_RATE": str(failure_rate),
+            "BENCH_OUTPUT_SIZE": str(output_size),
+            "BENCH_SEED": str(seed),
+            "BENCH_CLOSURES": closures_dir,
+            "BENCH_RETRY_ERRORS": "\n".join(install_slices._patterns_to_retry),
+        }
+        cwd = os.getcwd()
+        # install_slices creates its error.log in the working directory.
+        os.chdir(tmpdir)
+        try:
+            with unittest.mock.patch.object(
+                sys, "argv", argv
+            ), unittest.mock.patch.dict(os.environ, env):
+                children = resource.getrusage(resource.RUSAGE_CHILDREN)
+                cpu = time.process_time()
+                start = time.monotonic()
+                install_slices.main()
+                wall = time.monotonic() - start
+                cpu = time.process_time() - cpu
+                children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        finally:
+            os.chdir(cwd)
+        with open(report, encoding="utf-8") as f:
+            data = json.load(f)
+    latencies = [s for durations in data["durations"].values() for s in durations.values()]
+    statuses = [entry["status"] for entry in data["slices"]]
+    return {
+        "slices": len(statuses),
+        "failed": statuses.count("failed"),
+        "seconds": round(wall, 3),
+        "slices_per_second": round(len(statuses) / wall, 1),
+        "p50_seconds": round(percentile(latencies, 50), 3),
+        "p95_seconds": round(percentile(latencies, 95), 3),
+        "retries": data["retries"]["used"],
+        "orchestrator_cpu_seconds": round(cpu, 3),
+        "orchestrator_cpu_ms_per_slice": round(1000 * cpu / max(1, len(statuses)), 3),
+        "chisel_cpu_seconds": round(
+            children_after.ru_utime
+            + children_after.ru_stime
+            - children.ru_utime
+            - children.ru_stime,
+            3,
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark install_slices on synthetic releases, fully offline.",
+        epilog="The other options are passed to install_slices, e.g. --workers "
+        "or --batch-size.",
+    )
+    parser.add_argument(
+        "--sizes",
+        default="100,1000",
+        help="Comma-separated numbers of slices of the synthetic releases "
+        "(default: 100,1000)",
+    )
+    parser.add_argument(
+        "--arch",
+        default="amd64",
+        help="Package architecture(s), comma-separated (default: amd64)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.01,
+        help="Seconds each chisel cut takes (default: 0.01)",
+    )
+    parser.add_argument(
+        "--latency-per-slice",
+        type=float,
+        default=0.005,
+        help="Additional seconds per slice in a chisel cut (default: 0.005)",
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of the chisel cuts that fail with an error that is "
+        "retried (default: 0.0)",
+    )
+    parser.add_argument(
+        "--output-size",
+        type=int,
+        default=4096,
+        help="Bytes installed by chisel per slice (default: 4096)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the synthetic releases and failures (default: 0)",
+    )
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the logs of install_slices"
+    )
+    cli_args, extra_args = parser.parse_known_args()
+    # Configured before install_slices does, which keeps the benchmark quiet
+    # and leaves no error.log behind.
+    logging.basicConfig(
+        level=logging.INFO if cli_args.verbose else logging.CRITICAL,
+        format="%(levelname)s: %(message)s",
+    )
+
+    results = []
+    for size in (int(s) for s in cli_args.sizes.split(",")):
+        result = run_benchmark(
+            size,
+            cli_args.arch.split(","),
+            latency=cli_args.latency,
+            latency_per_slice=cli_args.latency_per_slice,
+            failure_rate=cli_args.failure_rate,
+            output_size=cli_args.output_size,
+            seed=cli_args.seed,
+            extra_args=extra_args,
+        )
+        results.append(result)
+        print(
+            "{slices:6d} slices: {slices_per_second:7.1f} slices/s, "
+            "p50 {p50_seconds:.3f}s, p95 {p95_seconds:.3f}s, "
+            "orchestrator CPU {orchestrator_cpu_ms_per_slice:.2f} ms/slice, "
+            "{failed} failed".format(**result),
+            flush=True,
+        )
+    if cli_args.output:
+        with open(cli_args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+"""
+Read the manifest that chisel generates in the installed root when one of
+the cut slices has a path with "generate: manifest": a zstd-compressed
+"jsonwall" file, with one JSON object per line after a header line. The
+objects describe the packages, slices and paths that were installed.
+"""
+
+import io
+import json
+import os
+
+import zstandard
+
+from typing import Iterator
+
+
+MANIFEST_NAME = "manifest.wall"
+
+
+class ManifestError(Exception):
+    """
+    The manifest cannot be read.
+    """
+
+
+def manifest_path(path: str) -> str:
+    """
+    Return the path of the manifest that chisel generates for the path of a
+    slice with "generate: manifest", such as /var/lib/chisel/**.
+    """
+    return path.rstrip("*").rstrip("/") + "/" + MANIFEST_NAME
+
+
+def iter_manifest(path: str | os.PathLike) -> Iterator[dict]:
+    """
+    Yield the objects of the manifest at path, streaming. Raise
+    ManifestError if it is not a chisel manifest.
+    """
+    try:
+        with open(path, "rb") as f, zstandard.ZstdDecompressor().stream_reader(
+            f, read_across_frames=True
+        ) as reader:
+            lines = io.TextIOWrapper(reader, encoding="utf-8")
+            header = json.loads(next(lines, "null"))
+            if not isinstance(header, dict) or "jsonwall" not in header:
+                raise ManifestError(f"{path} is not a jsonwall file")
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+    except (OSError, ValueError, zstandard.ZstdError) as e:
+        raise ManifestError(f"cannot read {path}: {e}") from e
@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+
+"""
+Read the control fields and the file list of a deb, streaming, without
+python-apt: the ar container is walked member by member and only the tar
+headers of the data tarball are decoded, the file bodies are skipped.
+"""
+
+import contextlib
+import gzip
+import lzma
+import os
+import tarfile
+
+import zstandard
+
+from typing import BinaryIO, Iterator
+
+
+AR_MAGIC = b"!<arch>\n"
+AR_HEADER_SIZE = 60
+# Skipping the bodies in large reads keeps the decompression in C.
+SKIP_SIZE = 1 << 16
+
+
+class DebError(Exception):
+    """
+    The file is not a deb, or is corrupted.
+    """
+
+
+class _MemberReader:
+    """
+    Read at most size bytes from f, the data of an ar member.
+    """
+
+    def __init__(self, f: BinaryIO, size: int):
+        self.f = f
+        self.remaining = size
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+
+def iter_ar_members(f: BinaryIO) -> Iterator[tuple[str, int]]:
+    """
+    Yield the name and size of each member of the ar archive f, with f
+    positioned at the start of the member data.
+    """
+    if f.read(len(AR_MAGIC)) != AR_MAGIC:
+        raise DebError("not an ar archive")
+    offset = len(AR_MAGIC)
+    while True:
+        f.seek(offset)
+        header = f.read(AR_HEADER_SIZE)
+        if not header:
+            return
+        if len(header) != AR_HEADER_SIZE or header[58:60] != b"`\n":
+            raise DebError("truncated ar member header")
+        name = header[:16].decode("ascii", errors="replace").rstrip().rstrip("/")
+        try:
+            size = int(header[48:58])
+        except ValueError as e:
+            raise DebError(f"invalid size of ar member {name}") from e
+        yield name, size
+        # The members are aligned on 2 bytes.
+        offset += AR_HEADER_SIZE + size + size % 2
+
+
+@contextlib.contextmanager
+def open_member(path: str | os.PathLike, prefix: str) -> Iterator[BinaryIO]:
+    """
+    Open the first member of the deb at path whose name starts with prefix,
+    such as "data.tar", and yield a stream of its decompressed content.
+    """
+    with open(path, "rb") as f:
+        for name, size in iter_ar_members(f):
+            if name.startswith(prefix):
+                break
+        else:
+            raise DebError(f"no {prefix} member")
+        raw = _MemberReader(f, size)
+        compression = name[len(prefix) :]
+        if compression == "":
+            yield raw
+        elif compression == ".gz":
+            with gzip.GzipFile(fileobj=raw, mode="rb") as stream:
+                yield stream
+        elif compression == ".xz":
+            with lzma.LZMAFile(raw) as stream:
+                yield stream
+        elif compression == ".zst":
+            decompressor = zstandard.ZstdDecompressor()
+            with decompressor.stream_reader(raw, read_across_frames=True) as stream:
+                yield stream
+        else:
+            raise DebError(f"unsupported compression of {name}")
+
+
+@contextlib.contextmanager
+def _reading(path: str | os.PathLike) -> Iterator[None]:
+    """
+    Turn the errors of a corrupted deb into DebError.
+    """
+    try:
+        yield
+    except (lzma.LZMAError, zstandard.ZstdError, EOFError, OSError) as e:
+        raise DebError(f"cannot read {path}: {e}") from e
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    # The zstandard readers may return less than asked for.
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _skip(stream: BinaryIO, size: int) -> None:
+    while size > 0:
+        chunk = stream.read(min(size, SKIP_SIZE))
+        if not chunk:
+            raise DebError("truncated tar stream")
+        size -= len(chunk)
+
+
+def _parse_header(block: bytes) -> tuple[str, int, bytes]:
+    """
+    Return the name, size and type of a tar header block. Only these fields
+    are decoded, which is much cheaper than tarfile.TarInfo.frombuf().
+    """
+    name = block[:100].split(b"\0", 1)[0]
+    if block[257:263] == b"ustar\0" and block[345] != 0:
+        name = block[345:500].split(b"\0", 1)[0] + b"/" + name
+    size_field = block[124:136]
+    if size_field[0] & 0x80:
+        # GNU base-256 encoding of large sizes.
+        size = int.from_bytes(size_field[1:], "big")
+    else:
+        try:
+            size = int(size_field.split(b"\0", 1)[0].strip() or b"0", 8)
+        except ValueError as e:
+            raise DebError("invalid tar header") from e
+    return name.decode("utf-8", "surrogateescape"), size, block[156:157]
+
+
+def _iter_tar(stream: BinaryIO) -> Iterator[tuple[str, int, BinaryIO]]:
+    """
+    Yield the normalized path and size of each entry of a tar stream, with
+    a reader of its body, which is skipped if it is not read.
+
+    Unlike tarfile in "r|" mode, which reads the stream in small blocks and
+    decodes every field of the headers, the bodies are skipped in large
+    reads and only the names and sizes are decoded. The GNU long names and
+    the pax paths, which dpkg-deb uses for long paths, are supported.
+    """
+    long_name = None
+    while True:
+        block = _read_exactly(stream, tarfile.BLOCKSIZE)
+        if block == tarfile.NUL * tarfile.BLOCKSIZE:
+            return
+        if len(block) < tarfile.BLOCKSIZE:
+            raise DebError("truncated tar stream")
+        name, size, kind = _parse_header(block)
+        padded = -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        if kind in (tarfile.GNUTYPE_LONGNAME, tarfile.XHDTYPE):
+            body = _read_exactly(stream, padded)
+            if len(body) < padded:
+                raise DebError("truncated tar stream")
+            body = body[:size]
+            if kind == tarfile.GNUTYPE_LONGNAME:
+                long_name = body.rstrip(b"\0").decode("utf-8", "surrogateescape")
+            else:
+                for record in body.split(b"\n"):
+                    _, _, keyword = record.partition(b" ")
+                    if keyword.startswith(b"path="):
+                        long_name = keyword[5:].decode("utf-8", "surrogateescape")
+            continue
+        if long_name is not None:
+            name, long_name = long_name, None
+        name = name.removeprefix("./").rstrip("/")
+        body = _MemberReader(stream, size)
+        if name and name != ".":
+            yield name, size, body
+        _skip(stream, body.remaining + padded - size)
+
+
+def read_control(path: str | os.PathLike) -> dict[str, str]:
+    """
+    Return the fields of the control file of the deb at path.
+    """
+    with _reading(path), open_member(path, "control.tar") as stream:
+        for name, size, body in _iter_tar(stream):
+            if name == "control":
+                text = _read_exactly(body, size).decode("utf-8", errors="replace")
+                break
+        else:
+            raise DebError(f"no control file in {path}")
+    fields: dict[str, str] = {}
+    key = None
+    for line in text.splitlines():
+        if line[:1] in (" ", "\t") and key:
+            fields[key] += "\n" + line.strip()
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            fields[key] = value.strip()
+    return fields
+
+
+def iter_data_files(path: str | os.PathLike) -> Iterator[str]:
+    """
+    Yield the paths of the deb at path, relative to the root, in the order
+    of its data tarball.
+    """
+    with _reading(path), open_member(path, "data.tar") as stream:
+        for name, _, _ in _iter_tar(stream):
+            yield name
+
+
+def deb_has_file(path: str | os.PathLike, wanted: str) -> bool:
+    """
+    Return True if the deb at path contains wanted, a path relative to the
+    root. Stop reading at the first match.
+    """
+    wanted = wanted.lstrip("/")
+    return any(name == wanted for name in iter_data_files(path))
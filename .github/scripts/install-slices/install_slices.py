@@ -6,36 +6,172 @@ Verify chisel slice definition files by installing the slices.
 Usage
 -----
 install_slices [-h] --arch ARCH --release RELEASE [--dry-run]
-               [--ensure-existence] [--ignore-missing] [file ...]
+               [--ensure-existence] [--ignore-missing]
+               [--availability AVAILABILITY]
+               [--packages-table PACKAGES_TABLE]
+               [--chisel-version CHISEL_VERSION]
+               [--chisel VERSION=PATH] [--since SINCE] [--with-dependents]
+               [--workers WORKERS] [--min-workers MIN_WORKERS]
+               [--max-workers MAX_WORKERS]
+               [--batch-size BATCH_SIZE] [--co-installable]
+               [--affinity {package,essentials}] [--order {lpt,given}]
+               [--history HISTORY] [--prefetch-workers PREFETCH_WORKERS]
+               [--archive-url ARCHIVE_URL] [--retry-budget RETRY_BUDGET]
+               [--retry-delay RETRY_DELAY]
+               [--plan PLAN] [--report REPORT] [--cache-dir CACHE_DIR]
+               [--result-cache RESULT_CACHE]
+               [--result-cache-size RESULT_CACHE_SIZE] [--no-cache]
+               [--no-preflight] [--manifest-slice MANIFEST_SLICE]
+               [--manifest-cut] [--trace TRACE] [--timings TIMINGS]
+               [file ...]
 
 positional arguments:
   file                Chisel slice definition file(s)
 
 options:
   -h, --help          show this help message and exit
-  --arch ARCH         Package architecture
+  --arch ARCH         Package architecture(s), comma-separated or repeated, to
+                      install the slices on in a single run
   --release RELEASE   chisel-releases branch name or directory
   --dry-run           Perform dry run: do not actually install the slices
   --ensure-existence  Each package must exist in the archive for at least one architecture
   --ignore-missing    Ignore arch-specific package not found in archive errors
+  --availability AVAILABILITY
+                      Availability matrix of the packages, written by
+                      availability.py, to check the existence of the
+                      packages instead of querying the archive
+  --packages-table PACKAGES_TABLE
+                      Package table of the archive, written by
+                      availability.py table, to check the existence of the
+                      packages instead of querying the archive
+  --chisel-version CHISEL_VERSION
+                      Version of chisel being used (default: unknown)
+  --chisel VERSION=PATH
+                      chisel binary of the given version. If repeated, every
+                      slice is cut with each binary and the installed trees
+                      are compared (default: chisel from PATH, of
+                      --chisel-version)
+  --since SINCE       Also install the slice definition files of the release
+                      that changed since this git revision
+  --with-dependents   Also install the slices of the release that have one of
+                      the changed slices among their essentials
+  --workers WORKERS   Number of workers to start the parallel installation with
+                      (default: 5)
+  --min-workers MIN_WORKERS
+                      Minimum number of workers when adapting to the archive
+                      and CPU load (default: 1)
+  --max-workers MAX_WORKERS
+                      Maximum number of workers when adapting to the archive
+                      and CPU load (default: the larger of --workers and the
+                      number of CPUs)
+  --batch-size BATCH_SIZE
+                      Maximum number of slices to install with a single chisel
+                      cut, reduced as failures show up (default: 1)
+  --co-installable    Check that all the slices can be installed together
+  --affinity {package,essentials}
+                      Install slices of the same package (and, with
+                      essentials, of packages sharing essentials) back to
+                      back (default: package)
+  --order {lpt,given}
+                      Install the longest slices first, estimated from the
+                      package sizes in the archive or from --history (lpt), or
+                      follow the order of the files (given) (default: lpt)
+  --history HISTORY   Report of a previous run, to estimate how long each cut
+                      takes
+  --prefetch-workers PREFETCH_WORKERS
+                      Number of parallel downloads of the packages ahead of
+                      the cuts, 0 to let chisel download them (default: 8)
+  --archive-url ARCHIVE_URL
+                      URL or local directory of the Ubuntu archive (mirror) to
+                      read the package indices and packages from (default:
+                      the archive used by chisel for --arch)
+  --retry-budget RETRY_BUDGET
+                      Maximum number of cuts retried after archive errors in
+                      the whole run (default: 100)
+  --retry-delay RETRY_DELAY
+                      Base delay in seconds of the exponential backoff
+                      between the attempts of a cut, 0 to retry at once
+                      (default: 1.0)
+  --plan PLAN         Write the execution plan to this JSON file: the cuts, the
+                      packages to download and their sizes, the expected cache
+                      hits and the estimated duration (from --history). Use
+                      with --dry-run to only plan the run
+  --report REPORT     Write which cut installed each slice to this JSON file,
+                      with the time and resources each slice took
+  --cache-dir CACHE_DIR
+                      Chisel download cache shared by all workers
+                      (default: a temporary directory for this run)
+  --result-cache RESULT_CACHE
+                      Directory of the results of previous runs, to skip the
+                      slices whose definitions, essentials and packages did
+                      not change since they passed (default:
+                      $XDG_CACHE_HOME/chisel-releases/install-slices)
+  --result-cache-size RESULT_CACHE_SIZE
+                      Maximum number of results to keep in --result-cache
+                      (default: 100000)
+  --no-cache          Install all the slices, even those that passed before
+  --no-preflight      Cut the slices even if the static checks of the slice
+                      definitions find that they cannot be installed
+  --manifest-slice MANIFEST_SLICE
+                      Slice that generates chisel's manifest, which checks the
+                      cuts that install it, or "none" (default: the slice of
+                      the release that generates it, if any)
+  --manifest-cut      Also check the cuts that do not install the manifest
+                      slice, by cutting them again along with it
+  --trace TRACE       Write a trace of the run, which opens in Perfetto, to
+                      this JSON file
+  --timings TIMINGS   Append the timings of the slices to this SQLite
+                      database, keyed by the commit of the release, the
+                      architecture and the chisel version. See timing_db.py
+                      to compare them to previous runs
 """
 
 import argparse
+import asyncio
+import bisect
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import hashlib
+import heapq
+import itertools
+import json
 import logging
 import math
 import os
 import pathlib
+import random
+import resource
+import re
+import shutil
+import sqlite3
+import stat
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+import weakref
 
-import magic
 import requests
 import yaml
 
-from apt.debfile import DebPackage
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from dataclasses import dataclass
+from archive_index import (
+    PackageInfo,
+    archive_url,
+    compare_versions,
+    download_package,
+    fetch_packages_index,
+)
+from chisel_manifest import ManifestError, iter_manifest, manifest_path
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from deb_reader import DebError, deb_has_file, read_control
+from package_table import PackageTable, PackageTableError
+from timing_db import SliceTiming, record_run
+from typing import AsyncIterator, Awaitable, Callable, Iterator
 
 
 
@@ -46,6 +182,101 @@ class MissingCopyright(Exception):
     pass
 
 
+# Name of the worker that the current task or thread runs for, in traces.
+_trace_worker: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "trace_worker", default="main"
+)
+
+
+class Tracer:
+    """
+    Record spans in the Chrome trace event format, which Perfetto and
+    chrome://tracing open directly. Every worker shows up as a thread.
+    Recording is a no-op until enabled.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.events: list[dict] = []
+        self._tids: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def _now(self) -> float:
+        return round((time.perf_counter() - self._start) * 1e6, 1)
+
+    def _tid(self) -> int:
+        worker = _trace_worker.get()
+        with self._lock:
+            if worker not in self._tids:
+                self._tids[worker] = len(self._tids) + 1
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": os.getpid(),
+                        "tid": self._tids[worker],
+                        "args": {"name": worker},
+                    }
+                )
+            return self._tids[worker]
+
+    @contextlib.contextmanager
+    def span(self, name: str, cat: str, **args) -> Iterator[dict]:
+        """
+        Record the time spent in the block. The block can add to the
+        arguments of the span through the yielded dict.
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = self._now()
+        try:
+            yield args
+        finally:
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": cat,
+                    "ph": "X",
+                    "ts": start,
+                    "dur": round(self._now() - start, 1),
+                    "pid": os.getpid(),
+                    "tid": self._tid(),
+                    "args": args,
+                }
+            )
+
+    def instant(self, name: str, cat: str, **args) -> None:
+        """
+        Record an event without duration.
+        """
+        if not self.enabled:
+            return
+        self.events.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "i",
+                "s": "t",
+                "ts": self._now(),
+                "pid": os.getpid(),
+                "tid": self._tid(),
+                "args": args,
+            }
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Write the recorded events to path.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+TRACER = Tracer()
+
+
 def configure_logging() -> None:
     """
     Configure the logging options for this script.
@@ -67,6 +298,16 @@ def configure_logging() -> None:
     logging.basicConfig(level=logging.INFO, handlers=[console_handler, file_handler])
 
 
+def _chisel_binary(value: str) -> tuple[str, str]:
+    """
+    Parse a VERSION=PATH chisel binary argument.
+    """
+    version, sep, path = value.partition("=")
+    if not sep or not version or not path:
+        raise argparse.ArgumentTypeError(f"expected VERSION=PATH, got {value!r}")
+    return version, path
+
+
 def parse_args() -> argparse.Namespace:
     """
     Parse CLI args passed to this script.
@@ -77,7 +318,10 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--arch",
         required=True,
-        help="Package architecture",
+        action="extend",
+        type=lambda value: [arch for arch in value.split(",") if arch],
+        help="Package architecture(s), comma-separated or repeated, to install "
+        "the slices on in a single run",
     )
     parser.add_argument(
         "--release",
@@ -102,24 +346,233 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Ignore arch-specific package not found in archive errors",
     )
+    parser.add_argument(
+        "--availability",
+        required=False,
+        default=None,
+        help="Availability matrix of the packages, written by availability.py, "
+        "to check the existence of the packages instead of querying the archive",
+    )
+    parser.add_argument(
+        "--packages-table",
+        required=False,
+        default=None,
+        help="Package table of the archive, written by availability.py table, "
+        "to check the existence of the packages instead of querying the archive",
+    )
     parser.add_argument(
         "--chisel-version",
         required=False,
         default="unknown",
         help="Version of chisel being used (default: unknown)",
     )
+    parser.add_argument(
+        "--chisel",
+        metavar="VERSION=PATH",
+        type=_chisel_binary,
+        action="append",
+        default=[],
+        help="chisel binary of the given version. If repeated, every slice "
+        "is cut with each binary and the installed trees are compared "
+        "(default: chisel from PATH, of --chisel-version)",
+    )
     parser.add_argument(
         "files",
         metavar="file",
         help="Chisel slice definition file(s)",
         nargs="*",
     )
+    parser.add_argument(
+        "--since",
+        required=False,
+        default=None,
+        help="Also install the slice definition files of the release that "
+        "changed since this git revision",
+    )
+    parser.add_argument(
+        "--with-dependents",
+        action="store_true",
+        required=False,
+        help="Also install the slices of the release that have one of the "
+        "changed slices among their essentials",
+    )
     parser.add_argument(
         "--workers",
         required=False,
         default=5,
         type=int,
-        help="Number of workers to use for parallel installation (default: 5)",
+        help="Number of workers to start the parallel installation with "
+        "(default: 5)",
+    )
+    parser.add_argument(
+        "--min-workers",
+        required=False,
+        default=1,
+        type=int,
+        help="Minimum number of workers when adapting to the archive and "
+        "CPU load (default: 1)",
+    )
+    parser.add_argument(
+        "--max-workers",
+        required=False,
+        default=None,
+        type=int,
+        help="Maximum number of workers when adapting to the archive and "
+        "CPU load (default: the larger of --workers and the number of CPUs)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        required=False,
+        default=1,
+        type=int,
+        help="Maximum number of slices to install with a single chisel cut, "
+        "reduced as failures show up (default: 1)",
+    )
+    parser.add_argument(
+        "--co-installable",
+        required=False,
+        action="store_true",
+        help="Check that all the slices can be installed together",
+    )
+    parser.add_argument(
+        "--affinity",
+        required=False,
+        default="package",
+        choices=["package", "essentials"],
+        help="Install slices of the same package (and, with essentials, of "
+        "packages sharing essentials) back to back (default: package)",
+    )
+    parser.add_argument(
+        "--order",
+        required=False,
+        default="lpt",
+        choices=["lpt", "given"],
+        help="Install the longest slices first, estimated from the package "
+        "sizes in the archive or from --history (lpt), or follow the order "
+        "of the files (given) (default: lpt)",
+    )
+    parser.add_argument(
+        "--history",
+        required=False,
+        default=None,
+        help="Report of a previous run, to estimate how long each cut takes",
+    )
+    parser.add_argument(
+        "--prefetch-workers",
+        required=False,
+        default=8,
+        type=int,
+        help="Number of parallel downloads of the packages ahead of the "
+        "cuts, 0 to let chisel download them (default: 8)",
+    )
+    parser.add_argument(
+        "--archive-url",
+        required=False,
+        default=None,
+        help="URL or local directory of the Ubuntu archive (mirror) to read "
+        "the package indices and packages from (default: the archive used "
+        "by chisel for --arch)",
+    )
+    parser.add_argument(
+        "--retry-budget",
+        required=False,
+        default=100,
+        type=int,
+        help="Maximum number of cuts retried after archive errors in the "
+        "whole run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--retry-delay",
+        required=False,
+        default=1.0,
+        type=float,
+        help="Base delay in seconds of the exponential backoff between the "
+        "attempts of a cut, 0 to retry at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--plan",
+        required=False,
+        default=None,
+        help="Write the execution plan to this JSON file: the cuts, the "
+        "packages to download and their sizes, the expected cache hits and "
+        "the estimated duration (from --history). Use with --dry-run to only "
+        "plan the run",
+    )
+    parser.add_argument(
+        "--report",
+        required=False,
+        default=None,
+        help="Write which cut installed each slice to this JSON file, with the "
+        "time and resources each slice took",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        required=False,
+        default=None,
+        help="Chisel download cache shared by all workers "
+        "(default: a temporary directory for this run)",
+    )
+    parser.add_argument(
+        "--result-cache",
+        required=False,
+        default=os.path.join(
+            os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+            "chisel-releases",
+            "install-slices",
+        ),
+        help="Directory of the results of previous runs, to skip the slices "
+        "whose definitions, essentials and packages did not change since "
+        "they passed (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--result-cache-size",
+        type=int,
+        required=False,
+        default=100000,
+        help="Maximum number of results to keep in --result-cache "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        required=False,
+        help="Install all the slices, even those that passed before",
+    )
+    parser.add_argument(
+        "--no-preflight",
+        action="store_true",
+        required=False,
+        help="Cut the slices even if the static checks of the slice "
+        "definitions find that they cannot be installed",
+    )
+    parser.add_argument(
+        "--manifest-slice",
+        required=False,
+        default=None,
+        help="Slice that generates chisel's manifest, which checks the cuts that "
+        "install it, or \"none\" (default: the slice of the release that "
+        "generates it, if any)",
+    )
+    parser.add_argument(
+        "--manifest-cut",
+        action="store_true",
+        required=False,
+        help="Also check the cuts that do not install the manifest slice, by "
+        "cutting them again along with it",
+    )
+    parser.add_argument(
+        "--trace",
+        required=False,
+        default=None,
+        help="Write a trace of the run, which opens in Perfetto, to this JSON file",
+    )
+    parser.add_argument(
+        "--timings",
+        required=False,
+        default=None,
+        help="Append the timings of the slices to this SQLite database, keyed "
+        "by the commit of the release, the architecture and the chisel "
+        "version. See timing_db.py to compare them to previous runs",
     )
     return parser.parse_args()
 
@@ -173,6 +626,66 @@ def parse_archive(release: str) -> Archive:
     return archive
 
 
+# Architectures known to chisel.
+CHISEL_ARCHES = ["amd64", "arm64", "armhf", "i386", "ppc64el", "riscv64", "s390x"]
+
+
+@dataclass
+class PathInfo:
+    """
+    Minimal data class replicating a path in the contents of a slice in
+    chisel.
+    """
+
+    # One of copy, glob, text, symlink, dir and generate.
+    kind: str
+    # Source of a copy, content of a text, target of a symlink.
+    info: str = ""
+    mode: int = 0
+    mutable: bool = False
+    # Architectures the path is installed on, all of them if empty.
+    arches: list[str] = field(default_factory=list)
+    # Package whose version of the path is installed when slices of several
+    # packages list it.
+    prefer: str = ""
+
+    def same_content(self, other: "PathInfo") -> bool:
+        """
+        Return whether both paths install the same content, in which case
+        different slices can list them, as long as they are not copied.
+        """
+        return (self.kind, self.info, self.mode, self.mutable) == (
+            other.kind,
+            other.info,
+            other.mode,
+            other.mutable,
+        )
+
+
+def parse_path_info(path: str, options: dict | None) -> PathInfo:
+    """
+    Parse a path of the contents of a slice definition file, as chisel does.
+    """
+    options = options or {}
+    arches = options.get("arch", [])
+    info = PathInfo("copy", "", options.get("mode") or 0, bool(options.get("mutable")))
+    info.arches = [arches] if isinstance(arches, str) else list(arches)
+    info.prefer = str(options.get("prefer") or "")
+    if options.get("generate"):
+        info.kind, info.info = "generate", str(options["generate"])
+    elif "text" in options:
+        info.kind, info.info = "text", str(options["text"])
+    elif options.get("make"):
+        info.kind = "dir"
+    elif "symlink" in options:
+        info.kind, info.info = "symlink", str(options["symlink"])
+    elif "copy" in options:
+        info.info = str(options["copy"])
+    elif any(c in path for c in "*?"):
+        info.kind = "glob"
+    return info
+
+
 @dataclass
 class Package:
     """
@@ -181,6 +694,19 @@ class Package:
 
     package: str
     slices: list[str]
+    # Essentials of each slice, as {slice: {essential: [arch, ...]}}. An
+    # empty list of architectures means the essential applies to all of them.
+    essentials: dict[str, dict[str, list[str]]] = field(default_factory=dict)
+    # sha256 digest of the slice definition file.
+    digest: str = field(default="", compare=False)
+    # Paths of each slice, as {slice: {path: PathInfo}}.
+    contents: dict[str, dict[str, PathInfo]] = field(default_factory=dict, compare=False)
+
+
+# Entry of an installation plan: (pkg, slice, covered slices).
+PlanEntry = tuple[str, str, list[str]]
+# Group of planned entries to install on an architecture: (arch, entries).
+WorkItem = tuple[str, list[PlanEntry]]
 
 
 def full_slice_name(pkg: str, slice: str) -> str:
@@ -190,28 +716,504 @@ def full_slice_name(pkg: str, slice: str) -> str:
     return f"{pkg}_{slice}"
 
 
+def _parse_essentials(essentials: list | dict | None) -> dict[str, list[str]]:
+    """
+    Parse an "essential" entry of a slice definition file. It can either be a
+    list of slice names, or a map of slice names to their options:
+        essential:
+            - libc6_libs
+        essential:
+            libc6_libs:
+            libfoo_libs: {arch: [amd64, arm64]}
+    """
+    if not essentials:
+        return {}
+    if isinstance(essentials, list):
+        return {name: [] for name in essentials}
+    parsed = {}
+    for name, options in essentials.items():
+        arch = (options or {}).get("arch", [])
+        parsed[name] = [arch] if isinstance(arch, str) else list(arch)
+    return parsed
+
+
 def parse_package(filepath: str) -> Package:
     """
     Parse a slice definition file and return the Package.
     """
     logging.debug("Parsing %s...", filepath)
-    with open(filepath, "r", encoding="utf-8") as stream:
-        try:
-            data = yaml.safe_load(stream)
-        except yaml.YAMLError as e:
-            logging.error("%s: %s", filepath, e)
-            sys.exit(1)
+    with open(filepath, "rb") as stream:
+        content = stream.read()
+    try:
+        data = yaml.safe_load(content)
+    except yaml.YAMLError as e:
+        logging.error("%s: %s", filepath, e)
+        sys.exit(1)
     try:
         package = data["package"]
         slices = list(data["slices"].keys())
         slices = sorted(slices)
+        # Package-level essentials apply to all the slices of the package.
+        pkg_essentials = _parse_essentials(data.get("essential"))
+        essentials = {}
+        contents = {}
+        for slice in slices:
+            slice_essentials = {
+                name: arch
+                for name, arch in pkg_essentials.items()
+                if name != full_slice_name(package, slice)
+            }
+            slice_data = data["slices"][slice] or {}
+            slice_essentials.update(_parse_essentials(slice_data.get("essential")))
+            if slice_essentials:
+                essentials[slice] = slice_essentials
+            contents[slice] = {
+                path: parse_path_info(path, options)
+                for path, options in (slice_data.get("contents") or {}).items()
+            }
     except KeyError as e:
         logging.error("%s: key %s not found", filepath, e)
         sys.exit(1)
-    pkg = Package(package, slices)
+    pkg = Package(
+        package, slices, essentials, hashlib.sha256(content).hexdigest(), contents
+    )
     return pkg
 
 
+def parse_release_packages(release: str) -> list[Package]:
+    """
+    Parse all the slice definition files of a local release. Return an empty
+    list if the release is not a local directory.
+    """
+    slices_dir = pathlib.Path(release, "slices")
+    if "/" not in release or not slices_dir.is_dir():
+        return []
+    logging.info("Parsing slice definition files in %s...", slices_dir)
+    return [parse_package(str(f)) for f in sorted(slices_dir.glob("**/*.yaml"))]
+
+
+def essential_closures(packages: list[Package], arch: str) -> dict[str, set[str]]:
+    """
+    Return, for every slice of the packages, the set of slices that chisel
+    installs when cutting it on arch: the slice itself and its transitive
+    essentials.
+    """
+    essentials: dict[str, list[str]] = {}
+    for pkg in packages:
+        for slice in pkg.slices:
+            essentials[full_slice_name(pkg.package, slice)] = [
+                name
+                for name, arches in pkg.essentials.get(slice, {}).items()
+                if not arches or arch in arches
+            ]
+    closures = {}
+    for name in essentials:
+        closure = {name}
+        stack = [name]
+        while stack:
+            for essential in essentials.get(stack.pop(), []):
+                if essential not in closure:
+                    closure.add(essential)
+                    stack.append(essential)
+        closures[name] = closure
+    return closures
+
+
+def changed_slice_definitions(release: str, rev: str) -> tuple[list[str], set[str]]:
+    """
+    Return the slice definition files of the local release that changed since
+    the git revision rev, and the packages whose files were deleted since.
+    """
+    try:
+        output = subprocess.run(
+            ["git", "-C", release, "diff", "--name-status", "--no-renames",
+             "--relative", rev, "--", "slices"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+    except subprocess.CalledProcessError as e:
+        logging.error("Cannot list the changes since %s: %s", rev, e.stderr.strip())
+        sys.exit(1)
+    files = []
+    deleted = set()
+    for line in output.splitlines():
+        status, path = line.split("\t", 1)
+        if not path.endswith(".yaml"):
+            continue
+        if status == "D":
+            # Slice definition files are named after their package.
+            deleted.add(pathlib.Path(path).stem)
+        else:
+            files.append(os.path.join(release, path))
+    return sorted(files), deleted
+
+
+def release_commit(release: str) -> str:
+    """
+    Return the git commit checked out in the local release, or an empty
+    string if release is not a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "-C", release, "rev-parse", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def reverse_essentials(closures: dict[str, set[str]]) -> dict[str, set[str]]:
+    """
+    Return, for every package, the slices that install one of its slices,
+    either directly or as a transitive essential.
+    """
+    dependents: dict[str, set[str]] = collections.defaultdict(set)
+    for name, closure in closures.items():
+        for essential in closure:
+            dependents[essential.split("_", 1)[0]].add(name)
+    return dependents
+
+
+def impacted_slices(changed: set[str], closures: dict[str, set[str]]) -> set[str]:
+    """
+    Return the slices that need to be installed again when the slice
+    definitions of the changed packages change: the slices of these packages
+    and all the slices that have one of them among their essentials.
+    """
+    dependents = reverse_essentials(closures)
+    return set().union(*(dependents.get(pkg, set()) for pkg in changed))
+
+
+def _glob_tokens(glob: str) -> list[str]:
+    """
+    Split a chisel glob into characters and the "?", "*" and "**" wildcards.
+    """
+    tokens = []
+    i = 0
+    while i < len(glob):
+        if glob.startswith("**", i):
+            tokens.append("**")
+            i += 2
+        else:
+            tokens.append(glob[i])
+            i += 1
+    return tokens
+
+
+def globs_overlap(a: str, b: str) -> bool:
+    """
+    Return whether some path matches both chisel globs, where "?" matches a
+    character other than "/", "*" any number of them and "**" any number of
+    characters. Plain paths are globs matching themselves.
+    """
+    ta, tb = _glob_tokens(a), _glob_tokens(b)
+
+    def chars(token: str) -> str:
+        # A single character, "any" or "any but /".
+        if token == "**":
+            return "any"
+        if token in ("*", "?"):
+            return "not /"
+        return token
+
+    def intersect(x: str, y: str) -> bool:
+        if x == "any" or y == "any":
+            return True
+        if x == "not /":
+            return y != "/"
+        if y == "not /":
+            return x != "/"
+        return x == y
+
+    @functools.lru_cache(maxsize=None)
+    def overlap(i: int, j: int) -> bool:
+        if i == len(ta) and j == len(tb):
+            return True
+        # Wildcards can match nothing.
+        if i < len(ta) and ta[i] in ("*", "**") and overlap(i + 1, j):
+            return True
+        if j < len(tb) and tb[j] in ("*", "**") and overlap(i, j + 1):
+            return True
+        if i == len(ta) or j == len(tb) or not intersect(chars(ta[i]), chars(tb[j])):
+            return False
+        # Match a character with both, wildcards can match more.
+        next_i = i if ta[i] in ("*", "**") else i + 1
+        next_j = j if tb[j] in ("*", "**") else j + 1
+        if (next_i, next_j) == (i, j):
+            return False
+        return overlap(next_i, next_j)
+
+    return overlap(0, 0)
+
+
+@dataclass
+class PreflightError:
+    """
+    Error in the slice definitions that makes chisel fail, found without
+    cutting the slices.
+    """
+
+    slices: list[str]
+    error: str
+
+
+def _prefers(prefers: dict[str, str], a: str, b: str) -> bool:
+    """
+    Return whether one of the packages a and b prefers the other, directly
+    or through a chain of preferred packages.
+    """
+    for pkg, other in ((a, b), (b, a)):
+        seen = set()
+        while pkg in prefers and pkg not in seen:
+            seen.add(pkg)
+            pkg = prefers[pkg]
+            if pkg == other:
+                return True
+    return False
+
+
+def preflight_release(packages: list[Package]) -> list[PreflightError]:
+    """
+    Check the slice definitions of a whole release for the errors that make
+    chisel fail to install the slices:
+      - essentials that are not slices of the release, or that loop;
+      - architectures unknown to chisel;
+      - paths listed by several slices with different contents, or copied
+        by slices of different packages, unless one of the packages is
+        preferred to the other;
+      - globs matching the paths of slices of other packages.
+    """
+    errors = []
+    all_slices = {
+        full_slice_name(pkg.package, slice): pkg for pkg in packages for slice in pkg.slices
+    }
+    for name in sorted(all_slices):
+        pkg = all_slices[name]
+        slice = name.split("_", 1)[1]
+        for essential, arches in sorted(pkg.essentials.get(slice, {}).items()):
+            if essential not in all_slices:
+                errors.append(
+                    PreflightError([name], f"{name} requires {essential}, but slice is missing")
+                )
+            for arch in arches:
+                if arch not in CHISEL_ARCHES:
+                    errors.append(
+                        PreflightError(
+                            [name], f"{name} has invalid arch {arch!r} for essential {essential}"
+                        )
+                    )
+        for path, info in sorted(pkg.contents.get(slice, {}).items()):
+            for arch in info.arches:
+                if arch not in CHISEL_ARCHES:
+                    errors.append(
+                        PreflightError([name], f"{name} has invalid arch {arch!r} for {path}")
+                    )
+
+    # Essential loops, by a depth-first search.
+    state: dict[str, int] = {}
+    stack: list[str] = []
+
+    def visit(name: str) -> None:
+        state[name] = 1
+        stack.append(name)
+        pkg = all_slices[name]
+        for essential in sorted(pkg.essentials.get(name.split("_", 1)[1], {})):
+            if essential not in all_slices:
+                continue
+            if state.get(essential) == 1:
+                loop = stack[stack.index(essential):]
+                errors.append(
+                    PreflightError(loop, f"essential loop detected: {', '.join(loop)}")
+                )
+            elif essential not in state:
+                visit(essential)
+        stack.pop()
+        state[name] = 2
+
+    for name in sorted(all_slices):
+        if name not in state:
+            visit(name)
+
+    # Indexed table of the paths of all the slices.
+    paths: dict[str, list[tuple[str, str, PathInfo]]] = collections.defaultdict(list)
+    for name, pkg in sorted(all_slices.items()):
+        for path, info in pkg.contents.get(name.split("_", 1)[1], {}).items():
+            paths[path].append((name, pkg.package, info))
+    for path, entries in sorted(paths.items()):
+        prefers = {pkg: info.prefer for _, pkg, info in entries if info.prefer}
+        # The contents are the same for all the slices of a package if they
+        # are the same as for its first one, so that is the only comparison
+        # needed. The packages that prefer one another do not conflict.
+        firsts: dict[str, tuple[str, PathInfo]] = {}
+        for name, pkg, info in entries:
+            if pkg in firsts:
+                others = [firsts[pkg]]
+            else:
+                others = [
+                    first
+                    for other_pkg, first in firsts.items()
+                    if not _prefers(prefers, pkg, other_pkg)
+                ]
+            conflicting = [
+                old_name
+                for old_name, old_info in others
+                if not info.same_content(old_info)
+                or (info.kind in ("copy", "glob") and pkg not in firsts)
+            ]
+            if conflicting:
+                old_name = conflicting[0]
+                errors.append(
+                    PreflightError(
+                        [old_name, name],
+                        f"slices {old_name} and {name} conflict on {path}",
+                    )
+                )
+                break
+            firsts.setdefault(pkg, (name, info))
+    # Only the paths starting with the literal prefix of a glob can match it,
+    # and the globs that overlap it start with a prefix of that prefix, which
+    # is found when checking them in turn.
+    sorted_paths = sorted(paths)
+    reported = set()
+    for glob in sorted_paths:
+        if not any(info.kind == "glob" for _, _, info in paths[glob]):
+            continue
+        prefix = glob.split("*", 1)[0].split("?", 1)[0]
+        for path in sorted_paths[bisect.bisect_left(sorted_paths, prefix):]:
+            if not path.startswith(prefix):
+                break
+            if path == glob or not globs_overlap(glob, path):
+                continue
+            for name, pkg, info in paths[glob]:
+                for other_name, other_pkg, _ in paths[path]:
+                    key = frozenset([(name, glob), (other_name, path)])
+                    if pkg == other_pkg or key in reported:
+                        continue
+                    reported.add(key)
+                    errors.append(
+                        PreflightError(
+                            sorted([name, other_name]),
+                            f"slices {name} and {other_name} conflict on {glob} and {path}",
+                        )
+                    )
+    return errors
+
+
+def preflight_plan(
+    plan: list[PlanEntry],
+    closures: dict[str, set[str]],
+    errors: list[PreflightError],
+) -> dict[str, str]:
+    """
+    Return the planned slices that cannot be installed because they install
+    one of the slices of the errors found by preflight_release(), with the
+    first of these errors. The other slices can still be installed, like the
+    ones these slices cover, see replan_failed().
+    """
+    by_slice: dict[str, list[str]] = collections.defaultdict(list)
+    for e in errors:
+        for name in e.slices:
+            by_slice[name].append(e.error)
+    doomed = {}
+    for pkg, slice, _ in plan:
+        name = full_slice_name(pkg, slice)
+        found = list(
+            dict.fromkeys(
+                error
+                for essential in sorted(closures.get(name, {name}))
+                for error in by_slice.get(essential, ())
+            )
+        )
+        if found:
+            doomed[name] = found[0]
+            if len(found) > 1:
+                doomed[name] += f" (and {len(found) - 1} more errors)"
+    return doomed
+
+
+def preflight_arch(
+    plan: list[PlanEntry],
+    closures: dict[str, set[str]],
+    available: set[str],
+) -> dict[str, str]:
+    """
+    Return the planned slices that cannot be installed on an architecture
+    because one of their essentials, which the arch filters keep, belongs to
+    a package that is not available on it, with the reason.
+    """
+    doomed = {}
+    for pkg, slice, _ in plan:
+        name = full_slice_name(pkg, slice)
+        missing = sorted(
+            essential
+            for essential in closures.get(name, ())
+            if essential.split("_", 1)[0] not in available
+        )
+        if missing:
+            doomed[name] = (
+                f"{name} needs {', '.join(missing)}, whose package is not in the archive"
+            )
+    return doomed
+
+
+def plan_installation(
+    slices: list[tuple[str, str]],
+    closures: dict[str, set[str]],
+) -> list[PlanEntry]:
+    """
+    Pick a minimal set of slices to cut so that every slice in slices gets
+    installed, either directly or as an essential of another cut slice.
+    Return the slices to cut as (pkg, slice, covered) where covered lists the
+    full names of the slices whose installation is proven by that cut.
+
+    This is a greedy set cover: slices with the largest closures are picked
+    first, and slices that come as their essentials need no cut of their own.
+    """
+    wanted = {full_slice_name(pkg, slice): (pkg, slice) for pkg, slice in slices}
+    candidates = sorted(
+        wanted,
+        key=lambda name: (-len(closures.get(name, {name}) & wanted.keys()), name),
+    )
+    covered: set[str] = set()
+    plan = []
+    for name in candidates:
+        if name in covered:
+            continue
+        new = sorted((closures.get(name, {name}) & wanted.keys()) - covered)
+        covered.update(new)
+        plan.append((*wanted[name], new))
+    return plan
+
+
+def replan_failed(
+    plan: list[PlanEntry],
+    closures: dict[str, set[str]],
+    failed: set[str],
+) -> tuple[list[PlanEntry], list[PlanEntry]]:
+    """
+    Take the slices covered by the failed cuts of plan off them, since a cut
+    that fails tells nothing of its essentials. Return the plan where the
+    failed cuts only cover their own slice, and the new cuts that cover the
+    others, see plan_installation().
+    """
+    kept = []
+    uncovered: list[tuple[str, str]] = []
+    for pkg, slice, covered in plan:
+        name = full_slice_name(pkg, slice)
+        if name in failed and covered != [name]:
+            kept.append((pkg, slice, [name]))
+            for other in covered:
+                if other != name:
+                    other_pkg, other_slice = other.split("_", 1)
+                    uncovered.append((other_pkg, other_slice))
+        else:
+            kept.append((pkg, slice, covered))
+    return kept, plan_installation(uncovered, closures)
+
+
 def _query_package_existence(
     packages: list[str],
     archive: Archive,
@@ -276,32 +1278,218 @@ def query_package_existence(
         missing.update(m)
     return sorted(found), sorted(missing)
 
-def ensure_package_existence(packages: list[str], archive: Archive) -> None:
+
+@dataclass
+class Availability:
     """
-    Ensure that packages exist in the archive for any arch.
+    Availability matrix of the packages in the archive of a release: the
+    versions of each package in each suite, with the architectures they are
+    built for. It is computed once per release, see availability.py, and
+    shared by the jobs of the release instead of each querying the archive.
     """
-    logging.info("Ensuring packages existence in ubuntu-%s archive...", archive.version)
-    _, missing = query_package_existence(packages, archive)
-    if len(missing) > 0:
-        logging.error(
-            "The following packages do not exist for ubuntu-%s:\n%s",
-            archive.version,
-            "\n".join(f"  - {p}" for p in missing),
+
+    release: str
+    arches: list[str]
+    # {package: {suite: {version: [arch, ...]}}}, empty for the packages
+    # that were queried but are not in the archive.
+    packages: dict[str, dict[str, dict[str, list[str]]]] = field(default_factory=dict)
+
+    def architectures(self, pkg: str) -> set[str]:
+        """
+        Return the architectures that pkg exists for, in any suite.
+        """
+        return {
+            arch
+            for versions in self.packages.get(pkg, {}).values()
+            for arches in versions.values()
+            for arch in arches
+        }
+
+    def versions(self, arch: str) -> dict[str, str]:
+        """
+        Return the version of each package that chisel picks on arch: the
+        highest one across the suites.
+        """
+        versions: dict[str, str] = {}
+        for pkg, suites in self.packages.items():
+            for suite_versions in suites.values():
+                for version, arches in suite_versions.items():
+                    if arch in arches and (
+                        pkg not in versions or compare_versions(version, versions[pkg]) > 0
+                    ):
+                        versions[pkg] = version
+        return versions
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dataclasses.asdict(self), f, sort_keys=True, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str) -> "Availability":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+    @classmethod
+    def from_table(
+        cls, table: PackageTable, packages: list[str], arches: list[str] | None = None
+    ) -> "Availability":
+        """
+        Look the packages up in a package table, see package_table.py,
+        instead of querying the archive, for arches (default: all the arches
+        of the table).
+        """
+        arches = sorted(arches or table.arches)
+        matrix: dict[str, dict[str, dict[str, set[str]]]] = {pkg: {} for pkg in packages}
+        for pkg in packages:
+            for entry in table.entries(pkg):
+                if entry.arch in arches:
+                    versions = matrix[pkg].setdefault(entry.suite, {})
+                    versions.setdefault(entry.version, set()).add(entry.arch)
+        return cls(
+            table.release,
+            arches,
+            {
+                pkg: {
+                    suite: {version: sorted(a) for version, a in versions.items()}
+                    for suite, versions in suites.items()
+                }
+                for pkg, suites in matrix.items()
+            },
         )
-        sys.exit(1)
 
 
-def ignore_missing_packages(
-    packages: list[Package],
-    arch: str,
-    release: str,
-) -> tuple[list[Package], list[Package]]:
+def query_availability(
+    packages: list[str],
+    archive: Archive,
+    arches: list[str],
+    batch_size: int = 50,
+) -> Availability:
+    """
+    Query the availability matrix of the packages in the archive, for all
+    the arches at once.
+    This function breaks down the package list into batches, to avoid
+    URI length limits.
+    """
+    logging.info("Querying packages in %s for %s", archive, ", ".join(arches))
+    matrix: dict[str, dict[str, dict[str, set[str]]]] = {pkg: {} for pkg in packages}
+    n_batches = math.ceil(len(packages) / batch_size)
+    for i in range(n_batches):
+        batch = packages[i * batch_size : (i + 1) * batch_size]
+        logging.info("Querying packages batch %d/%d (%s ... %s)...", i + 1, n_batches, batch[0], batch[-1])
+        args = ["rmadison", "--architecture", ",".join(arches)]
+        if len(archive.components) > 0:
+            args += ["--component", ",".join(archive.components)]
+        if len(archive.suites) > 0:
+            args += ["--suite", ",".join(archive.suites)]
+        args.append(" ".join(batch))
+        logging.debug("Executing %s", " ".join(args))
+        res = subprocess.run(args, capture_output=True, text=True, check=False)
+        if res.returncode != 0:
+            logging.error("Failed to query the archives %d", res.returncode)
+            logging.error("==============================================\n%s", res.stderr)
+            sys.exit(res.returncode)
+        # Lines look like "pkg | version | suite[/component] | arch, arch".
+        for line in res.stdout.splitlines():
+            fields = [f.strip() for f in line.split("|")]
+            if len(fields) < 4:
+                continue
+            line_arches = {a.strip() for a in fields[3].split(",")}
+            if "all" in line_arches:
+                line_arches = set(arches)
+            line_arches &= set(arches)
+            if line_arches:
+                suite = fields[2].split("/", 1)[0]
+                versions = matrix.setdefault(fields[0], {}).setdefault(suite, {})
+                versions.setdefault(fields[1], set()).update(line_arches)
+    return Availability(
+        f"ubuntu-{archive.version}",
+        sorted(arches),
+        {
+            pkg: {
+                suite: {version: sorted(a) for version, a in versions.items()}
+                for suite, versions in suites.items()
+            }
+            for pkg, suites in matrix.items()
+        },
+    )
+
+
+def query_package_architectures(
+    packages: list[str],
+    archive: Archive,
+    arches: list[str],
+    batch_size: int = 50,
+    availability: Availability | None = None,
+) -> dict[str, set[str]]:
+    """
+    Return the architectures among arches that each package exists for in
+    the archive, querying all of them at once. Packages that exist for no
+    architecture are left out.
+    If given, the availability matrix answers for the packages and the
+    architectures it covers, and only the others are queried.
+    """
+    found: dict[str, set[str]] = {}
+    if availability is not None:
+        if availability.release != f"ubuntu-{archive.version}":
+            logging.error(
+                "The availability matrix is for %s, not ubuntu-%s",
+                availability.release,
+                archive.version,
+            )
+            sys.exit(1)
+        if set(arches) <= set(availability.arches):
+            for pkg in packages:
+                if pkg in availability.packages:
+                    found[pkg] = availability.architectures(pkg) & set(arches)
+        else:
+            logging.warning(
+                "The availability matrix does not cover %s",
+                ", ".join(sorted(set(arches) - set(availability.arches))),
+            )
+    unknown = [pkg for pkg in packages if pkg not in found]
+    if unknown:
+        queried = query_availability(unknown, archive, arches, batch_size)
+        found.update((pkg, queried.architectures(pkg)) for pkg in unknown)
+    return {pkg: pkg_arches for pkg, pkg_arches in found.items() if pkg_arches}
+
+
+def ensure_package_existence(
+    packages: list[str], archive: Archive, availability: Availability | None = None
+) -> None:
+    """
+    Ensure that packages exist in the archive for any arch. If given, the
+    availability matrix answers first, and only the packages it does not
+    find on the architectures it covers are queried for any arch.
+    """
+    logging.info("Ensuring packages existence in ubuntu-%s archive...", archive.version)
+    missing = packages
+    if availability is not None:
+        found = query_package_architectures(
+            packages, archive, availability.arches, availability=availability
+        )
+        missing = [pkg for pkg in packages if pkg not in found]
+    if missing and (availability is None or set(CHISEL_ARCHES) - set(availability.arches)):
+        _, missing = query_package_existence(missing, archive)
+    if len(missing) > 0:
+        logging.error(
+            "The following packages do not exist for ubuntu-%s:\n%s",
+            archive.version,
+            "\n".join(f"  - {p}" for p in missing),
+        )
+        sys.exit(1)
+
+
+def ignore_missing_packages(
+    packages: list[Package],
+    arch: str,
+    release: str,
+) -> tuple[list[Package], list[Package]]:
     """
     Filter the packages that do not exist in the archive for [arch, release].
     """
     package_names = [p.package for p in packages]
     archive = parse_archive(release)
-    found, _ = query_package_existence(package_names, archive, arch=[arch])
+    found = query_package_architectures(package_names, archive, [arch])
     #
     logging.info("Ignoring missing packages in ubuntu-%s/%s...", archive.version, arch)
     filtered = []
@@ -313,139 +1501,2090 @@ def ignore_missing_packages(
             ignored.append(p)
     return filtered, ignored
 
-_patterns_to_retry: list[str] = [
+# Classes of the chisel errors that are retried, by a pattern of their message.
+# Any other error is "non-retriable".
+_patterns_to_retry: dict[str, str] = {
     # https://github.com/canonical/chisel-releases/issues/765
-    "cannot fetch from archive",
+    "cannot fetch from archive": "fetch",
     # https://github.com/canonical/chisel-releases/issues/766
-    "cannot talk to archive",
+    "cannot talk to archive": "talk",
     # https://github.com/canonical/chisel-releases/issues/768
-    "cannot find archive data",
-]
+    "cannot find archive data": "missing data",
+}
+
+
+def classify_error(err: str) -> str:
+    """
+    Return the class of a chisel error, see _patterns_to_retry.
+    """
+    for pattern, error_class in _patterns_to_retry.items():
+        if pattern in err:
+            return error_class
+    return "non-retriable"
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How many times to attempt a cut failing with a class of errors, and how
+    long to wait in between: exponential backoff with full jitter, so that
+    the workers hit by the same archive hiccup do not retry all at once.
+    """
+
+    attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int, rng: random.Random) -> float:
+        """
+        Return the seconds to wait after the given failed attempt.
+        """
+        return rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def default_retry_policies(base_delay: float = 1.0) -> dict[str, RetryPolicy]:
+    """
+    Return the retry policies of the classes of errors, with delays scaled by
+    base_delay.
+    """
+    return {
+        # A download failed, usually on its own.
+        "fetch": RetryPolicy(3, base_delay, 30 * base_delay),
+        # The archive cannot be reached, which takes longer to recover.
+        "talk": RetryPolicy(4, 2 * base_delay, 60 * base_delay),
+        # The indices are being updated on the mirror.
+        "missing data": RetryPolicy(3, 5 * base_delay, 60 * base_delay),
+        "non-retriable": RetryPolicy(1),
+    }
+
+
+class CircuitBreaker:
+    """
+    Pause all the cuts of the run when the archive errors spike, instead of
+    letting every worker hammer an archive that is failing.
+
+    The breaker opens when at least threshold of the last window attempts
+    failed with archive errors, and no chisel process starts for cooldown
+    seconds. Then a single probe cut goes: if it fails with an archive error
+    the breaker opens again for twice as long, up to max_cooldown, otherwise
+    it closes.
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        threshold: float = 0.5,
+        cooldown: float = 10.0,
+        max_cooldown: float = 120.0,
+    ):
+        self.window: collections.deque[bool] = collections.deque(maxlen=window)
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.open_until = 0.0
+        self.history: list[dict[str, float | str]] = []
+        # Token of the probe in flight, see wait().
+        self._probing: object | None = None
+        self._start = time.monotonic()
+        self._cond = asyncio.Condition()
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        self.history.append(
+            {"time": round(time.monotonic() - self._start, 3), "state": state}
+        )
+        TRACER.instant(f"circuit breaker {state}", "retry")
+
+    def _open(self, cooldown: float) -> None:
+        self.cooldown = min(cooldown, self.max_cooldown)
+        self.open_until = time.monotonic() + self.cooldown
+        self.window.clear()
+        self._set_state("open")
+        self.history[-1]["cooldown"] = self.cooldown
+        logging.warning(
+            "Too many archive errors, pausing all the cuts for %.0fs", self.cooldown
+        )
+
+    async def wait(self) -> object | None:
+        """
+        Wait until a chisel process can start. Return a token if the process
+        is the probe, to pass to record() and release().
+        """
+        if self.state == "closed":
+            return None
+        with TRACER.span("circuit breaker", "wait"):
+            async with self._cond:
+                while self.state != "closed":
+                    remaining = self.open_until - time.monotonic()
+                    if remaining > 0:
+                        with contextlib.suppress(asyncio.TimeoutError):
+                            await asyncio.wait_for(self._cond.wait(), remaining)
+                    elif self._probing is None:
+                        if self.state == "open":
+                            self._set_state("half-open")
+                        self._probing = object()
+                        return self._probing
+                    else:
+                        await self._cond.wait()
+        return None
+
+    async def record(self, archive_error: bool, probe: object | None = None) -> None:
+        """
+        Record the outcome of a chisel process, given the token returned by
+        wait(). Only the probe decides whether the breaker closes, the
+        outcomes of the processes started before it opened are ignored.
+        """
+        async with self._cond:
+            if probe is not None:
+                if probe is not self._probing:
+                    return
+                self._probing = None
+                if archive_error:
+                    self._open(2 * self.cooldown)
+                else:
+                    self.cooldown = self.base_cooldown
+                    self._set_state("closed")
+                self._cond.notify_all()
+                return
+            if self.state != "closed":
+                return
+            self.window.append(archive_error)
+            if (
+                len(self.window) == self.window.maxlen
+                and sum(self.window) >= self.threshold * len(self.window)
+            ):
+                self._open(self.cooldown)
+                self._cond.notify_all()
+
+    async def release(self, probe: object | None) -> None:
+        """
+        Let another process probe the archive if the probe did not record
+        its outcome, because it was cancelled or failed.
+        """
+        if probe is None:
+            return
+        async with self._cond:
+            if probe is self._probing:
+                self._probing = None
+                self._cond.notify_all()
+
+
+class RetryEngine:
+    """
+    Decide whether and when to retry the cuts that failed, for the whole run:
+    each class of errors has its RetryPolicy, all the retries draw from a
+    budget, and the CircuitBreaker pauses the cuts when the archive is
+    failing. Every decision is kept for the report.
+    """
+
+    def __init__(
+        self,
+        policies: dict[str, RetryPolicy] | None = None,
+        budget: int = 100,
+        breaker: CircuitBreaker | None = None,
+        seed: int | None = None,
+    ):
+        self.policies = policies or default_retry_policies()
+        self.budget = budget
+        self.used = 0
+        self.breaker = breaker or CircuitBreaker()
+        self.decisions: list[dict] = []
+        self._rng = random.Random(seed)
+        self._start = time.monotonic()
+
+    def decide(self, error_class: str, attempt: int, slice_names: list[str]) -> float | None:
+        """
+        Return the seconds to wait before attempting the cut again after it
+        failed with an error of error_class, or None to give up.
+        """
+        policy = self.policies.get(error_class, RetryPolicy(1))
+        delay = None
+        if attempt >= policy.attempts:
+            decision = "give up" if error_class != "non-retriable" else "not retriable"
+        elif self.used >= self.budget:
+            decision = "budget exhausted"
+        else:
+            decision = "retry"
+            delay = policy.delay(attempt, self._rng)
+            self.used += 1
+        self.decisions.append(
+            {
+                "time": round(time.monotonic() - self._start, 3),
+                "slices": slice_names,
+                "class": error_class,
+                "attempt": attempt,
+                "decision": decision,
+                "delay": round(delay, 3) if delay is not None else None,
+            }
+        )
+        return delay
+
+    def summary(self) -> dict:
+        """
+        Return the retry budget, the decisions per class of errors and the
+        changes of the circuit breaker.
+        """
+        by_class: dict[str, collections.Counter[str]] = collections.defaultdict(
+            collections.Counter
+        )
+        for d in self.decisions:
+            by_class[d["class"]][d["decision"]] += 1
+        return {
+            "budget": self.budget,
+            "used": self.used,
+            "classes": {c: dict(counts) for c, counts in sorted(by_class.items())},
+            "decisions": self.decisions,
+            "circuit_breaker": self.breaker.history,
+        }
+
+@dataclass
+class ChiselTimings:
+    """
+    Timings of the chisel processes of one version in a cut.
+    """
+
+    # Seconds of every chisel process, retries included.
+    attempts: list[float] = field(default_factory=list)
+    retries: int = 0
+    # Packages needed by the cut that were (not) in the shared cache.
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+
+@dataclass
+class CutUsage:
+    """
+    Resources used by a cut: the chisel processes, over all their attempts,
+    and the disk space they filled.
+    """
+
+    user_cpu: float = 0.0
+    sys_cpu: float = 0.0
+    # Largest resident set size of the chisel processes, in bytes.
+    max_rss: int = 0
+    # Bytes written to disk by the chisel processes, as accounted by the
+    # kernel (zero on tmpfs).
+    disk_bytes: int = 0
+    # Size of the files installed in the root.
+    root_bytes: int = 0
+    # Size of the packages the cut added to the shared cache.
+    cache_bytes: int = 0
+    # Timings per chisel version.
+    chisel: dict[str, ChiselTimings] = field(default_factory=dict)
+
+    def add_rusage(self, rusage: resource.struct_rusage) -> None:
+        """
+        Account for the resource usage of a chisel process.
+        """
+        self.user_cpu += rusage.ru_utime
+        self.sys_cpu += rusage.ru_stime
+        # ru_maxrss is in KiB on Linux.
+        self.max_rss = max(self.max_rss, rusage.ru_maxrss * 1024)
+        self.disk_bytes += rusage.ru_oublock * 512
+
+    def add(self, other: "CutUsage") -> None:
+        """
+        Account for the resources used by another cut of the same slices,
+        whose root replaces this one.
+        """
+        self.user_cpu += other.user_cpu
+        self.sys_cpu += other.sys_cpu
+        self.max_rss = max(self.max_rss, other.max_rss)
+        self.disk_bytes += other.disk_bytes
+        self.root_bytes = max(self.root_bytes, other.root_bytes)
+        self.cache_bytes += other.cache_bytes
+        for version, timings in other.chisel.items():
+            mine = self.chisel.setdefault(version, ChiselTimings())
+            mine.attempts += timings.attempts
+            mine.retries += timings.retries
+            mine.cache_hits += timings.cache_hits
+            mine.cache_misses += timings.cache_misses
+
+    def share(self, n: int) -> "CutUsage":
+        """
+        Return the share of one of the n slices cut together, like the
+        duration of a batch. The largest resident set size, the retries and
+        the cache lookups are the ones of the whole cut.
+        """
+        return CutUsage(
+            user_cpu=round(self.user_cpu / n, 3),
+            sys_cpu=round(self.sys_cpu / n, 3),
+            max_rss=self.max_rss,
+            disk_bytes=self.disk_bytes // n,
+            root_bytes=self.root_bytes // n,
+            cache_bytes=self.cache_bytes // n,
+            chisel={
+                version: ChiselTimings(
+                    [round(seconds / n, 3) for seconds in timings.attempts],
+                    timings.retries,
+                    timings.cache_hits,
+                    timings.cache_misses,
+                )
+                for version, timings in self.chisel.items()
+            },
+        )
+
+
+async def wait_with_rusage(proc: subprocess.Popen) -> resource.struct_rusage:
+    """
+    Wait for the process without blocking the event loop, then reap it with
+    wait4() to get its resource usage, which asyncio's own subprocesses do
+    not expose. Set proc.returncode.
+    """
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+    # The pidfd becomes readable when the process exits.
+    pidfd = os.pidfd_open(proc.pid)
+    try:
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        await exited
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+        if not exited.done():
+            proc.wait()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
 
-def chisel_cut(
+
+def tree_size(root: str) -> int:
+    """
+    Return the size of the regular files under root.
+    """
+    size = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            st = os.lstat(os.path.join(dirpath, name))
+            if stat.S_ISREG(st.st_mode):
+                size += st.st_size
+    return size
+
+
+async def chisel_cut(
     *,
     arch: str,
     release: str,
     root: str,
-    slice_name: str,
+    slice_names: list[str],
     chisel_version: str,
     cache_dir: str,
-    n_retries: int = 3,
+    chisel: str = "chisel",
+    retries: RetryEngine | None = None,
+    slots: "ConcurrencyController | None" = None,
+    on_retry: Callable[[], None] | None = None,
+    usage: CutUsage | None = None,
 ) -> str | None:
     """
-    Run "chisel cut" to install the slice in the given root.
-    Retry up to n_retries times if a fetch error occurs.
+    Run "chisel cut" to install the slices together in the given root, with
+    the chisel binary of the given version.
+    Retry the archive errors as retries decides, calling on_retry every time
+    one occurs. If given, usage accounts for the resources used by the
+    chisel processes.
+    If given, every chisel process waits for one of the slots, which is
+    released before waiting to retry, so that the slots only account for
+    running processes.
     Return an error message if something went wrong, or None on success.
     """
     env = dict(os.environ)
     env["XDG_CACHE_HOME"] = str(cache_dir)
 
-    args = ["chisel", "cut", "--arch", arch, "--release", release, "--root", root]
+    args = [chisel, "cut", "--arch", arch, "--release", release, "--root", root]
     if chisel_version.lstrip("v").split("+", 1)[0] > "1.2.0":
         args += ["--ignore=unstable"]
-    args += [slice_name]
+    args += slice_names
 
-    for attempt in range(1, n_retries + 1):
-        res = subprocess.run(
-            args,
-            capture_output=True,
-            text=True,
-            check=False,
-            env=env,
-        )
-        if res.returncode == 0:
+    if retries is None:
+        retries = RetryEngine()
+    timings = usage.chisel.setdefault(chisel_version, ChiselTimings()) if usage else None
+    for attempt in itertools.count(1):
+        probe = await retries.breaker.wait()
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                if slots is not None:
+                    with TRACER.span("wait for a slot", "wait"):
+                        await stack.enter_async_context(slots.slot())
+                start = time.monotonic()
+                with TRACER.span(
+                    "chisel cut",
+                    "cut",
+                    slices=slice_names,
+                    version=chisel_version,
+                    attempt=attempt,
+                ) as trace_args:
+                    # stderr goes to a file, so that the process can be waited
+                    # for with wait_with_rusage() without draining a pipe.
+                    with tempfile.TemporaryFile() as stderr:
+                        proc = subprocess.Popen(
+                            args, stdout=subprocess.DEVNULL, stderr=stderr, env=env
+                        )
+                        rusage = await wait_with_rusage(proc)
+                        stderr.seek(0)
+                        err = stderr.read().decode(errors="replace").rstrip()
+                    trace_args["returncode"] = proc.returncode
+            error_class = classify_error(err) if proc.returncode != 0 else None
+            await retries.breaker.record(
+                error_class not in (None, "non-retriable"), probe
+            )
+        finally:
+            # Let another process probe the archive if this one did not
+            # complete.
+            await retries.breaker.release(probe)
+        if usage is not None:
+            usage.add_rusage(rusage)
+            timings.attempts.append(round(time.monotonic() - start, 3))
+        if error_class is None:
             return None
-        err = res.stderr.rstrip()
 
-        # Match stderr against known patterns to retry
-        matched: None | str = None
-        for pattern in _patterns_to_retry:
-            if pattern in err:
-                matched = pattern
-                break
-        
-        if attempt < n_retries and matched is not None:
-            logging.warning(
-                "Error while installing %s (attempt %d/%d): %s. Retrying...",
-                slice_name,
-                attempt,
-                n_retries,
-                matched,
+        if error_class != "non-retriable" and on_retry is not None:
+            on_retry()
+        delay = retries.decide(error_class, attempt, slice_names)
+        if delay is None:
+            return err
+        if timings is not None:
+            timings.retries += 1
+        logging.warning(
+            "Error while installing %s (attempt %d): %s error. Retrying in %.1fs...",
+            " ".join(slice_names),
+            attempt,
+            error_class,
+            delay,
+        )
+        with TRACER.span("backoff", "wait", slices=slice_names, error=error_class):
+            await asyncio.sleep(delay)
+
+
+def chisel_pkg_cache(cache_dir: str) -> pathlib.Path:
+    """
+    Return the directory where chisel stores the downloaded files when
+    XDG_CACHE_HOME is set to cache_dir.
+    """
+    return pathlib.Path(cache_dir) / "chisel" / "sha256"
+
+
+# Locks of the shared cache, per event loop since asyncio locks are bound to
+# the loop that uses them.
+_cache_locks: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[str, asyncio.Lock]
+] = weakref.WeakKeyDictionary()
+
+
+@contextlib.asynccontextmanager
+async def cache_lock(cache_dir: str, name: str) -> AsyncIterator[None]:
+    """
+    Hold the lock named after name in the shared cache directory.
+    """
+    locks = _cache_locks.setdefault(asyncio.get_running_loop(), {})
+    lock = locks.setdefault(os.path.join(cache_dir, name), asyncio.Lock())
+    async with lock:
+        yield
+
+
+class ConcurrencyController:
+    """
+    Limit the number of concurrent chisel processes, adapting the limit with
+    additive-increase/multiplicative-decrease (AIMD), like TCP congestion
+    control:
+      - every cut that completes without trouble adds 1/limit to the limit,
+        unless the CPUs are already saturated;
+      - archive errors (see _patterns_to_retry) halve the limit;
+      - a sustained rise of the cut latency reduces the limit by a quarter.
+    Decreases are spaced out, so that a burst of errors caused by the same
+    archive hiccup only counts once.
+    """
+
+    def __init__(self, initial: int, min_workers: int, max_workers: int):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.limit = float(min(max(initial, self.min_workers), self.max_workers))
+        self.in_flight = 0
+        self.active = 0
+        self.history: list[tuple[float, int]] = [(0.0, int(self.limit))]
+        self._start = time.monotonic()
+        self._last_decrease = self._start
+        self._latency_fast: float | None = None
+        self._latency_slow: float | None = None
+        self._samples = 0
+        self._cond = asyncio.Condition()
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        limit = min(max(limit, self.min_workers), self.max_workers)
+        if int(limit) != int(self.limit):
+            logging.info(
+                "Concurrency %d -> %d (%s)", int(self.limit), int(limit), reason
             )
-            continue
-        return err
+            self.history.append((round(time.monotonic() - self._start, 3), int(limit)))
+        self.limit = limit
 
+    def _decrease(self, factor: float, reason: str) -> None:
+        now = time.monotonic()
+        # Wait for the cuts started at the previous limit to be reflected.
+        if now - self._last_decrease < (self._latency_slow or 0):
+            return
+        self._last_decrease = now
+        self._set_limit(self.limit * factor, reason)
 
-def install_slices(
-    chunk: list[tuple[str, str]], dry_run: bool, arch: str, release: str, worker: int, chisel_version: str
-) -> None:
+    def record_retry(self) -> None:
+        """
+        Record a cut that failed with a retriable archive error.
+        """
+        self._decrease(0.5, "archive errors")
+
+    def record_latency(self, latency: float) -> None:
+        """
+        Record the duration of a cut.
+        """
+        self._samples += 1
+        if self._latency_fast is None or self._latency_slow is None:
+            self._latency_fast = self._latency_slow = latency
+            return
+        self._latency_fast += 0.3 * (latency - self._latency_fast)
+        self._latency_slow += 0.05 * (latency - self._latency_slow)
+        if self._samples > 2 * self.limit and self._latency_fast > 1.5 * self._latency_slow:
+            self._decrease(0.75, "slower cuts")
+        elif os.getloadavg()[0] < (os.cpu_count() or 1):
+            self._set_limit(self.limit + 1 / self.limit, "faster cuts")
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Wait until the number of running cuts is below the limit. The time
+        the slot is held is the latency of the cut, so it is held for a
+        single chisel process.
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_latency(time.monotonic() - start)
+            async with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def worker(self) -> AsyncIterator[None]:
+        """
+        Wait until fewer workers than the limit hold work, so that the work
+        is only handed out to the workers that can run it.
+        """
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+
+class CacheStats:
+    """
+    Account for the packages that each cut finds in the shared cache.
+
+    A package is a hit if its deb, found by its digest in the package index,
+    is in the cache when the cut starts, whoever downloaded it: an earlier
+    cut, even a failed one, the prefetcher or a previous run with the same
+    --cache-dir. Packages that are not in the index are not accounted for.
+    """
+
+    def __init__(
+        self,
+        closures: dict[str, set[str]],
+        index: dict[str, PackageInfo],
+        pkg_cache: pathlib.Path,
+    ):
+        self.closures = closures
+        self.index = index
+        self.pkg_cache = pkg_cache
+        self.hits: collections.Counter[str] = collections.Counter()
+        self.misses: collections.Counter[str] = collections.Counter()
+
+    def lookup(self, slice_names: list[str]) -> tuple[set[str], set[str]]:
+        """
+        Look up the packages needed to cut slice_names in the cache, and
+        return the ones that are there and the ones that are not.
+        """
+        needed = {
+            name.split("_", 1)[0]
+            for slice_name in slice_names
+            for name in self.closures.get(slice_name, {slice_name})
+        }
+        hits, misses = set(), set()
+        for pkg in needed:
+            if pkg not in self.index:
+                continue
+            if (self.pkg_cache / self.index[pkg].sha256).exists():
+                hits.add(pkg)
+                self.hits[pkg] += 1
+            else:
+                misses.add(pkg)
+                self.misses[pkg] += 1
+        return hits, misses
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        Return the cache hits, misses and hit rate per package.
+        """
+        summary = {}
+        for pkg in sorted(self.hits.keys() | self.misses.keys()):
+            hits, misses = self.hits[pkg], self.misses[pkg]
+            summary[pkg] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / (hits + misses), 3),
+            }
+        return summary
+
+
+def cache_files(cache_dir: str) -> set[str]:
     """
-    Install the slice by running "chisel cut".
+    Return the names of the files in the chisel cache.
     """
-    for i, (pkg, slice) in enumerate(chunk):
-        slice_name = full_slice_name(pkg, slice)
+    try:
+        return set(os.listdir(chisel_pkg_cache(cache_dir)))
+    except FileNotFoundError:
+        return set()
+
+
+async def chisel_cut_shared_cache(
+    *,
+    arch: str,
+    pkgs: list[str],
+    cache_dir: str,
+    slots: ConcurrencyController,
+    slice_names: list[str],
+    stats: CacheStats | None = None,
+    usage: CutUsage | None = None,
+    **kwargs,
+) -> str | None:
+    """
+    Run chisel_cut() using the cache shared by all the workers of this run,
+    each chisel process taking one of the slots for concurrent chisel
+    processes. If given,
+    stats accounts for the packages found in the cache, and usage for the
+    resources used by the cut, including the files it added to the cache.
+
+    The chisel cache is content-addressed (files are stored by their sha256
+    digest) and chisel publishes each file by renaming a verified temporary
+    file into place, so concurrent writers never expose partial files.
+    On top of that:
+      - the first cut of the run on each architecture fetches the archive
+        indices alone, so that the other workers find them in the cache
+        instead of racing to download them as well. Only archive errors
+        keep the next cut fetching them alone;
+      - slices of the same package are not cut concurrently on the same
+        architecture, so that the package is only downloaded once.
+    """
+    ready = pathlib.Path(cache_dir, f".index-ready-{arch}")
+    async with contextlib.AsyncExitStack() as stack:
+        if not ready.exists():
+            with TRACER.span("wait for archive indices", "wait"):
+                await stack.enter_async_context(cache_lock(cache_dir, f"index-{arch}"))
+            if ready.exists():
+                # Another worker populated the indices while we were waiting.
+                await stack.aclose()
+        async with contextlib.AsyncExitStack() as pkg_locks:
+            # Always lock in the same order to avoid deadlocks between workers.
+            with TRACER.span("wait for package locks", "wait", packages=pkgs):
+                for pkg in sorted(set(pkgs)):
+                    await pkg_locks.enter_async_context(
+                        cache_lock(cache_dir, f"package-{arch}-{pkg}")
+                    )
+            if stats:
+                hits, misses = stats.lookup(slice_names)
+                if usage is not None:
+                    timings = usage.chisel.setdefault(
+                        kwargs["chisel_version"], ChiselTimings()
+                    )
+                    timings.cache_hits += len(hits)
+                    timings.cache_misses += len(misses)
+            before = cache_files(cache_dir) if usage is not None else set()
+            err = await chisel_cut(
+                arch=arch,
+                cache_dir=cache_dir,
+                slice_names=slice_names,
+                slots=slots,
+                on_retry=slots.record_retry,
+                usage=usage,
+                **kwargs,
+            )
+            if usage is not None:
+                # A file added by a concurrent cut needing the same essential
+                # may be accounted to both cuts.
+                pkg_cache = chisel_pkg_cache(cache_dir)
+                for name in cache_files(cache_dir) - before:
+                    with contextlib.suppress(FileNotFoundError):
+                        usage.cache_bytes += os.path.getsize(pkg_cache / name)
+        # Chisel fetches the indices before installing anything, so they are
+        # in the cache unless the cut failed with an archive error, even if
+        # the slices failed, and the next cuts no longer need to wait.
+        if err is None or classify_error(err) == "non-retriable":
+            ready.touch()
+    return err
+
+
+class Prefetcher:
+    """
+    Download the packages needed by the cuts into the shared cache, ahead of
+    the cuts and with its own bounded concurrency, so that the cuts do not
+    wait for the network and only extract the packages.
+
+    Each cut waits for the packages it needs, which are downloaded in the
+    order the cuts are queued in. A package that fails to download is left
+    for chisel to fetch.
+    """
+
+    def __init__(
+        self,
+        index: dict[str, PackageInfo],
+        closures: dict[str, set[str]],
+        pkg_cache: pathlib.Path,
+        base_url: str,
+        workers: int,
+    ):
+        self.index = index
+        self.closures = closures
+        self.pkg_cache = pkg_cache
+        self.base_url = base_url
+        self.workers = workers
+        self.downloads: dict[str, dict[str, float | int | str]] = {}
+        self._ready: dict[str, asyncio.Event] = {}
+        self._local = threading.local()
+
+    def _needed(self, slice_names: list[str]) -> list[str]:
+        needed = {}
+        for slice_name in slice_names:
+            for name in sorted(self.closures.get(slice_name, {slice_name})):
+                pkg = name.split("_", 1)[0]
+                if pkg in self.index:
+                    needed[pkg] = None
+        return list(needed)
+
+    def _download(self, pkg: str) -> dict[str, float | int | str]:
+        if not hasattr(self._local, "session"):
+            # One session per thread, to reuse the connections to the archive.
+            self._local.session = requests.Session()
+        start = time.monotonic()
+        size = download_package(
+            self.index[pkg], self.base_url, self.pkg_cache, self._local.session
+        )
+        return {
+            "bytes": size,
+            "seconds": round(time.monotonic() - start, 3),
+            "status": "downloaded" if size else "cached",
+        }
+
+    async def run(self, slice_names: list[str]) -> None:
+        """
+        Download the packages needed by slice_names, in that order.
+        """
+        pkgs = self._needed(slice_names)
+        for pkg in pkgs:
+            self._ready.setdefault(pkg, asyncio.Event())
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        for pkg in pkgs:
+            queue.put_nowait(pkg)
+
+        async def worker(executor: ThreadPoolExecutor, i: int) -> None:
+            _trace_worker.set(f"prefetch {i}")
+            while not queue.empty():
+                pkg = queue.get_nowait()
+                try:
+                    with TRACER.span("download", "prefetch", package=pkg):
+                        self.downloads[pkg] = await loop.run_in_executor(
+                            executor, self._download, pkg
+                        )
+                except (OSError, ValueError, requests.RequestException) as e:
+                    logging.warning("Cannot prefetch %s: %s", pkg, e)
+                    self.downloads[pkg] = {"bytes": 0, "seconds": 0, "status": "failed"}
+                finally:
+                    # The cuts waiting for the package download it themselves
+                    # if it could not be prefetched.
+                    self._ready[pkg].set()
+
+        try:
+            with ThreadPoolExecutor(self.workers) as executor:
+                await asyncio.gather(
+                    *(worker(executor, i) for i in range(1, self.workers + 1))
+                )
+        finally:
+            # Do not leave the cuts waiting for the packages that were still
+            # queued when a worker failed.
+            for pkg in pkgs:
+                self._ready[pkg].set()
+        total = sum(d["bytes"] for d in self.downloads.values())
         logging.info(
-            "Worker %d (%d/%d): Installing %s on %s...",
-            worker,
-            i,
-            len(chunk),
-            slice_name,
-            arch,
+            "Prefetched %d packages (%.1f MB)", len(self.downloads), total / 1e6
+        )
+
+    async def wait(self, slice_names: list[str]) -> None:
+        """
+        Wait until the packages needed by slice_names are prefetched.
+        """
+        for pkg in self._needed(slice_names):
+            if pkg in self._ready:
+                await self._ready[pkg].wait()
+
+
+def estimate_durations(
+    plan: list[PlanEntry],
+    closures: dict[str, set[str]],
+    index: dict[str, PackageInfo],
+    history: dict[str, float] | None = None,
+) -> dict[str, float]:
+    """
+    Estimate how long each planned cut takes. Use the durations of previous
+    runs when known, and otherwise the amount of data chisel handles for the
+    cut: the download size and installed size of the packages it needs. Sizes
+    are converted to seconds with the median rate seen in the history, if any.
+    """
+    history = history or {}
+    sizes = {}
+    for pkg, slice, _ in plan:
+        name = full_slice_name(pkg, slice)
+        needed = {essential.split("_", 1)[0] for essential in closures.get(name, {name})}
+        sizes[name] = sum(
+            index[p].size + index[p].installed_size for p in needed if p in index
+        )
+    rates = sorted(
+        history[name] / sizes[name] for name in sizes if name in history and sizes[name]
+    )
+    rate = rates[len(rates) // 2] if rates else 1.0
+    return {name: history.get(name, size * rate) for name, size in sizes.items()}
+
+
+def order_longest_first(
+    groups: list[list[PlanEntry]], durations: dict[str, float]
+) -> list[list[PlanEntry]]:
+    """
+    Order the groups of cuts by decreasing estimated duration, so that the
+    longest ones do not start last and stretch the run (LPT scheduling).
+    """
+    return sorted(
+        groups,
+        key=lambda group: -sum(
+            durations.get(full_slice_name(pkg, slice), 0) for pkg, slice, _ in group
+        ),
+    )
+
+
+def group_by_affinity(
+    plan: list[PlanEntry],
+    closures: dict[str, set[str]] | None = None,
+    max_size: int | None = None,
+) -> list[list[PlanEntry]]:
+    """
+    Group the planned cuts by package, so that the cuts of a package run back
+    to back on the same worker: the first one downloads the package and the
+    others find it in the cache.
+
+    If max_size is given, larger groups are split into chunks of max_size
+    cuts, which other workers can take, so that a package with many slices
+    is not left for a single worker at the end of the run. The chunks wait
+    for the same downloads in the shared cache instead of repeating them,
+    see chisel_cut_shared_cache().
+
+    If closures are given, packages are also grouped with the packages whose
+    essentials they share: each package joins the least used of the packages
+    its essentials come from, skipping the ones needed by more than
+    sqrt(number of packages) others (libc6 and the like), which are in the
+    cache early anyway.
+    """
+    parent = {pkg: pkg for pkg, _, _ in plan}
+
+    def find(pkg: str) -> str:
+        while parent[pkg] != pkg:
+            parent[pkg] = parent[parent[pkg]]
+            pkg = parent[pkg]
+        return pkg
+
+    if closures is not None:
+        needs: dict[str, set[str]] = {}
+        for pkg, slice, _ in plan:
+            name = full_slice_name(pkg, slice)
+            needs.setdefault(pkg, set()).update(
+                essential.split("_", 1)[0] for essential in closures.get(name, {name})
+            )
+        users = collections.Counter(q for needed in needs.values() for q in needed)
+        limit = max(2, math.isqrt(len(needs)))
+        for pkg, needed in needs.items():
+            shared = [q for q in needed if q != pkg and 1 < users[q] <= limit]
+            if shared:
+                q = min(shared, key=lambda q: (users[q], q))
+                parent.setdefault(q, q)
+                parent[find(pkg)] = find(q)
+
+    groups: dict[str, list[PlanEntry]] = {}
+    for entry in plan:
+        groups.setdefault(find(entry[0]), []).append(entry)
+    if max_size is None:
+        return list(groups.values())
+    return [
+        group[i : i + max_size]
+        for group in groups.values()
+        for i in range(0, len(group), max_size)
+    ]
+
+
+@dataclass
+class DebEntry:
+    """
+    The package and version of a deb in the chisel cache.
+    """
+
+    sha256: str
+    package: str
+    version: str
+
+
+def read_deb_entry(path: pathlib.Path) -> tuple[str, str] | None:
+    """
+    Return the package and version of a deb, or None if path is not a deb.
+    """
+    try:
+        fields = read_control(path)
+        return fields["Package"], fields["Version"]
+    except (DebError, KeyError):
+        return None
+
+
+class DebIndex:
+    """
+    Persistent index of the files in the chisel cache by sha256 digest,
+    with the package and version of the debs, so that checking the contents
+    of a package is a lookup instead of a scan of the whole cache.
+
+    The index is updated incrementally: the control fields of each file of
+    the cache are read once. The files that are not debs, such as the
+    archive indices, are recorded with an empty package so that they are
+    not read again. Whether a deb has a path is answered by streaming its
+    data tarball up to that path, once, and is then kept in the index.
+    """
+
+    VERSION = 2
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS debs (
+        sha256 TEXT PRIMARY KEY,
+        package TEXT NOT NULL,
+        version TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS debs_package ON debs (package);
+    CREATE TABLE IF NOT EXISTS paths (
+        sha256 TEXT NOT NULL,
+        path TEXT NOT NULL,
+        present INTEGER NOT NULL,
+        PRIMARY KEY (sha256, path)
+    );
+    """
+
+    def __init__(self, path: str | pathlib.Path, pkg_cache: pathlib.Path):
+        self.pkg_cache = pathlib.Path(pkg_cache)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+                # The index is only a cache: rebuild it.
+                self._db.executescript("DROP TABLE IF EXISTS debs; DROP TABLE IF EXISTS paths;")
+                self._db.execute(f"PRAGMA user_version = {self.VERSION}")
+            self._db.executescript(self.SCHEMA)
+            self._known = {row[0] for row in self._db.execute("SELECT sha256 FROM debs")}
+
+    def close(self) -> None:
+        self._db.close()
+
+    def update(self) -> int:
+        """
+        Index the files added to the cache since the last update. Return the
+        number of debs indexed.
+        """
+        try:
+            names = os.listdir(self.pkg_cache)
+        except FileNotFoundError:
+            return 0
+        # chisel names the files by their digest once they are complete.
+        new = sorted(
+            name
+            for name in names
+            if name not in self._known and re.fullmatch("[0-9a-f]{64}", name)
         )
-        if dry_run:
+        rows = []
+        for name in new:
+            with TRACER.span("index deb", "check", sha256=name):
+                entry = read_deb_entry(self.pkg_cache / name)
+            rows.append((name, *(entry or ("", ""))))
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO debs VALUES (?, ?, ?)", rows)
+            self._known.update(new)
+        return sum(1 for row in rows if row[1])
+
+    def _entries(self, query: str, *params: str) -> list[DebEntry]:
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [DebEntry(*row) for row in rows]
+
+    def get(self, sha256: str) -> DebEntry | None:
+        """
+        Return the deb with this digest, if it is in the index.
+        """
+        entries = self._entries(
+            "SELECT * FROM debs WHERE sha256 = ? AND package != ''", sha256
+        )
+        return entries[0] if entries else None
+
+    def find(self, package: str) -> list[DebEntry]:
+        """
+        Return the debs of package in the index, latest version first.
+        """
+        entries = self._entries("SELECT * FROM debs WHERE package = ?", package)
+        entries.sort(
+            key=functools.cmp_to_key(lambda a, b: compare_versions(b.version, a.version))
+        )
+        return entries
+
+    def contains(self, entry: DebEntry, path: str) -> bool:
+        """
+        Return True if the deb of entry contains path, relative to the root.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT present FROM paths WHERE sha256 = ? AND path = ?",
+                (entry.sha256, path),
+            ).fetchone()
+        if row is not None:
+            return bool(row[0])
+        with TRACER.span("read deb", "check", package=entry.package, path=path):
+            try:
+                present = deb_has_file(self.pkg_cache / entry.sha256, path)
+            except DebError:
+                # Evicted from the cache since it was indexed.
+                return False
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO paths VALUES (?, ?, ?)",
+                (entry.sha256, path, int(present)),
+            )
+        return present
+
+    def has_file(self, package: str, path: str, sha256: str | None = None) -> bool:
+        """
+        Return True if the deb of package contains path. The deb is the one
+        with the given digest if it is in the index, the latest version of
+        package otherwise.
+        """
+        entry = self.get(sha256) if sha256 else None
+        if entry is None or entry.package != package:
+            entries = self.find(package)
+            entry = entries[0] if entries else None
+        return entry is not None and self.contains(entry, path)
+
+
+def deb_has_copyright_file(
+    pkg: str,
+    pkg_cache: pathlib.Path = CHISEL_PKG_CACHE,
+    index: DebIndex | None = None,
+    sha256: str | None = None,
+) -> bool:
+    """
+    Checks if a deb's contents comprise a copyright file
+
+    The deb is looked up in the index of the cache, by sha256 if the archive
+    index gave it, or by package name otherwise.
+
+    TODO: update this function once the Chisel DB is available, as the pkg
+    SHAs will be available from the DB itself.
+    """
+    if index is None:
+        index = DebIndex(":memory:", pkg_cache)
+    index.update()
+    return index.has_file(pkg, f"usr/share/doc/{pkg}/copyright", sha256)
+
+
+def find_manifest_slice(
+    packages: list[Package], slice_name: str | None = None
+) -> tuple[str, str] | None:
+    """
+    Return the slice of the packages that generates chisel's manifest, and
+    the path of the manifest in the installed root. If slice_name is given,
+    only that slice is considered.
+    """
+    for pkg in sorted(packages, key=lambda p: p.package):
+        for slice, paths in sorted(pkg.contents.items()):
+            name = full_slice_name(pkg.package, slice)
+            if slice_name and name != slice_name:
+                continue
+            for path, info in sorted(paths.items()):
+                if info.kind == "generate" and info.info == "manifest":
+                    return name, manifest_path(path)
+    return None
+
+
+def verify_manifest(
+    manifest_file: pathlib.Path,
+    root: str,
+    slice_names: list[str],
+    deb_index: DebIndex,
+) -> list[str]:
+    """
+    Check the root installed with slice_names against the manifest that
+    chisel generated in it, in a single pass over the manifest:
+      - the slices are in the manifest;
+      - the paths of the manifest are installed, with their size;
+      - the packages of the slices have their copyright file installed if
+        their deb has one. The deb is the one chisel installed, found in
+        the cache by the digest in the manifest.
+    Return the errors found.
+    """
+    errors = []
+    packages: dict[str, tuple[str, str]] = {}
+    installed_slices = set()
+    paths = set()
+    for entry in iter_manifest(manifest_file):
+        kind = entry.get("kind")
+        if kind == "package":
+            packages[entry["name"]] = (entry.get("version", ""), entry.get("sha256", ""))
+        elif kind == "slice":
+            installed_slices.add(entry["name"])
+        elif kind == "path":
+            path = entry["path"]
+            paths.add(path)
+            try:
+                st = os.lstat(root + path.rstrip("/"))
+            except FileNotFoundError:
+                errors.append(f"{path} is in the manifest but was not installed")
+                continue
+            # The size of a mutated file is the one of its original content.
+            if (
+                "size" in entry
+                and "final_sha256" not in entry
+                and stat.S_ISREG(st.st_mode)
+                and st.st_size != entry["size"]
+            ):
+                errors.append(
+                    f"{path} has {st.st_size} bytes instead of {entry['size']} in the manifest"
+                )
+    for name in slice_names:
+        if name not in installed_slices:
+            errors.append(f"{name} is not in the manifest")
+    for pkg in sorted({name.split("_", 1)[0] for name in slice_names}):
+        copyright_file = f"/usr/share/doc/{pkg}/copyright"
+        if copyright_file in paths or pkg not in packages:
             continue
-        with tempfile.TemporaryDirectory() as tmpfs, tempfile.TemporaryDirectory() as cache_dir:
-            err = chisel_cut(
+        version, sha256 = packages[pkg]
+        if deb_index.contains(DebEntry(sha256, pkg, version), copyright_file[1:]):
+            errors.append(f"{pkg} has a copyright file but it wasn't installed.")
+    return errors
+
+
+def snapshot_tree(root: str) -> dict[str, tuple[str, int, str]]:
+    """
+    Return (kind, mode, content) for every path under root, where content is
+    the sha256 digest of a regular file or the target of a symlink.
+    """
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            content = ""
+            if stat.S_ISLNK(st.st_mode):
+                kind, content = "symlink", os.readlink(path)
+            elif stat.S_ISDIR(st.st_mode):
+                kind = "dir"
+            elif stat.S_ISREG(st.st_mode):
+                kind = "file"
+                digest = hashlib.sha256()
+                with open(path, "rb") as f:
+                    while chunk := f.read(1 << 20):
+                        digest.update(chunk)
+                content = digest.hexdigest()
+            else:
+                kind = "other"
+            tree["/" + os.path.relpath(path, root)] = (kind, stat.S_IMODE(st.st_mode), content)
+    return tree
+
+
+def diff_trees(
+    a: dict[str, tuple[str, int, str]], b: dict[str, tuple[str, int, str]]
+) -> list[str]:
+    """
+    Describe how the trees returned by snapshot_tree() differ.
+    """
+    differences = []
+    for path in sorted(a.keys() | b.keys()):
+        if path not in b:
+            differences.append(f"{path}: only in the first tree")
+        elif path not in a:
+            differences.append(f"{path}: only in the second tree")
+        elif a[path] != b[path]:
+            (a_kind, a_mode, a_content), (b_kind, b_mode, b_content) = a[path], b[path]
+            if a_kind != b_kind:
+                differences.append(f"{path}: {a_kind} != {b_kind}")
+                continue
+            if a_mode != b_mode:
+                differences.append(f"{path}: mode {a_mode:04o} != {b_mode:04o}")
+            if a_content != b_content:
+                what = "target" if a_kind == "symlink" else "sha256"
+                differences.append(f"{path}: {what} {a_content} != {b_content}")
+    return differences
+
+
+@dataclass
+class Divergence:
+    """
+    Difference between the trees that two chisel versions install for the
+    same slices.
+    """
+
+    slices: list[str]
+    arch: str
+    versions: tuple[str, str]
+    differences: list[str]
+
+
+@dataclass
+class CutResult:
+    """
+    Outcome of a "chisel cut", along with the slices it proved installable.
+    """
+
+    slice_name: str
+    covered: list[str]
+    error: str | None = None
+    # Seconds spent installing the slice, shared evenly within a batch.
+    duration: float = 0.0
+    # Whether the slice passed in a previous run and was not cut again.
+    cached: bool = False
+    arch: str = ""
+    # Resources used to install the slice, shared evenly within a batch.
+    usage: CutUsage | None = None
+
+
+@dataclass
+class Conflict:
+    """
+    Pair of slices that install on their own but not together.
+    """
+
+    slices: tuple[str, str]
+    error: str
+    arch: str = ""
+
+
+async def _first_failing_prefix(
+    base: list[PlanEntry],
+    entries: list[PlanEntry],
+    cut: Callable[[list[PlanEntry]], Awaitable[str | None]],
+) -> tuple[PlanEntry, str]:
+    """
+    Find the first entry such that base plus the entries up to it fails,
+    knowing that base passes and base plus all the entries fails.
+    """
+    lo, hi, err = 0, len(entries), ""
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        mid_err = await cut(base + entries[:mid])
+        if mid_err is None:
+            lo = mid
+        else:
+            hi, err = mid, mid_err
+    return entries[hi - 1], err
+
+
+async def _isolate(
+    entries: list[PlanEntry],
+    err: str,
+    cut: Callable[[list[PlanEntry]], Awaitable[str | None]],
+    failed: dict[str, str],
+    conflicts: list[Conflict],
+) -> list[PlanEntry]:
+    """
+    Bisect the entries, which chisel fails to cut together with err, adding
+    the slices that fail on their own to failed and the pairs of slices that
+    cannot be installed together to conflicts. Return the entries left,
+    which install together.
+    """
+    if len(entries) == 1:
+        pkg, slice, _ = entries[0]
+        failed[full_slice_name(pkg, slice)] = err
+        return []
+    mid = len(entries) // 2
+    halves = []
+    for half in (entries[:mid], entries[mid:]):
+        half_err = await cut(half)
+        if half_err is not None:
+            half = await _isolate(half, half_err, cut, failed, conflicts)
+        halves.append(half)
+    left, right = halves
+    # Whole halves install on their own, but not together. What is left of
+    # them needs to be cut together again, as the slices that fail on their
+    # own may hide conflicts between the halves.
+    if left and right and len(left) + len(right) < len(entries):
+        err = await cut(left + right)
+    while left and right and err is not None:
+        r, r_err = await _first_failing_prefix(left, right, cut)
+        l, l_err = await _first_failing_prefix([r], left, cut)
+        names = (full_slice_name(l[0], l[1]), full_slice_name(r[0], r[1]))
+        conflicts.append(Conflict(names, l_err or r_err or err))
+        # The slice of the left half may conflict with others as well.
+        right = [entry for entry in right if entry is not r]
+        err = await cut(left + right) if right else None
+    return left + right
+
+
+async def bisect_cut(
+    entries: list[PlanEntry],
+    cut: Callable[
+        [list[PlanEntry], list[PlanEntry]], Awaitable[tuple[str | None, dict[str, str]]]
+    ],
+) -> tuple[list[CutResult], list[Conflict]]:
+    """
+    Cut all the entries together and, if chisel fails, bisect them
+    recursively to isolate the slices that fail on their own and the pairs of
+    slices that cannot be installed together.
+
+    cut(entries, unchecked) runs chisel on the entries and, if it succeeds,
+    checks the installed root for the unchecked entries. It returns the
+    chisel error and the errors of the checks by slice. Each entry is only
+    checked by the first cut that installs it, and the errors of the checks
+    do not trigger the bisection, since chisel did install the slices.
+    """
+    checks: dict[str, str | None] = {}
+
+    async def run(subset: list[PlanEntry]) -> str | None:
+        unchecked = [e for e in subset if full_slice_name(e[0], e[1]) not in checks]
+        err, errors = await cut(subset, unchecked)
+        if err is None:
+            for pkg, slice, _ in unchecked:
+                name = full_slice_name(pkg, slice)
+                checks[name] = errors.get(name)
+        return err
+
+    failed: dict[str, str] = {}
+    conflicts: list[Conflict] = []
+    err = await run(entries)
+    if err is not None:
+        await _isolate(entries, err, run, failed, conflicts)
+    results = []
+    for pkg, slice, covered in entries:
+        name = full_slice_name(pkg, slice)
+        results.append(CutResult(name, covered, failed.get(name) or checks.get(name)))
+    return results, conflicts
+
+
+class BatchSizer:
+    """
+    Adapt the number of slices cut together to the observed failure rate.
+
+    Every failure in a batch costs about log2(size) extra cuts to isolate, so
+    the batch size follows the optimal group size 1/sqrt(p) of Dorfman's
+    group testing, where p is the fraction of failed slices so far.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self.attempted = 0
+        self.failed = 0
+
+    def update(self, results: list[CutResult]) -> None:
+        self.attempted += len(results)
+        self.failed += sum(1 for r in results if r.error)
+
+    @property
+    def size(self) -> int:
+        if self.failed == 0:
+            return self.max_size
+        rate = self.failed / self.attempted
+        return max(1, min(self.max_size, round(1 / math.sqrt(rate))))
+
+
+async def install_slices(
+    queue: asyncio.Queue[WorkItem],
+    dry_run: bool,
+    release: str,
+    worker: int,
+    chisels: dict[str, str],
+    cache_dir: str,
+    sizer: BatchSizer,
+    slots: ConcurrencyController,
+    stats: dict[str, CacheStats] | None = None,
+    prefetchers: dict[str, Prefetcher] | None = None,
+    retries: RetryEngine | None = None,
+    deb_index: DebIndex | None = None,
+    manifest: tuple[str, str] | None = None,
+    manifest_cut: bool = False,
+) -> tuple[list[CutResult], list[Conflict], list[Divergence]]:
+    """
+    Install the groups of slices from the queue by running "chisel cut" on
+    their architecture, until the queue is empty. The slices of a group are
+    installed back to back by the same worker, see group_by_affinity().
+    Each planned entry also lists the slices covered by that cut, whose
+    copyright files are checked in the installed root as well, once per
+    entry.
+    Up to sizer.size entries of the same architecture are cut together, see
+    bisect_cut(). The stats and prefetchers are per architecture, retries is
+    shared by the whole run. The copyright files missing from the installed
+    roots are looked up in deb_index.
+
+    If given, manifest is the slice that generates chisel's manifest and the
+    path of the manifest in the root. The entries whose cut installs that
+    slice are checked against the manifest instead of their copyright files,
+    see verify_manifest(). With manifest_cut, the other entries are cut again
+    along with the slice, in a separate root, to check them as well.
+
+    The slices are cut with every chisel binary in chisels, given by version,
+    and the trees they install are compared to the one of the first version.
+    """
+    stats = stats or {}
+    prefetchers = prefetchers or {}
+    divergences: list[Divergence] = []
+
+    async def cut(
+        arch: str,
+        total_usage: CutUsage,
+        entries: list[PlanEntry],
+        unchecked: list[PlanEntry],
+    ) -> tuple[str | None, dict[str, str]]:
+        slice_names = [full_slice_name(pkg, slice) for pkg, slice, _ in entries]
+        pkgs = [pkg for pkg, _, _ in entries]
+        if arch in prefetchers:
+            with TRACER.span("wait for prefetch", "wait"):
+                await prefetchers[arch].wait(
+                    slice_names + ([manifest[0]] if manifest and manifest_cut else [])
+                )
+        roots = {version: tempfile.mkdtemp() for version in chisels}
+        tmpfs = next(iter(roots.values()))
+        usage = CutUsage()
+        try:
+            # The versions share the cache, so only the first one downloads.
+            for version, chisel in chisels.items():
+                err = await chisel_cut_shared_cache(
+                    pkgs=pkgs,
+                    arch=arch,
+                    release=release,
+                    root=roots[version],
+                    cache_dir=cache_dir,
+                    slots=slots,
+                    stats=stats.get(arch),
+                    slice_names=slice_names,
+                    chisel_version=version,
+                    chisel=chisel,
+                    retries=retries,
+                    usage=usage,
+                )
+                if err:
+                    return (f"chisel {version}: {err}" if len(chisels) > 1 else err), {}
+            usage.root_bytes = await asyncio.to_thread(tree_size, tmpfs)
+            if len(roots) > 1:
+                await compare_roots(arch, slice_names, roots)
+
+            # The errors of the checks are reported per slice, and keep it
+            # out of the result cache.
+            errors = await check_manifest(arch, unchecked, tmpfs)
+
+            # Check if the copyright file has been installed with the slices
+            # that were not checked against the manifest.
+            missing: dict[str, bool] = {}
+            for pkg, slice, covered in unchecked:
+                name = full_slice_name(pkg, slice)
+                if name in errors:
+                    continue
+                for covered_pkg in sorted({n.split("_", 1)[0] for n in covered}):
+                    if covered_pkg not in missing:
+                        missing[covered_pkg] = await copyright_missing(
+                            arch, tmpfs, covered_pkg
+                        )
+                    if missing[covered_pkg]:
+                        errors.setdefault(name, []).append(
+                            "{} has a copyright file but it wasn't installed.".format(
+                                covered_pkg,
+                            )
+                        )
+            return None, {name: "\n".join(e) for name, e in errors.items() if e}
+        finally:
+            total_usage.add(usage)
+            for root in roots.values():
+                with TRACER.span("remove root", "cleanup", root=root):
+                    await asyncio.to_thread(shutil.rmtree, root, ignore_errors=True)
+
+    async def check_manifest(
+        arch: str, unchecked: list[PlanEntry], root: str
+    ) -> dict[str, list[str]]:
+        """
+        Check the unchecked entries installed in root against the manifest
+        that chisel generated in it, if any. With manifest_cut, entries whose
+        cut did not generate the manifest are cut again along with the
+        manifest slice, in a separate root, to check them. Return the errors
+        of the entries that were checked, by slice.
+        """
+        if not manifest or not unchecked:
+            return {}
+        verify_root = root
+        if not pathlib.Path(root + manifest[1]).is_file():
+            if not manifest_cut:
+                return {}
+            verify_root = tempfile.mkdtemp()
+            version, chisel = next(iter(chisels.items()))
+            names = [full_slice_name(pkg, slice) for pkg, slice, _ in unchecked]
+            err = await chisel_cut_shared_cache(
+                pkgs=[pkg for pkg, _, _ in unchecked] + [manifest[0].split("_", 1)[0]],
                 arch=arch,
                 release=release,
-                root=tmpfs,
+                root=verify_root,
                 cache_dir=cache_dir,
-                slice_name=slice_name,
-                chisel_version=chisel_version,
+                slots=slots,
+                slice_names=names + [manifest[0]],
+                chisel_version=version,
+                chisel=chisel,
+                retries=retries,
             )
             if err:
-                logging.error("==============================================\n%s", err)
-                return
+                await asyncio.to_thread(shutil.rmtree, verify_root, ignore_errors=True)
+                if len(unchecked) == 1:
+                    return {
+                        names[0]: [
+                            f"cannot be installed with {manifest[0]} to check the "
+                            f"manifest: {err}"
+                        ]
+                    }
+                # Check the entries one by one to find those that cannot be
+                # installed with the manifest slice.
+                errors = {}
+                for entry in unchecked:
+                    errors.update(await check_manifest(arch, [entry], root))
+                return errors
+        try:
+            manifest_file = pathlib.Path(verify_root + manifest[1])
+            if not manifest_file.is_file():
+                return {}
+            errors = {}
+            for pkg, slice, covered in unchecked:
+                name = full_slice_name(pkg, slice)
+                with TRACER.span("verify manifest", "check", slice=name) as trace_args:
+                    try:
+                        errors[name] = await asyncio.to_thread(
+                            verify_manifest, manifest_file, verify_root, covered, deb_index
+                        )
+                    except ManifestError as e:
+                        errors[name] = [str(e)]
+                    trace_args["errors"] = len(errors[name])
+            return errors
+        finally:
+            if verify_root != root:
+                with TRACER.span("remove root", "cleanup", root=verify_root):
+                    await asyncio.to_thread(shutil.rmtree, verify_root, ignore_errors=True)
+
+    async def copyright_missing(arch: str, root: str, pkg: str) -> bool:
+        copyright_file = pathlib.Path(f"{root}/usr/share/doc/{pkg}/copyright")
+        if copyright_file.is_file() or copyright_file.is_symlink():
+            return False
+        # Does the copyright file exist in the deb?
+        info = prefetchers[arch].index.get(pkg) if arch in prefetchers else None
+        with TRACER.span("deb_has_copyright_file", "check", package=pkg) as trace_args:
+            trace_args["result"] = await asyncio.to_thread(
+                deb_has_copyright_file,
+                pkg,
+                chisel_pkg_cache(cache_dir),
+                deb_index,
+                info.sha256 if info else None,
+            )
+        return trace_args["result"]
 
-            # Check if the copyright file has been installed with this slice
-            copyright_file = pathlib.Path(f"{tmpfs}/usr/share/doc/{pkg}/copyright")
-            if not copyright_file.is_file() and not copyright_file.is_symlink():
-                # Does the copyright file exist in the deb?
-                if deb_has_copyright_file(pkg):
-                    err = "{} has a copyright file but it wasn't installed.".format(
-                        pkg,
+    async def compare_roots(
+        arch: str, slice_names: list[str], roots: dict[str, str]
+    ) -> None:
+        (base_version, base_root), *others = roots.items()
+        with TRACER.span("compare roots", "check", versions=list(roots)):
+            base = await asyncio.to_thread(snapshot_tree, base_root)
+            for version, root in others:
+                differences = diff_trees(
+                    base, await asyncio.to_thread(snapshot_tree, root)
+                )
+                if differences:
+                    logging.warning(
+                        "chisel %s and %s install %s differently on %s:\n%s",
+                        base_version,
+                        version,
+                        " ".join(slice_names),
+                        arch,
+                        "\n".join(differences),
+                    )
+                    divergences.append(
+                        Divergence(slice_names, arch, (base_version, version), differences)
                     )
-                    logging.error(err)
 
+    _trace_worker.set(f"worker {worker}")
+    results: list[CutResult] = []
+    conflicts: list[Conflict] = []
+    pending: list[tuple[str, PlanEntry]] = []
+
+    def fill() -> None:
+        while len(pending) < sizer.size and not queue.empty():
+            arch, group = queue.get_nowait()
+            pending.extend((arch, entry) for entry in group)
+
+    async def install_batch(arch: str, batch: list[PlanEntry]) -> None:
+        start = time.monotonic()
+        usage = CutUsage()
+        with TRACER.span(
+            " ".join(full_slice_name(pkg, slice) for pkg, slice, _ in batch),
+            "slice",
+            arch=arch,
+        ) as trace_args:
+            batch_results, batch_conflicts = await bisect_cut(
+                batch, functools.partial(cut, arch, usage)
+            )
+            trace_args.update(dataclasses.asdict(usage))
+        for result in batch_results:
+            result.duration = (time.monotonic() - start) / len(batch)
+            result.arch = arch
+            result.usage = usage.share(len(batch))
+        for conflict in batch_conflicts:
+            conflict.arch = arch
+        sizer.update(batch_results)
+        results.extend(batch_results)
+        conflicts.extend(batch_conflicts)
+        for conflict in batch_conflicts:
+            logging.error(
+                "%s and %s cannot be installed together on %s:\n%s",
+                *conflict.slices,
+                arch,
+                conflict.error,
+            )
+        for err in (r.error for r in batch_results if r.error):
+            logging.error("==============================================\n%s", err)
+
+    while not queue.empty():
+        # Only as many workers as the concurrency limit take groups off the
+        # queue, and until they have cut them, so that the first groups, the
+        # longest ones, are not held by workers waiting for a slot.
+        async with slots.worker():
+            fill()
+            while pending:
+                # Only the slices of the same architecture can be cut together.
+                arch = pending[0][0]
+                batch: list[PlanEntry] = []
+                rest = []
+                for item in pending:
+                    if item[0] == arch and len(batch) < sizer.size:
+                        batch.append(item[1])
+                    else:
+                        rest.append(item)
+                pending[:] = rest
+                logging.info(
+                    "Worker %d (%d groups left): Installing %s on %s...",
+                    worker,
+                    queue.qsize(),
+                    " ".join(full_slice_name(pkg, slice) for pkg, slice, _ in batch),
+                    arch,
+                )
+                if not dry_run:
+                    await install_batch(arch, batch)
+                if pending:
+                    fill()
+    return results, conflicts, divergences
 
-def deb_has_copyright_file(pkg: str) -> bool:
+
+async def install_all_slices(
+    groups: list[WorkItem],
+    dry_run: bool,
+    release: str,
+    chisels: dict[str, str],
+    cache_dir: str,
+    controller: ConcurrencyController,
+    batch_size: int,
+    stats: dict[str, CacheStats] | None = None,
+    prefetchers: dict[str, Prefetcher] | None = None,
+    retries: RetryEngine | None = None,
+    manifest: tuple[str, str] | None = None,
+    manifest_cut: bool = False,
+    replan: Callable[[list[CutResult]], list[WorkItem]] | None = None,
+) -> tuple[list[CutResult], list[Conflict], list[Divergence]]:
     """
-    Checks if a deb's contents comprise a copyright file
+    Install all the planned groups of slices, of all the architectures, with
+    workers pulling from a shared queue, so that no worker sits idle while
+    there is work left, and every slice is attempted even if others fail.
+    The controller decides how many of the workers take groups off the queue
+    and run chisel at the same time.
+    If given, the prefetchers download the packages of each architecture
+    ahead of the cuts. The failed cuts are retried as retries decides.
+    If given, manifest is the slice that generates chisel's manifest, which
+    checks the cuts that install it, or all of them with manifest_cut, see
+    install_slices().
+    Every chisel binary in chisels, given by version, cuts every slice, see
+    install_slices().
+    If given, replan returns more groups to install from the results of the
+    groups installed so far, until it returns none. These groups may only
+    need the packages of the planned groups, which are already prefetched.
+    """
+    queue: asyncio.Queue[WorkItem] = asyncio.Queue()
+    for item in groups:
+        queue.put_nowait(item)
+    sizer = BatchSizer(batch_size)
+    retries = retries or RetryEngine()
+    # The index of the debs lives with the cache it indexes.
+    deb_index = DebIndex(
+        pathlib.Path(cache_dir, "deb-index.sqlite"), chisel_pkg_cache(cache_dir)
+    )
+    prefetches = []
+    for arch, prefetcher in (prefetchers or {}).items():
+        slice_names = [
+            full_slice_name(pkg, slice)
+            for group_arch, group in groups
+            if group_arch == arch
+            for pkg, slice, _ in group
+        ]
+        if manifest and manifest_cut:
+            slice_names.append(manifest[0])
+        prefetches.append(asyncio.create_task(prefetcher.run(slice_names)))
+    # Let the prefetchers register the packages before the cuts wait.
+    await asyncio.sleep(0)
+    results: list[CutResult] = []
+    conflicts: list[Conflict] = []
+    divergences: list[Divergence] = []
+    while not queue.empty():
+        worker_results = await asyncio.gather(
+            *(
+                install_slices(
+                    queue,
+                    dry_run,
+                    release,
+                    worker,
+                    chisels,
+                    cache_dir,
+                    sizer,
+                    controller,
+                    stats,
+                    prefetchers,
+                    retries,
+                    deb_index,
+                    manifest,
+                    manifest_cut,
+                )
+                for worker in range(1, controller.max_workers + 1)
+            )
+        )
+        round_results = [r for worker_result, _, _ in worker_results for r in worker_result]
+        results += round_results
+        for _, worker_conflicts, worker_divergences in worker_results:
+            conflicts += worker_conflicts
+            divergences += worker_divergences
+        for item in replan(round_results) if replan else []:
+            queue.put_nowait(item)
+    await asyncio.gather(*prefetches)
+    deb_index.close()
+    return results, conflicts, divergences
 
-    NOTE: this is a temporary and convoluted implementation, as at the moment
-    we don't have an easy and reliable way to check which deb was used for
-    the installation (at least not without duplicating a some of the Chisel
-    codebase).
 
-    TODO: update this function once the Chisel DB is available, as the pkg
-    SHAs will be available from the DB itself.
+def execution_plan(
+    work: list[WorkItem],
+    closures: dict[str, dict[str, set[str]]],
+    indices: dict[str, dict[str, PackageInfo]],
+    durations: dict[str, dict[str, float]],
+    workers: int,
+    pkg_cache: pathlib.Path | None = None,
+) -> dict:
+    """
+    Describe what installing the queued work would take: the cuts in queue
+    order with the packages they need, the packages to download and their
+    sizes, the expected hits in the shared cache (packages already in
+    pkg_cache, or needed by an earlier cut), and the wall-clock time on
+    the given number of workers.
+
+    durations gives the estimated seconds of each cut of the architectures
+    with a history, see estimate_durations(). Times are None when unknown.
     """
-    for sha_file in pathlib.Path(CHISEL_PKG_CACHE).rglob("*"):
+    seen: dict[str, set[str]] = collections.defaultdict(set)
+    if pkg_cache is not None and pkg_cache.is_dir():
+        cached_digests = {path.name for path in pkg_cache.iterdir()}
+        for arch, index in indices.items():
+            seen[arch] = {pkg for pkg, info in index.items() if info.sha256 in cached_digests}
+    cuts = []
+    packages: dict[str, dict[str, dict[str, int | str]]] = collections.defaultdict(dict)
+    download_bytes: dict[str, int] = collections.defaultdict(int)
+    hits = misses = 0
+    # Each group goes to the worker that frees up first.
+    free_at: list[float] | None = [0.0] * max(1, workers)
+    for arch, group in work:
+        index = indices.get(arch, {})
+        group_seconds: float | None = 0.0
+        for pkg, slice, covered in group:
+            name = full_slice_name(pkg, slice)
+            needed = sorted({n.split("_", 1)[0] for n in closures[arch].get(name, {name})})
+            cut_hits = [p for p in needed if p in seen[arch]]
+            for p in needed:
+                if p in index:
+                    info = index[p]
+                    packages[arch][p] = {
+                        "version": info.version,
+                        "size": info.size,
+                        "installed_size": info.installed_size,
+                    }
+                    if p not in seen[arch]:
+                        download_bytes[arch] += info.size
+            hits += len(cut_hits)
+            misses += len(needed) - len(cut_hits)
+            seen[arch].update(needed)
+            seconds = durations[arch].get(name) if arch in durations else None
+            if seconds is None or group_seconds is None:
+                group_seconds = None
+            else:
+                group_seconds += seconds
+            cuts.append(
+                {
+                    "arch": arch,
+                    "slice": name,
+                    "covers": covered,
+                    "packages": needed,
+                    "cache_hits": cut_hits,
+                    "estimated_seconds": None if seconds is None else round(seconds, 3),
+                }
+            )
+        if group_seconds is None or free_at is None:
+            free_at = None
+        else:
+            heapq.heappush(free_at, heapq.heappop(free_at) + group_seconds)
+    cpu_seconds = None
+    if all(cut["estimated_seconds"] is not None for cut in cuts):
+        cpu_seconds = round(sum(cut["estimated_seconds"] for cut in cuts), 3)
+    return {
+        "workers": workers,
+        "cuts": cuts,
+        "packages": {arch: dict(sorted(pkgs.items())) for arch, pkgs in packages.items()},
+        "download_bytes": dict(download_bytes),
+        "cache": {"hits": hits, "misses": misses},
+        "cut_seconds": cpu_seconds,
+        "estimated_seconds": None if free_at is None else round(max(free_at), 3),
+    }
+
+
+# The modules whose checks decide the outcome of a cut, besides this one.
+_CHECK_MODULES = ("archive_index", "chisel_manifest", "deb_reader", "package_table")
+
+
+def result_cache_context(
+    arch: str, archive: Archive, chisels: dict[str, str], release: str
+) -> str:
+    """
+    Return the digest of what, besides the slice definitions and the package
+    versions, the outcome of a cut depends on: the architecture, the archive,
+    the chisel.yaml of the release if it is local, the chisel binaries, given
+    by version, and the sources of the checks. Branches like "main" move, so
+    the path and digest of each binary are included along with its version.
+    """
+    digest = hashlib.sha256()
+    for value in (
+        arch,
+        json.dumps(archive.__dict__, sort_keys=True),
+        *itertools.chain.from_iterable(chisels.items()),
+    ):
+        digest.update(value.encode())
+        digest.update(b"\0")
+    files = [shutil.which(chisel) for chisel in chisels.values()]
+    if "/" in release:
+        files.append(os.path.join(release, "chisel.yaml"))
+    files.append(__file__)
+    files += [sys.modules[name].__file__ for name in _CHECK_MODULES]
+    for path in files:
+        if path and os.path.isfile(path):
+            with open(path, "rb") as f:
+                while chunk := f.read(1 << 20):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def result_cache_key(
+    entry: PlanEntry,
+    closures: dict[str, set[str]],
+    packages: dict[str, Package],
+    versions: dict[str, str],
+    context: str,
+    manifest: str | None = None,
+) -> str | None:
+    """
+    Return the key of the outcome of a planned cut: the digest of the context
+    (see result_cache_context()), of the slice that generates the manifest
+    if any, and of the slice definition file and archive version of every
+    package the cut installs, the manifest slice included. Return None if
+    any of them is unknown, in which case the outcome cannot be cached.
+    """
+    pkg, slice, _ = entry
+    name = full_slice_name(pkg, slice)
+    needed = {n.split("_", 1)[0] for n in closures.get(name, {name})}
+    if manifest:
+        needed |= {n.split("_", 1)[0] for n in closures.get(manifest, {manifest})}
+    digest = hashlib.sha256(f"{context}\0{name}\0{manifest or ''}\0".encode())
+    for p in sorted(needed):
+        if p not in packages or not packages[p].digest or p not in versions:
+            return None
+        digest.update(f"{p}\0{packages[p].digest}\0{versions[p]}\0".encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent store of the cuts that passed, keyed by result_cache_key(), so
+    that the slices whose inputs did not change since are not cut again.
+    Each entry is a small file, and the least recently used entries are
+    evicted beyond max_entries.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = pathlib.Path(path)
+        self.max_entries = max_entries
+
+    def _entry(self, key: str) -> pathlib.Path:
+        return self.path / key[:2] / key
+
+    def get(self, key: str) -> bool:
+        """
+        Return True if the cut with this key passed before.
+        """
+        entry = self._entry(key)
         try:
-            sha_type = magic.from_file(str(sha_file), mime=True)
-        except:
-            # Ignore any other kind
-            continue
+            # Mark the entry as recently used.
+            os.utime(entry)
+        except FileNotFoundError:
+            return False
+        return True
 
-        if sha_type and "debian.binary-package" in sha_type:
-            deb_path = str(pathlib.Path(CHISEL_PKG_CACHE / sha_file))
-            sha_pkg = os.popen(f"dpkg-deb -f {deb_path} Package").read().strip()
+    def add(self, key: str, slice_names: list[str]) -> None:
+        """
+        Record that the cut with this key passed, installing slice_names.
+        """
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=entry.parent, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"slices": slice_names, "time": time.time()}, f)
+        os.replace(tmp_path, entry)
 
-            if sha_pkg == pkg:
-                deb = DebPackage(deb_path)
-                return f"usr/share/doc/{pkg}/copyright" in deb.filelist
+    def prune(self) -> int:
+        """
+        Evict the least recently used entries beyond max_entries. Return the
+        number of evicted entries.
+        """
+        entries = []
+        for entry in self.path.glob("??/*"):
+            if not entry.name.startswith("."):
+                entries.append((entry.stat().st_mtime, entry))
+        entries.sort(reverse=True)
+        for _, entry in entries[self.max_entries :]:
+            entry.unlink(missing_ok=True)
+        return max(0, len(entries) - self.max_entries)
 
-    return False
+
+def load_history(report_path: str) -> dict[str, dict[str, float]]:
+    """
+    Load the duration of each cut on each architecture from the report of a
+    previous run.
+    """
+    with open(report_path, "r", encoding="utf-8") as f:
+        return json.load(f).get("durations", {})
+
+
+def slice_timings(results: list[CutResult]) -> list[SliceTiming]:
+    """
+    Return the timings of the slices cut in this run, per chisel version.
+    """
+    timings = []
+    for result in results:
+        if result.usage is None:
+            continue
+        for version, chisel in result.usage.chisel.items():
+            timings.append(
+                SliceTiming(
+                    arch=result.arch,
+                    slice=result.slice_name,
+                    chisel_version=version,
+                    total=round(result.duration, 3),
+                    seconds=round(sum(chisel.attempts), 3),
+                    attempts=chisel.attempts,
+                    retries=chisel.retries,
+                    cache_hits=chisel.cache_hits,
+                    cache_misses=chisel.cache_misses,
+                    failed=result.error is not None,
+                )
+            )
+    return timings
+
+
+def report_installation(
+    plans: dict[str, list[PlanEntry]],
+    results: list[CutResult],
+    report_path: str | None,
+    conflicts: list[Conflict] | None = None,
+    extra: dict | None = None,
+) -> None:
+    """
+    Log which cut proved each slice installable on each architecture, and
+    write it as JSON to report_path if given, along with the status of each
+    slice per architecture and the extra sections. The slices covered by a
+    cut that failed are reported as untested, unless they were planned
+    again under other cuts, see replan_failed().
+    """
+    cuts = {(r.arch, r.slice_name): r for r in results}
+    report = []
+    matrix: dict[str, dict[str, str]] = collections.defaultdict(dict)
+    for arch, plan in plans.items():
+        arch_report = []
+        for pkg, slice, covered in plan:
+            root = full_slice_name(pkg, slice)
+            result = cuts.get((arch, root))
+            if result is None:
+                status = "not verified"
+            elif result.error:
+                status = "failed"
+            elif result.cached:
+                status = "cached pass"
+            else:
+                status = "installed"
+            for name in covered:
+                # The essentials of a failed slice were not tested on their
+                # own, so they did not fail.
+                name_status = "untested" if status == "failed" and name != root else status
+                arch_report.append(
+                    {"slice": name, "arch": arch, "status": name_status, "installed_by": root}
+                )
+                matrix[name][arch] = name_status
+        n_installed = sum(1 for entry in arch_report if entry["status"] == "installed")
+        n_cached = sum(1 for entry in arch_report if entry["status"] == "cached pass")
+        logging.info(
+            "%s: %d/%d slices installed, %d passed before (%d/%d planned cuts attempted)",
+            arch,
+            n_installed,
+            len(arch_report),
+            n_cached,
+            sum(1 for r in results if r.arch == arch and not r.cached),
+            len(plan),
+        )
+        report += arch_report
+    report.sort(key=lambda entry: (entry["slice"], entry["arch"]))
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "slices": report,
+                    "matrix": {name: matrix[name] for name in sorted(matrix)},
+                    "conflicts": [
+                        {"slices": list(c.slices), "arch": c.arch, "error": c.error}
+                        for c in conflicts or []
+                    ],
+                    **(extra or {}),
+                },
+                f,
+                indent=2,
+            )
 
 
 def main() -> None:
@@ -454,66 +3593,480 @@ def main() -> None:
     """
     configure_logging()
     cli_args = parse_args()
+    TRACER.enabled = cli_args.trace is not None
     # Parse slice definition files.
     packages = []
     for file in cli_args.files:
         pkg = parse_package(file)
         packages.append(pkg)
+    changed = {p.package for p in packages}
+    if cli_args.since:
+        files, deleted = changed_slice_definitions(cli_args.release, cli_args.since)
+        for file in files:
+            pkg = parse_package(file)
+            if pkg.package not in changed:
+                packages.append(pkg)
+                changed.add(pkg.package)
+        changed |= deleted
+    # Essentials are crawled in the whole release, when available, so that
+    # the closures are complete.
+    arches = list(dict.fromkeys(cli_args.arch))
+    chisels = dict(cli_args.chisel) or {cli_args.chisel_version: "chisel"}
+    release_packages = {p.package: p for p in parse_release_packages(cli_args.release)}
+    # Errors in the slice definitions doom the cuts of the slices they
+    # affect. Only a local release can be checked as a whole.
+    release_errors: list[PreflightError] = []
+    if release_packages and not cli_args.no_preflight:
+        with TRACER.span("preflight", "setup"):
+            release_errors = preflight_release(
+                list({**release_packages, **{p.package: p for p in packages}}.values())
+            )
+        for e in release_errors:
+            logging.error("Preflight: %s", e.error)
+    release_packages.update((p.package, p) for p in packages)
+    closures = {
+        arch: essential_closures(list(release_packages.values()), arch)
+        for arch in arches
+    }
+    manifest = None
+    if cli_args.manifest_slice != "none":
+        manifest = find_manifest_slice(
+            list(release_packages.values()), cli_args.manifest_slice
+        )
+        if manifest:
+            logging.info("Checking the installed trees with the manifest of %s", manifest[0])
+        elif cli_args.manifest_slice:
+            logging.warning("%s does not generate a manifest", cli_args.manifest_slice)
+    # Packages to install on each architecture.
+    arch_packages = {arch: packages for arch in arches}
+    # Also install the slices that depend on the changed ones.
+    if cli_args.with_dependents:
+        for arch in arches:
+            impacted: dict[str, list[str]] = collections.defaultdict(list)
+            for name in sorted(impacted_slices(changed, closures[arch])):
+                pkg, slice = name.split("_", 1)
+                if pkg in release_packages:
+                    impacted[pkg].append(slice)
+            logging.info(
+                "%d slices of %d packages are impacted on %s by the changes to %d packages",
+                sum(len(slices) for slices in impacted.values()),
+                len(impacted),
+                arch,
+                len(changed),
+            )
+            arch_packages[arch] = [
+                dataclasses.replace(release_packages[pkg], slices=slices)
+                for pkg, slices in impacted.items()
+            ]
+    all_packages = sorted({p.package for pkgs in arch_packages.values() for p in pkgs})
     # Ensure package existence for at least one architecture. This means that
     # each package must be present in the archive for at least one of the
     # architectures.
+    archive = parse_archive(cli_args.release)
+    availability = Availability.load(cli_args.availability) if cli_args.availability else None
+    if cli_args.packages_table:
+        # The essentials are among the packages of the release.
+        try:
+            with PackageTable(cli_args.packages_table) as table:
+                availability = Availability.from_table(
+                    table, sorted(set(all_packages) | release_packages.keys())
+                )
+        except PackageTableError as e:
+            logging.error("%s", e)
+            sys.exit(1)
     if cli_args.ensure_existence:
-        archive = parse_archive(cli_args.release)
-        ensure_package_existence([p.package for p in packages], archive)
-    # Ignore packages who do not exist in the archive for this particular
-    # architecture.
-    if cli_args.ignore_missing:
-        packages, ignored = ignore_missing_packages(
-            packages, cli_args.arch, cli_args.release
+        ensure_package_existence(all_packages, archive, availability)
+    # Ignore packages who do not exist in the archive for a particular
+    # architecture. A single query covers all the architectures, and the
+    # packages of the essentials, which cannot be missing.
+    available: dict[str, set[str]] | None = None
+    if cli_args.ignore_missing and all_packages:
+        essential_pkgs = {
+            name.split("_", 1)[0]
+            for arch in arches
+            for p in arch_packages[arch]
+            for slice in p.slices
+            for name in closures[arch].get(full_slice_name(p.package, slice), ())
+        }
+        found = query_package_architectures(
+            sorted(set(all_packages) | essential_pkgs),
+            archive,
+            arches,
+            availability=availability,
         )
-        if len(ignored) > 0:
-            logging.info("The following packages will be IGNORED:")
-            for pkg in ignored:
-                logging.info("  - %s", pkg.package)
+        available = {
+            arch: {pkg for pkg, pkg_arches in found.items() if arch in pkg_arches}
+            for arch in arches
+        }
+        for arch in arches:
+            ignored = [p for p in arch_packages[arch] if arch not in found.get(p.package, ())]
+            if len(ignored) > 0:
+                logging.info("The following packages will be IGNORED on %s:", arch)
+                for pkg in ignored:
+                    logging.info("  - %s", pkg.package)
+            arch_packages[arch] = [p for p in arch_packages[arch] if p not in ignored]
     #
-    if len(packages) > 0:
+    installed = sorted({p.package for pkgs in arch_packages.values() for p in pkgs})
+    if len(installed) > 0:
         logging.info(
             "Slices of the following %s packages will be INSTALLED (available workers=%s):",
-            len(packages),
+            len(installed),
             cli_args.workers,
         )
-        for pkg in packages:
-            logging.info("  - %s", pkg.package)
+        for pkg in installed:
+            logging.info("  - %s", pkg)
     else:
         logging.info("No slices will be installed.")
         return
 
-    # TODO: this list of slices can still be reduced, since many of these
-    # will come as essentials of other slices. We could simply crawl all essentials
-    # in the release, and remove them from the "all_slices" list (since they
-    # are going to get installed anyway). The problem here is accounting: I'd like
-    # to ensure that all slices are still installed nonetheless, even if indirectly,
-    # but that means `install_slices` will have to be aware of the nested essentials.
-    all_slices = [(pkg.package, slice) for pkg in packages for slice in pkg.slices]
-
-    chunk_size = math.ceil(len(all_slices) / cli_args.workers)
-    chunks_of_slices: list[tuple[list[tuple[str, str]], bool, str, str, int, str]] = [
-        (
-            all_slices[i : i + chunk_size],
-            cli_args.dry_run,
-            cli_args.arch,
-            cli_args.release,
-            i // chunk_size + 1,  # worker number
-            cli_args.chisel_version,
+    # Many slices get installed anyway as essentials of other slices, so only
+    # cut the slices that are not covered by others.
+    plans: dict[str, list[PlanEntry]] = {}
+    with TRACER.span("plan", "setup"):
+        for arch in arches:
+            all_slices = [
+                (pkg.package, slice) for pkg in arch_packages[arch] for slice in pkg.slices
+            ]
+            plans[arch] = plan_installation(all_slices, closures[arch])
+            logging.info(
+                "Installing %d slices with %d cuts on %s",
+                len(all_slices),
+                len(plans[arch]),
+                arch,
+            )
+
+    with contextlib.ExitStack() as stack:
+        # All the workers share the same chisel cache, so that the archive
+        # indices and the packages are only downloaded once per run.
+        cache_dir = cli_args.cache_dir
+        if cache_dir is None:
+            cache_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # To check that all the slices can be installed together, cut them
+        # all at once and bisect on failure, which takes about log2(N) cuts.
+        if cli_args.co_installable:
+            controller = ConcurrencyController(1, 1, 1)
+        else:
+            controller = ConcurrencyController(
+                cli_args.workers,
+                cli_args.min_workers,
+                cli_args.max_workers or max(cli_args.workers, os.cpu_count() or 1),
+            )
+        retries = RetryEngine(
+            default_retry_policies(cli_args.retry_delay), cli_args.retry_budget
+        )
+        # The result cache does not tell whether slices install together.
+        result_cache = None
+        if not cli_args.no_cache and not cli_args.co_installable:
+            result_cache = ResultCache(
+                cli_args.result_cache, cli_args.result_cache_size
+            )
+        history = load_history(cli_args.history) if cli_args.history else {}
+        prefetch = not cli_args.dry_run and cli_args.prefetch_workers > 0
+        groups: list[tuple[float, WorkItem]] = []
+        keys: dict[str, dict[str, str]] = {}
+        cached_results: list[CutResult] = []
+        stats: dict[str, CacheStats] = {}
+        prefetchers: dict[str, Prefetcher] = {}
+        indices: dict[str, dict[str, PackageInfo]] = {}
+        estimates: dict[str, dict[str, float]] = {}
+        preflight_results: list[CutResult] = []
+        doomed_by_arch: dict[str, dict[str, str]] = {}
+
+        def read_index(arch: str) -> dict[str, PackageInfo]:
+            try:
+                with TRACER.span("fetch package index", "setup", arch=arch):
+                    return fetch_packages_index(
+                        archive.suites,
+                        archive.components,
+                        arch,
+                        base_url=cli_args.archive_url,
+                    )
+            except (OSError, requests.RequestException) as e:
+                logging.warning("Cannot read the archive package index: %s", e)
+                return {}
+
+        def preflight(arch: str, entries: list[PlanEntry]) -> dict[str, str]:
+            doomed = preflight_plan(entries, closures[arch], release_errors)
+            if available is not None and not cli_args.no_preflight:
+                missing = preflight_arch(entries, closures[arch], available[arch])
+                for error in missing.values():
+                    logging.error("Preflight on %s: %s", arch, error)
+                doomed = {**missing, **doomed}
+            return doomed
+
+        for arch in arches:
+            # Do not cut the slices that are bound to fail, and plan the
+            # slices they cover under other roots, which preflight checks
+            # in turn.
+            plan = plans[arch]
+            doomed: dict[str, str] = {}
+            new = plan
+            while new_doomed := preflight(arch, new):
+                doomed.update(new_doomed)
+                plan, new = replan_failed(plan, closures[arch], set(new_doomed))
+                plan += new
+            plans[arch] = plan
+            if doomed:
+                logging.info(
+                    "%d/%d planned cuts on %s are bound to fail and are skipped",
+                    len(doomed),
+                    len(plan),
+                    arch,
+                )
+                to_skip = [e for e in plan if full_slice_name(e[0], e[1]) in doomed]
+                plan = [e for e in plan if full_slice_name(e[0], e[1]) not in doomed]
+                for pkg, slice, covered in to_skip:
+                    name = full_slice_name(pkg, slice)
+                    preflight_results.append(CutResult(name, covered, doomed[name], arch=arch))
+            doomed_by_arch[arch] = doomed
+            # Slices take about as long on all the architectures, so fall
+            # back to the history of the others.
+            arch_history = history.get(arch) or {
+                name: seconds for h in history.values() for name, seconds in h.items()
+            }
+            index: dict[str, PackageInfo] | None = None
+            # Skip the cuts that passed before with the same inputs. The
+            # versions of the packages are the ones of the availability
+            # matrix, if it covers the architecture, so that a run with
+            # nothing left to cut does not read the package index.
+            to_cut = plan
+            keys[arch] = {}
+            if result_cache:
+                if (
+                    availability is not None
+                    and availability.release == f"ubuntu-{archive.version}"
+                    and arch in availability.arches
+                ):
+                    versions = availability.versions(arch)
+                else:
+                    index = read_index(arch)
+                    versions = {pkg: info.version for pkg, info in index.items()}
+                context = result_cache_context(
+                    arch, archive, chisels, cli_args.release
+                )
+                to_cut = []
+                for entry in plan:
+                    name = full_slice_name(entry[0], entry[1])
+                    key = result_cache_key(
+                        entry,
+                        closures[arch],
+                        release_packages,
+                        versions,
+                        context,
+                        manifest[0] if manifest and cli_args.manifest_cut else None,
+                    )
+                    if key:
+                        keys[arch][name] = key
+                    if key and result_cache.get(key):
+                        cached_results.append(
+                            CutResult(name, entry[2], cached=True, arch=arch)
+                        )
+                    else:
+                        to_cut.append(entry)
+                logging.info(
+                    "%d/%d planned cuts on %s passed before and are skipped",
+                    len(plan) - len(to_cut),
+                    len(plan),
+                    arch,
+                )
+            # The package index is needed to prefetch the packages, and to
+            # estimate the cut durations that are not in the history.
+            if (
+                index is None
+                and to_cut
+                and (
+                    prefetch
+                    or cli_args.plan
+                    or (
+                        cli_args.order == "lpt"
+                        and any(
+                            full_slice_name(pkg, slice) not in arch_history
+                            for pkg, slice, _ in to_cut
+                        )
+                    )
+                )
+            ):
+                index = read_index(arch)
+            index = index or {}
+            # No group is longer than the share of a worker, so that the
+            # workers can share the packages with many slices.
+            arch_groups = group_by_affinity(
+                to_cut,
+                closures[arch] if cli_args.affinity == "essentials" else None,
+                max(
+                    cli_args.batch_size,
+                    math.ceil(len(to_cut) / controller.max_workers),
+                ),
+            )
+            durations: dict[str, float] = {}
+            if cli_args.order == "lpt" or cli_args.plan:
+                durations = estimate_durations(
+                    to_cut, closures[arch], index, arch_history
+                )
+            if cli_args.order == "lpt":
+                arch_groups = order_longest_first(arch_groups, durations)
+            indices[arch] = index
+            # Without a history, the durations are only relative.
+            if arch_history:
+                estimates[arch] = durations
+            for group in arch_groups:
+                duration = sum(
+                    durations.get(full_slice_name(pkg, slice), 0)
+                    for pkg, slice, _ in group
+                )
+                groups.append((duration, (arch, group)))
+            if prefetch and index:
+                # The architectures share the parallel downloads.
+                prefetchers[arch] = Prefetcher(
+                    index,
+                    closures[arch],
+                    chisel_pkg_cache(cache_dir),
+                    cli_args.archive_url or archive_url(arch),
+                    max(1, cli_args.prefetch_workers // len(arches)),
+                )
+            stats[arch] = CacheStats(closures[arch], index, chisel_pkg_cache(cache_dir))
+        # Interleave the architectures, longest groups first (the sort is
+        # stable, so this keeps the given order otherwise).
+        if cli_args.order == "lpt":
+            groups.sort(key=lambda item: -item[0])
+        if cli_args.plan:
+            execution = execution_plan(
+                [item for _, item in groups],
+                closures,
+                indices,
+                estimates,
+                int(controller.limit),
+                chisel_pkg_cache(cache_dir),
+            )
+            execution["skipped"] = [
+                {"arch": r.arch, "slice": r.slice_name, "covers": r.covered}
+                for r in cached_results
+            ]
+            with open(cli_args.plan, "w", encoding="utf-8") as f:
+                json.dump(execution, f, indent=2)
+            logging.info(
+                "Plan: %d cuts, %.1f MB to download, %s",
+                len(execution["cuts"]),
+                sum(execution["download_bytes"].values()) / 1e6,
+                "unknown duration"
+                if execution["estimated_seconds"] is None
+                else f"about {execution['estimated_seconds']:.1f}s",
+            )
+        def replan(round_results: list[CutResult]) -> list[WorkItem]:
+            # A failed cut tells nothing of the slices it covers, so cut them
+            # under other roots, until each slice passed or failed itself.
+            work = []
+            for arch in arches:
+                failed = {r.slice_name for r in round_results if r.arch == arch and r.error}
+                plan, new = replan_failed(plans[arch], closures[arch], failed)
+                plans[arch] = plan + new
+                if new:
+                    logging.info(
+                        "Installing the slices covered by failed cuts with %d cuts on %s",
+                        len(new),
+                        arch,
+                    )
+                    work += [(arch, group) for group in group_by_affinity(new)]
+            return work
+
+        results, conflicts, divergences = asyncio.run(
+            install_all_slices(
+                [item for _, item in groups],
+                cli_args.dry_run,
+                cli_args.release,
+                chisels,
+                cache_dir,
+                controller,
+                batch_size=(
+                    max(len(plan) for plan in plans.values())
+                    if cli_args.co_installable
+                    else cli_args.batch_size
+                ),
+                stats=stats,
+                prefetchers=prefetchers,
+                retries=retries,
+                manifest=manifest,
+                manifest_cut=cli_args.manifest_cut,
+                replan=replan,
+            )
         )
-        for i in range(0, len(all_slices), chunk_size)
-    ]
 
-    with ProcessPoolExecutor() as executor:
-        futures = [
-            executor.submit(install_slices, *chunk) for chunk in chunks_of_slices
-        ]
-        _ = [future.result() for future in as_completed(futures)]
+    if result_cache:
+        # Keep reporting the divergences between chisel versions.
+        divergent = {(d.arch, name) for d in divergences for name in d.slices}
+        for result in results:
+            key = keys[result.arch].get(result.slice_name)
+            if result.error is None and key and (result.arch, result.slice_name) not in divergent:
+                result_cache.add(key, result.covered)
+        result_cache.prune()
+
+    durations_by_arch: dict[str, dict[str, float]] = {arch: {} for arch in arches}
+    resources_by_arch: dict[str, dict[str, dict]] = {arch: {} for arch in arches}
+    for result in results:
+        durations_by_arch[result.arch][result.slice_name] = round(result.duration, 3)
+        if result.usage:
+            resources_by_arch[result.arch][result.slice_name] = dataclasses.asdict(
+                result.usage
+            )
+    report_installation(
+        plans,
+        cached_results + preflight_results + results,
+        cli_args.report,
+        conflicts,
+        extra={
+            "durations": durations_by_arch,
+            "resources": resources_by_arch,
+            "concurrency": controller.history,
+            "cache": {arch: stats[arch].summary() for arch in arches},
+            "prefetch": {arch: p.downloads for arch, p in prefetchers.items()},
+            "divergences": [dataclasses.asdict(d) for d in divergences],
+            "retries": retries.summary(),
+            "preflight": {
+                "release": [dataclasses.asdict(e) for e in release_errors],
+                "doomed": doomed_by_arch,
+            },
+        },
+    )
+    usages = [r.usage for r in results if r.usage]
+    if usages:
+        logging.info(
+            "chisel used %.1fs of CPU and up to %d MiB of memory, "
+            "installed %d MiB and added %d MiB to the cache",
+            sum(u.user_cpu + u.sys_cpu for u in usages),
+            max(u.max_rss for u in usages) >> 20,
+            sum(u.root_bytes for u in usages) >> 20,
+            sum(u.cache_bytes for u in usages) >> 20,
+        )
+    if retries.decisions:
+        logging.info(
+            "Retried %d of %d allowed cuts after archive errors, "
+            "the circuit breaker opened %d times",
+            retries.used,
+            retries.budget,
+            sum(h["state"] == "open" for h in retries.breaker.history),
+        )
+    hits = sum(sum(s.hits.values()) for s in stats.values())
+    lookups = hits + sum(sum(s.misses.values()) for s in stats.values())
+    if lookups:
+        logging.info("Package cache hit rate: %.1f%%", 100 * hits / lookups)
+    if len(chisels) > 1:
+        logging.info(
+            "%d cuts installed different trees with chisel %s",
+            len(divergences),
+            ", ".join(chisels),
+        )
+    if cli_args.timings and not cli_args.dry_run:
+        run = record_run(
+            cli_args.timings,
+            release_commit(cli_args.release),
+            f"ubuntu-{archive.version}",
+            slice_timings(results),
+        )
+        logging.info("Recorded the timings as run %d in %s", run, cli_args.timings)
+    if cli_args.trace:
+        TRACER.save(cli_args.trace)
 
 
 if __name__ == "__main__":
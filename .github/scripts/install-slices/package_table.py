@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+
+"""
+Build and read a package table: the packages of the Packages indices of an
+archive, for several suites, components and architectures, in a sorted
+binary file that is memory-mapped to look packages up by name in O(log n)
+without parsing anything, unlike the indices or the output of rmadison.
+
+Layout of the file, little-endian:
+    header      magic, format version and length of the metadata
+    metadata    JSON: release, arches, suites, components and counts
+    names       one record per package, sorted by name: offset and length
+                of the name, bitmap of the arches, first entry and number of
+                entries
+    entries     one record per package, arch and suite: index of the arch,
+                suite and component, offset and length of the version, size
+                and installed size
+    strings     the names and versions, in UTF-8
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import requests
+
+from dataclasses import dataclass
+from typing import Iterator
+
+from archive_index import archive_url, read_packages_index
+
+
+MAGIC = b"PKGTABLE"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+NAME = struct.Struct("<IHIIH")
+ENTRY = struct.Struct("<BBBIHQQ")
+# The arches of a package are a bitmap in a 32-bit field.
+MAX_ARCHES = 32
+
+
+class PackageTableError(Exception):
+    """
+    The file is not a package table, or is corrupted.
+    """
+
+
+@dataclass
+class TableEntry:
+    """
+    Minimal data class to store a package of a Packages index in the table.
+    """
+
+    arch: str
+    suite: str
+    component: str
+    version: str
+    size: int
+    installed_size: int
+
+
+def build_package_table(
+    path: str | os.PathLike,
+    release: str,
+    suites: list[str],
+    components: list[str],
+    arches: list[str],
+    base_url: str | None = None,
+    session: requests.Session | None = None,
+) -> int:
+    """
+    Read the Packages indices of every suite and component for arches, from
+    base_url or the archive that chisel uses for each arch, and write the
+    package table of release to path. The file is written under a temporary
+    name and renamed, so that it never shows up partially.
+    Return the number of packages.
+    """
+    if len(arches) > MAX_ARCHES:
+        raise ValueError(f"at most {MAX_ARCHES} architectures fit in a package table")
+    # {name: [(arch, suite, component, version, size, installed size), ...]}
+    packages: dict[str, list[tuple[int, int, int, str, int, int]]] = {}
+    for a, arch in enumerate(arches):
+        for s, suite in enumerate(suites):
+            for c, component in enumerate(components):
+                for info in read_packages_index(
+                    suite, component, arch, base_url or archive_url(arch), session
+                ):
+                    packages.setdefault(info.package, []).append(
+                        (a, s, c, info.version, info.size, info.installed_size)
+                    )
+
+    strings = bytearray()
+    offsets: dict[str, int] = {}
+
+    def add_string(value: str) -> tuple[int, int]:
+        data = value.encode("utf-8")
+        if value not in offsets:
+            offsets[value] = len(strings)
+            strings.extend(data)
+        return offsets[value], len(data)
+
+    names = bytearray()
+    entries = bytearray()
+    n_entries = 0
+    for name in sorted(packages, key=lambda name: name.encode("utf-8")):
+        pkg_entries = sorted(packages[name])
+        bitmap = 0
+        for a, s, c, version, size, installed_size in pkg_entries:
+            bitmap |= 1 << a
+            entries += ENTRY.pack(a, s, c, *add_string(version), size, installed_size)
+        names += NAME.pack(*add_string(name), bitmap, n_entries, len(pkg_entries))
+        n_entries += len(pkg_entries)
+    meta = json.dumps(
+        {
+            "release": release,
+            "arches": arches,
+            "suites": suites,
+            "components": components,
+            "count": len(packages),
+            "entries": n_entries,
+        },
+        separators=(",", ":"),
+    ).encode()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".package-table-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(meta)))
+            f.write(meta)
+            f.write(names)
+            f.write(entries)
+            f.write(strings)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(packages)
+
+
+class _Names:
+    """
+    Sequence of the encoded names of a table, for bisect.
+    """
+
+    def __init__(self, table: "PackageTable"):
+        self.table = table
+
+    def __len__(self) -> int:
+        return self.table.count
+
+    def __getitem__(self, i: int) -> bytes:
+        offset, length, _, _, _ = self.table._name(i)
+        return self.table._string(offset, length)
+
+
+class PackageTable:
+    """
+    Package table written by build_package_table(), memory-mapped.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = path
+        try:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise PackageTableError(f"cannot read {path}: {e}") from e
+        try:
+            magic, version, meta_size = HEADER.unpack_from(self._map)
+            if magic != MAGIC or version != VERSION:
+                raise PackageTableError(f"{path} is not a package table of version {VERSION}")
+            meta = json.loads(self._map[HEADER.size : HEADER.size + meta_size])
+            self.release: str = meta["release"]
+            self.arches: list[str] = meta["arches"]
+            self.suites: list[str] = meta["suites"]
+            self.components: list[str] = meta["components"]
+            self.count: int = meta["count"]
+            self._names_start = HEADER.size + meta_size
+            self._entries_start = self._names_start + self.count * NAME.size
+            self._strings_start = self._entries_start + meta["entries"] * ENTRY.size
+            if self._strings_start > len(self._map):
+                raise PackageTableError(f"{path} is truncated")
+        except (struct.error, ValueError, KeyError, PackageTableError) as e:
+            self._map.close()
+            if isinstance(e, PackageTableError):
+                raise
+            raise PackageTableError(f"{path} is not a package table: {e}") from e
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self) -> "PackageTable":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _name(self, i: int) -> tuple[int, int, int, int, int]:
+        return NAME.unpack_from(self._map, self._names_start + i * NAME.size)
+
+    def _string(self, offset: int, length: int) -> bytes:
+        start = self._strings_start + offset
+        return self._map[start : start + length]
+
+    def _find(self, name: str) -> tuple[int, int, int, int, int] | None:
+        """
+        Return the name record of the package, found by bisection.
+        """
+        key = name.encode("utf-8")
+        i = bisect.bisect_left(_Names(self), key)
+        if i < self.count:
+            record = self._name(i)
+            if self._string(record[0], record[1]) == key:
+                return record
+        return None
+
+    def __contains__(self, name: str) -> bool:
+        return self._find(name) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        names = _Names(self)
+        for i in range(self.count):
+            yield names[i].decode("utf-8")
+
+    def architectures(self, name: str) -> set[str]:
+        """
+        Return the arches that the package exists for, in any suite.
+        """
+        record = self._find(name)
+        if record is None:
+            return set()
+        bitmap = record[2]
+        return {arch for a, arch in enumerate(self.arches) if bitmap & (1 << a)}
+
+    def entries(self, name: str) -> list[TableEntry]:
+        """
+        Return the entries of the package, by arch, suite and component.
+        """
+        record = self._find(name)
+        if record is None:
+            return []
+        _, _, _, first, count = record
+        entries = []
+        for i in range(first, first + count):
+            a, s, c, offset, length, size, installed_size = ENTRY.unpack_from(
+                self._map, self._entries_start + i * ENTRY.size
+            )
+            entries.append(
+                TableEntry(
+                    self.arches[a],
+                    self.suites[s],
+                    self.components[c],
+                    self._string(offset, length).decode("utf-8"),
+                    size,
+                    installed_size,
+                )
+            )
+        return entries
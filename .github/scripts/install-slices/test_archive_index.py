@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+"""
+Tests for archive_index.py script
+"""
+
+import gzip
+import hashlib
+import lzma
+import os
+import tempfile
+import unittest
+
+from archive_index import (
+    PackageInfo,
+    archive_url,
+    compare_versions,
+    parse_packages_index,
+    fetch_packages_index,
+    download_package,
+)
+
+
+PACKAGES_INDEX = """Package: hello
+Architecture: amd64
+Version: 2.10-2ubuntu4
+Installed-Size: 109
+Filename: pool/main/h/hello/hello_2.10-2ubuntu4_amd64.deb
+Size: 28188
+SHA256: 35b1508eeee9c1dfba798c4c04304ef0f266990f936a51f165571edf53325cbc
+Description: example package based on GNU hello
+ The GNU hello program produces a familiar, friendly greeting.
+
+Package: libc6
+Architecture: amd64
+Version: 2.35-0ubuntu3
+Installed-Size: 13592
+Filename: pool/main/g/glibc/libc6_2.35-0ubuntu3_amd64.deb
+Size: 3235320
+SHA256: 8cd22b6aa8dcec9df5ce1b0e4e2d6a39c4b94a4dd0c3fa4c0a4e0a0dcb1a8e38
+"""
+
+UPDATES_INDEX = """Package: libc6
+Architecture: amd64
+Version: 2.35-0ubuntu3.8
+Installed-Size: 13594
+Filename: pool/main/g/glibc/libc6_2.35-0ubuntu3.8_amd64.deb
+Size: 3235500
+SHA256: 1d7d4e3e5bb0cf06d0a5e2b5e8a27e1c8bc2b3c0fd2f3d3a4e0fde1b3e5e4a1c
+"""
+
+
+class TestScriptMethods(unittest.TestCase):
+    """
+    Test the methods of archive_index
+    """
+
+    def test_archive_url(self):
+        """
+        Test archive_url()
+        """
+        self.assertEqual(archive_url("amd64"), "http://archive.ubuntu.com/ubuntu")
+        self.assertEqual(archive_url("arm64"), "http://ports.ubuntu.com/ubuntu-ports")
+
+    def test_compare_versions(self):
+        """
+        Test compare_versions()
+        """
+        ordered = [
+            "1.0~rc1",
+            "1.0",
+            "1.0-1~",
+            "1.0-1",
+            "1.0-1build1",
+            "1.0-1ubuntu1",
+            "1.0-1.1",
+            "1.0a",
+            "1.0+b1",
+            "1.0.1",
+            "10",
+            "1:0.9",
+        ]
+        for lower, higher in zip(ordered, ordered[1:]):
+            self.assertLess(compare_versions(lower, higher), 0, (lower, higher))
+            self.assertGreater(compare_versions(higher, lower), 0, (higher, lower))
+        self.assertEqual(compare_versions("2.35-0ubuntu3", "2.35-0ubuntu3"), 0)
+
+    def test_parse_packages_index(self):
+        """
+        Test parse_packages_index()
+        """
+        packages = parse_packages_index(PACKAGES_INDEX, "amd64", "jammy", "main")
+        self.assertEqual(
+            packages[0],
+            PackageInfo(
+                package="hello",
+                version="2.10-2ubuntu4",
+                arch="amd64",
+                suite="jammy",
+                component="main",
+                filename="pool/main/h/hello/hello_2.10-2ubuntu4_amd64.deb",
+                sha256="35b1508eeee9c1dfba798c4c04304ef0f266990f936a51f165571edf53325cbc",
+                size=28188,
+                installed_size=109 * 1024,
+            ),
+        )
+        self.assertEqual([p.package for p in packages], ["hello", "libc6"])
+
+    def test_fetch_packages_index(self):
+        """
+        Test fetch_packages_index() with a local mirror
+        """
+        with tempfile.TemporaryDirectory() as mirror:
+            for suite, index, compress, ext in [
+                ("jammy", PACKAGES_INDEX, lzma.compress, "xz"),
+                ("jammy-updates", UPDATES_INDEX, gzip.compress, "gz"),
+            ]:
+                path = os.path.join(mirror, "dists", suite, "main", "binary-amd64")
+                os.makedirs(path)
+                with open(os.path.join(path, f"Packages.{ext}"), "wb") as f:
+                    f.write(compress(index.encode()))
+            index = fetch_packages_index(
+                ["jammy", "jammy-updates"], ["main"], "amd64", base_url=mirror
+            )
+        self.assertEqual(sorted(index), ["hello", "libc6"])
+        # the highest version across the suites is picked
+        self.assertEqual(index["libc6"].version, "2.35-0ubuntu3.8")
+        self.assertEqual(index["libc6"].suite, "jammy-updates")
+        self.assertEqual(index["hello"].suite, "jammy")
+
+    def test_download_package(self):
+        """
+        Test download_package() with a local mirror
+        """
+        content = b"!<arch>\nfake deb"
+        sha256 = hashlib.sha256(content).hexdigest()
+        info = PackageInfo(
+            "hello", "1", "amd64", "jammy", "main", "pool/hello.deb", sha256, 16, 0
+        )
+        with tempfile.TemporaryDirectory() as mirror, tempfile.TemporaryDirectory() as cache:
+            os.makedirs(os.path.join(mirror, "pool"))
+            with open(os.path.join(mirror, "pool", "hello.deb"), "wb") as f:
+                f.write(content)
+            self.assertEqual(download_package(info, mirror, cache), len(content))
+            with open(os.path.join(cache, sha256), "rb") as f:
+                self.assertEqual(f.read(), content)
+            # already in the cache
+            self.assertEqual(download_package(info, mirror, cache), 0)
+            # a corrupted package is not published
+            info.sha256 = "0" * 64
+            with self.assertRaises(ValueError):
+                download_package(info, mirror, cache)
+            self.assertEqual(os.listdir(cache), [sha256])
+
+
+if __name__ == "__main__":
+    unittest.main()
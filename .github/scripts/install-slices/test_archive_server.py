@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+"""
+Tests for archive_server.py script
+"""
+
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from archive_server import (
+    ArchiveServer,
+    Faults,
+    snapshot_archive,
+    snapshot_dir,
+)
+
+
+def write_mirror(mirror: str, debs: dict[str, bytes]) -> None:
+    """
+    Write a local jammy mirror for amd64 with the given debs.
+    """
+    dists = os.path.join(mirror, "dists", "jammy")
+    os.makedirs(os.path.join(dists, "main", "binary-amd64"))
+    with open(os.path.join(dists, "InRelease"), "w", encoding="utf-8") as f:
+        f.write("Suite: jammy\n")
+    stanzas = []
+    for pkg, content in debs.items():
+        os.makedirs(os.path.join(mirror, "pool", pkg))
+        with open(os.path.join(mirror, "pool", pkg, f"{pkg}.deb"), "wb") as f:
+            f.write(content)
+        stanzas.append(
+            f"Package: {pkg}\nVersion: 1.0\nFilename: pool/{pkg}/{pkg}.deb\n"
+            f"Size: {len(content)}\nSHA256: {hashlib.sha256(content).hexdigest()}\n"
+        )
+    with open(os.path.join(dists, "main", "binary-amd64", "Packages.gz"), "wb") as f:
+        f.write(gzip.compress("\n".join(stanzas).encode()))
+
+
+class TestScriptMethods(unittest.TestCase):
+    """
+    Test the methods of archive_server
+    """
+
+    def test_snapshot_dir(self):
+        """
+        Test snapshot_dir()
+        """
+        self.assertEqual(
+            snapshot_dir("/snap", "http://ports.ubuntu.com/ubuntu-ports"),
+            "/snap/ports.ubuntu.com/ubuntu-ports",
+        )
+
+    def test_snapshot_archive(self):
+        """
+        Test snapshot_archive() with a local mirror
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mirror = os.path.join(tmpdir, "mirror")
+            write_mirror(mirror, {"foo": b"foo deb", "bar": b"bar deb", "baz": b"baz deb"})
+            release = os.path.join(tmpdir, "release")
+            os.makedirs(os.path.join(release, "slices"))
+            with open(os.path.join(release, "chisel.yaml"), "w", encoding="utf-8") as f:
+                f.write(
+                    "format: v1\n"
+                    "archives:\n"
+                    "  ubuntu: {version: 22.04, components: [main], suites: [jammy]}\n"
+                )
+            for pkg, slices in [
+                ("foo", "bins: {essential: [bar_libs]}"),
+                ("bar", "libs: {}"),
+                ("baz", "libs: {}"),
+            ]:
+                with open(
+                    os.path.join(release, "slices", f"{pkg}.yaml"), "w", encoding="utf-8"
+                ) as f:
+                    f.write(f"package: {pkg}\nslices:\n  {slices}\n")
+            snapshot = os.path.join(tmpdir, "snapshot")
+            copied = snapshot_archive(
+                snapshot,
+                release + "/",
+                ["amd64"],
+                [os.path.join(release, "slices", "foo.yaml")],
+                base_url=mirror,
+            )
+            files = sorted(
+                os.path.relpath(os.path.join(dirpath, name), snapshot)
+                for dirpath, _, names in os.walk(snapshot)
+                for name in names
+            )
+            self.assertEqual(
+                files,
+                [
+                    "archive.ubuntu.com/ubuntu/dists/jammy/InRelease",
+                    "archive.ubuntu.com/ubuntu/dists/jammy/main/binary-amd64/Packages.gz",
+                    # foo and its essential, but not baz
+                    "archive.ubuntu.com/ubuntu/pool/bar/bar.deb",
+                    "archive.ubuntu.com/ubuntu/pool/foo/foo.deb",
+                ],
+            )
+            self.assertEqual(
+                copied, sum(os.path.getsize(os.path.join(snapshot, f)) for f in files)
+            )
+            # the snapshot resumes
+            self.assertEqual(
+                snapshot_archive(snapshot, release + "/", ["amd64"], base_url=mirror),
+                len(b"baz deb"),
+            )
+
+    def test_archive_server(self):
+        """
+        Test ArchiveServer
+        """
+        with tempfile.TemporaryDirectory() as snapshot:
+            path = os.path.join(snapshot, "archive.ubuntu.com", "ubuntu", "pool")
+            os.makedirs(path)
+            with open(os.path.join(path, "foo.deb"), "wb") as f:
+                f.write(b"foo deb" * 1000)
+            faults = Faults()
+            server = ArchiveServer(("127.0.0.1", 0), snapshot, faults)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            session = requests.Session()
+            session.trust_env = False
+            proxy = f"http://127.0.0.1:{server.server_address[1]}"
+            try:
+                # as a proxy
+                response = session.get(
+                    "http://archive.ubuntu.com/ubuntu/pool/foo.deb",
+                    proxies={"http": proxy},
+                    timeout=10,
+                )
+                self.assertEqual(response.content, b"foo deb" * 1000)
+                # by path
+                response = session.get(
+                    f"{proxy}/archive.ubuntu.com/ubuntu/pool/foo.deb", timeout=10
+                )
+                self.assertEqual(response.content, b"foo deb" * 1000)
+                for url in [f"{proxy}/archive.ubuntu.com/ubuntu/pool/bar.deb", f"{proxy}/../etc/passwd"]:
+                    self.assertEqual(session.get(url, timeout=10).status_code, 404)
+                # injected faults
+                faults.error_rate = 1.0
+                response = session.get(f"{proxy}/archive.ubuntu.com/ubuntu/pool/foo.deb", timeout=10)
+                self.assertEqual(response.status_code, 503)
+                faults.error_rate, faults.truncate_rate = 0.0, 1.0
+                with self.assertRaises(requests.RequestException):
+                    session.get(f"{proxy}/archive.ubuntu.com/ubuntu/pool/foo.deb", timeout=10)
+                faults.truncate_rate, faults.reset_rate = 0.0, 1.0
+                with self.assertRaises(requests.ConnectionError):
+                    session.get(f"{proxy}/archive.ubuntu.com/ubuntu/pool/foo.deb", timeout=10)
+            finally:
+                session.close()
+                server.shutdown()
+                server.server_close()
+                thread.join()
+            self.assertEqual(server.stats["requests"], 7)
+            self.assertEqual(server.stats["not found"], 2)
+            self.assertEqual(
+                (server.stats["errors"], server.stats["truncated"], server.stats["resets"]),
+                (1, 1, 1),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+
+"""
+Tests for availability.py script
+"""
+
+import gzip
+import os
+import pathlib
+import subprocess
+import tempfile
+import unittest
+import unittest.mock
+
+from availability import compute_availability
+from package_table import PackageTable, PackageTableError, build_package_table
+
+
+CHISEL_YAML = """
+format: v1
+archives:
+  ubuntu:
+    version: 22.04
+    components: [main, universe]
+    suites: [jammy, jammy-security, jammy-updates]
+"""
+
+
+class TestScriptMethods(unittest.TestCase):
+    """
+    Test the methods of availability
+    """
+
+    @unittest.mock.patch("subprocess.run")
+    def test_compute_availability(self, mock_run):
+        """
+        Test compute_availability()
+        """
+        mock_run.return_value = subprocess.CompletedProcess(
+            [], 0, " hello | 2.10-2ubuntu4 | jammy | amd64, arm64\n"
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            release = pathlib.Path(tmpdir)
+            (release / "chisel.yaml").write_text(CHISEL_YAML, encoding="utf-8")
+            (release / "slices").mkdir()
+            for pkg in ["hello", "foo"]:
+                (release / "slices" / f"{pkg}.yaml").write_text(
+                    f"package: {pkg}\nslices:\n  bins:\n    contents:\n      /usr/bin/{pkg}:\n",
+                    encoding="utf-8",
+                )
+            availability = compute_availability(tmpdir + "/", ["amd64", "arm64"], [])
+            self.assertEqual(availability.release, "ubuntu-22.04")
+            self.assertEqual(
+                availability.packages,
+                {"foo": {}, "hello": {"jammy": {"2.10-2ubuntu4": ["amd64", "arm64"]}}},
+            )
+            self.assertEqual(mock_run.call_count, 1)
+            self.assertEqual(mock_run.call_args.args[0][-1], "foo hello")
+            # Only the packages of the given files.
+            availability = compute_availability(
+                tmpdir + "/", ["amd64"], [os.path.join(tmpdir, "slices", "hello.yaml")]
+            )
+            self.assertEqual(list(availability.packages), ["hello"])
+
+    @unittest.mock.patch("subprocess.run")
+    def test_compute_availability_from_table(self, mock_run):
+        """
+        Test compute_availability() with a package table
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            release = pathlib.Path(tmpdir, "release")
+            (release / "slices").mkdir(parents=True)
+            (release / "chisel.yaml").write_text(CHISEL_YAML, encoding="utf-8")
+            (release / "slices" / "hello.yaml").write_text(
+                "package: hello\nslices:\n  bins:\n    contents:\n      /usr/bin/hello:\n",
+                encoding="utf-8",
+            )
+            mirror = pathlib.Path(tmpdir, "mirror")
+            for arch in ["amd64", "s390x"]:
+                path = mirror / "dists" / "jammy" / "main" / f"binary-{arch}"
+                path.mkdir(parents=True)
+                (path / "Packages.gz").write_bytes(
+                    gzip.compress(b"Package: hello\nVersion: 2.10-2ubuntu4\n")
+                )
+            table_path = os.path.join(tmpdir, "packages.table")
+            build_package_table(
+                table_path, "ubuntu-22.04", ["jammy"], ["main"], ["amd64", "s390x"], str(mirror)
+            )
+            with PackageTable(table_path) as table:
+                availability = compute_availability(str(release) + "/", ["s390x"], [], table)
+                self.assertEqual(availability.arches, ["s390x"])
+                self.assertEqual(
+                    availability.packages, {"hello": {"jammy": {"2.10-2ubuntu4": ["s390x"]}}}
+                )
+                # The table does not cover arm64.
+                with self.assertRaises(PackageTableError):
+                    compute_availability(str(release) + "/", ["arm64"], [], table)
+            mock_run.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
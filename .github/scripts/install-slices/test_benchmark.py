@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+"""
+Tests for benchmark.py script
+"""
+
+import os
+import random
+import tempfile
+import unittest
+
+from benchmark import percentile, run_benchmark, write_release
+from install_slices import essential_closures, parse_package
+
+
+class TestScriptMethods(unittest.TestCase):
+    """
+    Test the methods of benchmark
+    """
+
+    def test_write_release(self):
+        """
+        Test write_release()
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            release = os.path.join(tmpdir, "release")
+            files = write_release(release, 10, random.Random(0))
+            self.assertTrue(os.path.exists(os.path.join(release, "chisel.yaml")))
+            packages = [parse_package(f) for f in files]
+        self.assertEqual([p.package for p in packages], ["pkg00000", "pkg00001", "pkg00002"])
+        self.assertEqual([len(p.slices) for p in packages], [4, 4, 2])
+        # essentials only point to the slices of the packages before
+        closures = essential_closures(packages, "amd64")
+        self.assertEqual(len(closures), 10)
+        for name, closure in closures.items():
+            self.assertTrue(all(n.split("_")[0] <= name.split("_")[0] for n in closure))
+
+    def test_percentile(self):
+        """
+        Test percentile()
+        """
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 95), 95.0)
+        self.assertEqual(percentile([3.0], 95), 3.0)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_run_benchmark(self):
+        """
+        Test run_benchmark(), which runs offline
+        """
+        result = run_benchmark(
+            20,
+            ["amd64", "arm64"],
+            latency=0,
+            latency_per_slice=0,
+            failure_rate=0.2,
+            extra_args=["--workers", "4"],
+        )
+        self.assertEqual(result["slices"], 40)
+        # the failures are retried
+        self.assertEqual(result["failed"], 0)
+        self.assertGreater(result["slices_per_second"], 0)
+        self.assertLessEqual(result["p50_seconds"], result["p95_seconds"])
+        self.assertGreater(result["orchestrator_cpu_seconds"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+"""
+Tests for chisel_manifest.py script
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+import zstandard
+
+from chisel_manifest import ManifestError, iter_manifest, manifest_path
+
+
+def write_manifest(path: str, entries: list[dict]) -> None:
+    """
+    Write a manifest as chisel does: a zstd-compressed jsonwall file.
+    """
+    lines = [{"jsonwall": "1.0", "schema": "1.0", "count": len(entries) + 1}] + entries
+    content = "".join(json.dumps(line) + "\n" for line in lines).encode()
+    with open(path, "wb") as f:
+        f.write(zstandard.ZstdCompressor().compress(content))
+
+
+class TestScriptMethods(unittest.TestCase):
+    """
+    Test the methods of chisel_manifest
+    """
+
+    def test_manifest_path(self):
+        """
+        Test manifest_path()
+        """
+        self.assertEqual(manifest_path("/var/lib/chisel/**"), "/var/lib/chisel/manifest.wall")
+        self.assertEqual(manifest_path("/var/lib/chisel/"), "/var/lib/chisel/manifest.wall")
+
+    def test_iter_manifest(self):
+        """
+        Test iter_manifest()
+        """
+        entries = [
+            {"kind": "package", "name": "hello", "version": "2.10-2", "sha256": "ab"},
+            {"kind": "slice", "name": "hello_bins"},
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "manifest.wall")
+            write_manifest(path, entries)
+            self.assertEqual(list(iter_manifest(path)), entries)
+            # not compressed
+            with open(path, "wb") as f:
+                f.write(b'{"jsonwall": "1.0"}\n')
+            with self.assertRaises(ManifestError):
+                list(iter_manifest(path))
+            # not a jsonwall file
+            with open(path, "wb") as f:
+                f.write(zstandard.ZstdCompressor().compress(b'{"kind": "slice"}\n'))
+            with self.assertRaises(ManifestError):
+                list(iter_manifest(path))
+            with self.assertRaises(ManifestError):
+                list(iter_manifest(os.path.join(tmpdir, "missing.wall")))
+
+
+if __name__ == "__main__":
+    unittest.main()
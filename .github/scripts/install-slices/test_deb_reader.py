@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+"""
+Tests for deb_reader.py script
+"""
+
+import io
+import os
+import pathlib
+import subprocess
+import tempfile
+import unittest
+
+from deb_reader import (
+    DebError,
+    deb_has_file,
+    iter_ar_members,
+    iter_data_files,
+    read_control,
+)
+
+
+# Longer than the name field of the tar headers.
+LONG_PATH = "usr/lib/hello/" + "x" * 120
+
+
+def build_deb(tmpdir: str, compression: str) -> str:
+    """
+    Build a deb with dpkg-deb, compressed with the given method, and return
+    its path.
+    """
+    root = pathlib.Path(tmpdir, "root")
+    (root / "DEBIAN").mkdir(parents=True, exist_ok=True)
+    (root / "DEBIAN" / "control").write_text(
+        "Package: hello\nVersion: 2.10-2ubuntu4\nArchitecture: all\n"
+        "Maintainer: Test <test@example.com>\nDescription: greets\n the world\n",
+        encoding="utf-8",
+    )
+    for name in ["usr/bin/hello", "usr/share/doc/hello/copyright", LONG_PATH]:
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_text(name, encoding="utf-8")
+    deb = os.path.join(tmpdir, f"hello-{compression}.deb")
+    subprocess.run(
+        ["dpkg-deb", f"-Z{compression}", "--root-owner-group", "--build", str(root), deb],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return deb
+
+
+class TestScriptMethods(unittest.TestCase):
+    """
+    Test the methods of deb_reader
+    """
+
+    def test_iter_ar_members(self):
+        """
+        Test iter_ar_members()
+        """
+
+        def member(name: bytes, data: bytes) -> bytes:
+            header = name.ljust(16) + b"0".ljust(12) + b"0".ljust(6) * 2
+            header += b"644".ljust(8) + str(len(data)).encode().ljust(10) + b"`\n"
+            return header + data + b"\n" * (len(data) % 2)
+
+        f = io.BytesIO(b"!<arch>\n" + member(b"debian-binary", b"2.0\n") + member(b"odd/", b"abc"))
+        members = []
+        for name, size in iter_ar_members(f):
+            members.append((name, f.read(size)))
+        self.assertEqual(members, [("debian-binary", b"2.0\n"), ("odd", b"abc")])
+        with self.assertRaises(DebError):
+            list(iter_ar_members(io.BytesIO(b"Package: hello\n")))
+        with self.assertRaises(DebError):
+            list(iter_ar_members(io.BytesIO(b"!<arch>\ntruncated")))
+
+    def test_read_deb(self):
+        """
+        Test read_control(), iter_data_files() and deb_has_file()
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for compression in ["xz", "zstd", "gzip", "none"]:
+                deb = build_deb(tmpdir, compression)
+                fields = read_control(deb)
+                self.assertEqual(fields["Package"], "hello")
+                self.assertEqual(fields["Version"], "2.10-2ubuntu4")
+                self.assertEqual(fields["Description"], "greets\nthe world")
+                self.assertEqual(
+                    sorted(iter_data_files(deb)),
+                    [
+                        "usr",
+                        "usr/bin",
+                        "usr/bin/hello",
+                        "usr/lib",
+                        "usr/lib/hello",
+                        LONG_PATH,
+                        "usr/share",
+                        "usr/share/doc",
+                        "usr/share/doc/hello",
+                        "usr/share/doc/hello/copyright",
+                    ],
+                )
+                self.assertTrue(deb_has_file(deb, "/usr/share/doc/hello/copyright"))
+                self.assertFalse(deb_has_file(deb, "usr/share/doc/hello/changelog"))
+                self.assertTrue(deb_has_file(deb, LONG_PATH))
+            not_a_deb = os.path.join(tmpdir, "not-a-deb")
+            with open(not_a_deb, "wb") as f:
+                f.write(b"!<arch>\n")
+            with self.assertRaises(DebError):
+                read_control(not_a_deb)
+            with self.assertRaises(DebError):
+                deb_has_file(not_a_deb, "usr/bin/hello")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,24 +4,90 @@
 Tests for install_slices.py script
 """
 
+import asyncio
+import dataclasses
+import functools
+import gzip
+import hashlib
+import http.server
+import json
 import logging
 import os
+import pathlib
+import random
+import subprocess
 import tempfile
+import threading
+import time
 import unittest
 import unittest.mock
 
+import install_slices
+import zstandard
+
+from archive_index import PackageInfo
+from package_table import PackageTable, build_package_table
+from timing_db import SliceTiming
 from install_slices import (
-    CHISEL_PKG_CACHE,
+    CHISEL_ARCHES,
     Package,
     Archive,
     parse_archive,
     full_slice_name,
     parse_package,
+    essential_closures,
+    plan_installation,
+    replan_failed,
+    changed_slice_definitions,
+    reverse_essentials,
+    impacted_slices,
+    report_installation,
+    CutResult,
+    Conflict,
+    Divergence,
+    CutUsage,
+    PathInfo,
+    PreflightError,
+    globs_overlap,
+    preflight_release,
+    preflight_plan,
+    preflight_arch,
+    ChiselTimings,
+    slice_timings,
+    bisect_cut,
+    BatchSizer,
+    ConcurrencyController,
+    CacheStats,
+    group_by_affinity,
+    estimate_durations,
+    order_longest_first,
+    execution_plan,
+    Prefetcher,
+    Tracer,
+    ResultCache,
+    result_cache_context,
+    result_cache_key,
     query_package_existence,
+    Availability,
+    query_availability,
+    query_package_architectures,
     ensure_package_existence,
     ignore_missing_packages,
-    install_slice,
+    cache_lock,
+    chisel_cut,
+    classify_error,
+    RetryPolicy,
+    default_retry_policies,
+    CircuitBreaker,
+    RetryEngine,
+    chisel_cut_shared_cache,
+    install_all_slices,
+    snapshot_tree,
+    diff_trees,
+    DebIndex,
     deb_has_copyright_file,
+    find_manifest_slice,
+    verify_manifest,
     main,
 )
 
@@ -93,6 +159,36 @@ DEFAULT_PACKAGE = Package(
 )
 
 
+def write_cached_deb(
+    pkg_cache: pathlib.Path, pkg: str, version: str, files: list[str]
+) -> str:
+    """
+    Build a deb of the given package and files with dpkg-deb, store it in
+    the chisel cache by its digest and return the digest.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        root = pathlib.Path(tmpdir, "root")
+        (root / "DEBIAN").mkdir(parents=True)
+        (root / "DEBIAN" / "control").write_text(
+            f"Package: {pkg}\nVersion: {version}\nArchitecture: all\n"
+            "Maintainer: Test <test@example.com>\nDescription: test\n",
+            encoding="utf-8",
+        )
+        for name in files:
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            (root / name).write_text(name, encoding="utf-8")
+        deb = pathlib.Path(tmpdir, "pkg.deb")
+        subprocess.run(
+            ["dpkg-deb", "--build", "--root-owner-group", str(root), str(deb)],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        content = deb.read_bytes()
+    sha = hashlib.sha256(content).hexdigest()
+    (pkg_cache / sha).write_bytes(content)
+    return sha
+
+
 class TestScriptMethods(unittest.TestCase):
     """
     Test the methods of install-slices
@@ -153,6 +249,932 @@ class TestScriptMethods(unittest.TestCase):
             pkg = parse_package(filepath)
             self.assertEqual(pkg, DEFAULT_PACKAGE)
 
+    def test_parse_package_essentials(self):
+        """
+        Test parse_package() with essentials
+        """
+        sdf = """
+package: foo
+essential:
+    - foo_copyright
+slices:
+    bins:
+        essential:
+            bar_libs:
+            baz_libs: {arch: [amd64, arm64]}
+            qux_libs: {arch: s390x}
+    copyright:
+    libs:
+        essential:
+            - bar_libs
+"""
+        with tempfile.TemporaryDirectory() as tmpfs:
+            filepath = os.path.join(tmpfs, "foo.yaml")
+            with open(filepath, "w", encoding="utf-8") as file:
+                file.write(sdf)
+            pkg = parse_package(filepath)
+        self.assertEqual(
+            pkg,
+            Package(
+                package="foo",
+                slices=["bins", "copyright", "libs"],
+                essentials={
+                    "bins": {
+                        "foo_copyright": [],
+                        "bar_libs": [],
+                        "baz_libs": ["amd64", "arm64"],
+                        "qux_libs": ["s390x"],
+                    },
+                    "libs": {"foo_copyright": [], "bar_libs": []},
+                },
+            ),
+        )
+
+    def test_parse_package_contents(self):
+        """
+        Test parse_package() with contents
+        """
+        sdf = """
+package: foo
+slices:
+    bins:
+        contents:
+            /usr/bin/foo:
+            /usr/bin/foo-*: {arch: [amd64, arm64]}
+            /usr/bin/bar: {symlink: foo}
+            /etc/foo.conf: {text: FOO, mutable: true}
+            /var/lib/foo/: {make: true, mode: 0755}
+            /usr/bin/baz: {copy: /usr/bin/foo, arch: s390x}
+            /usr/bin/qux: {prefer: bar}
+"""
+        with tempfile.TemporaryDirectory() as tmpfs:
+            filepath = os.path.join(tmpfs, "foo.yaml")
+            with open(filepath, "w", encoding="utf-8") as file:
+                file.write(sdf)
+            pkg = parse_package(filepath)
+        self.assertEqual(
+            pkg.contents,
+            {
+                "bins": {
+                    "/usr/bin/foo": PathInfo("copy"),
+                    "/usr/bin/foo-*": PathInfo("glob", arches=["amd64", "arm64"]),
+                    "/usr/bin/bar": PathInfo("symlink", "foo"),
+                    "/etc/foo.conf": PathInfo("text", "FOO", mutable=True),
+                    "/var/lib/foo/": PathInfo("dir", mode=0o755),
+                    "/usr/bin/baz": PathInfo("copy", "/usr/bin/foo", arches=["s390x"]),
+                    "/usr/bin/qux": PathInfo("copy", prefer="bar"),
+                }
+            },
+        )
+
+    def test_globs_overlap(self):
+        """
+        Test globs_overlap()
+        """
+        for a, b, overlap in [
+            ("/usr/bin/foo", "/usr/bin/foo", True),
+            ("/usr/bin/foo", "/usr/bin/bar", False),
+            ("/usr/bin/*", "/usr/bin/foo", True),
+            ("/usr/bin/*", "/usr/bin/foo/bar", False),
+            ("/usr/**", "/usr/bin/foo/bar", True),
+            ("/usr/bin/f?o", "/usr/bin/foo", True),
+            ("/usr/bin/f?o", "/usr/bin/fo/", False),
+            ("/usr/lib/*.so", "/usr/lib/libfoo*", True),
+            ("/usr/lib/*.so", "/usr/lib/*.a", False),
+            ("/usr/lib/**/*.so", "/usr/lib/x86_64-linux-gnu/libfoo.so", True),
+            ("/usr/share/doc/*/copyright", "/usr/share/doc/foo/copyright", True),
+            ("/usr/share/*/foo", "/usr/*/doc/bar", False),
+        ]:
+            self.assertEqual(globs_overlap(a, b), overlap, (a, b))
+            self.assertEqual(globs_overlap(b, a), overlap, (b, a))
+
+    def test_preflight_release(self):
+        """
+        Test preflight_release()
+        """
+        packages = [
+            Package(
+                "foo",
+                ["bins", "copyright", "libs"],
+                {"bins": {"foo_libs": [], "bar_libs": ["amd64", "x86"]}},
+                contents={
+                    "bins": {"/usr/bin/foo": PathInfo("copy")},
+                    "copyright": {"/usr/share/doc/foo/copyright": PathInfo("copy")},
+                    "libs": {
+                        # same content as in bar_libs
+                        "/usr/lib/foo/": PathInfo("dir", mode=0o755),
+                        "/etc/foo": PathInfo("text", "foo"),
+                    },
+                },
+            ),
+            Package(
+                "bar",
+                ["bins", "libs", "data"],
+                {"libs": {"baz_libs": [], "bar_data": []}, "data": {"bar_libs": []}},
+                contents={
+                    # copied by another package
+                    "bins": {"/usr/bin/foo": PathInfo("copy", arches=["arm64"])},
+                    "libs": {
+                        "/usr/lib/foo/": PathInfo("dir", mode=0o755),
+                        "/etc/foo": PathInfo("text", "bar"),
+                    },
+                    "data": {"/usr/share/doc/*/copyright": PathInfo("glob")},
+                },
+            ),
+        ]
+        errors = preflight_release(packages)
+        self.assertEqual(
+            [e.error for e in errors],
+            [
+                "bar_libs requires baz_libs, but slice is missing",
+                "foo_bins has invalid arch 'x86' for essential bar_libs",
+                "essential loop detected: bar_data, bar_libs",
+                "slices bar_libs and foo_libs conflict on /etc/foo",
+                "slices bar_bins and foo_bins conflict on /usr/bin/foo",
+                "slices bar_data and foo_copyright conflict on "
+                "/usr/share/doc/*/copyright and /usr/share/doc/foo/copyright",
+            ],
+        )
+        self.assertEqual(errors[2].slices, ["bar_data", "bar_libs"])
+        # a consistent release
+        self.assertEqual(preflight_release([Package("baz", ["libs"])]), [])
+        # packages preferring one another do not conflict, even through a
+        # chain of preferred packages
+        packages = [
+            Package(
+                pkg, ["bins"], contents={"bins": {"/usr/bin/foo": PathInfo("copy", prefer=prefer)}}
+            )
+            for pkg, prefer in [("foo", "bar"), ("bar", "baz"), ("baz", ""), ("qux", "")]
+        ]
+        self.assertEqual(preflight_release(packages[:3]), [])
+        self.assertEqual(
+            [e.error for e in preflight_release(packages)],
+            ["slices bar_bins and qux_bins conflict on /usr/bin/foo"],
+        )
+
+    def test_preflight_plan(self):
+        """
+        Test preflight_plan()
+        """
+        closures = {
+            "foo_bins": {"foo_bins", "bar_libs", "libc6_libs"},
+            "baz_bins": {"baz_bins", "libc6_libs"},
+            "qux_bins": {"qux_bins"},
+        }
+        plan = [
+            ("foo", "bins", ["foo_bins"]),
+            ("baz", "bins", ["baz_bins"]),
+            ("qux", "bins", ["qux_bins"]),
+        ]
+        errors = [
+            PreflightError(["bar_libs", "qux_bins"], "slices bar_libs and qux_bins conflict"),
+            PreflightError(["foo_bins"], "foo_bins has invalid arch 'x86'"),
+        ]
+        # only the slices that install the slices of the errors are doomed
+        self.assertEqual(
+            preflight_plan(plan, closures, errors),
+            {
+                "foo_bins": "slices bar_libs and qux_bins conflict (and 1 more errors)",
+                "qux_bins": "slices bar_libs and qux_bins conflict",
+            },
+        )
+        self.assertEqual(preflight_plan(plan, closures, []), {})
+        # the slices covered by a doomed cut are planned under other roots,
+        # which are checked in turn
+        closures["libc6_libs"] = {"libc6_libs"}
+        closures["bar_libs"] = {"bar_libs", "libc6_libs"}
+        plan = [("foo", "bins", ["bar_libs", "foo_bins", "libc6_libs"])]
+        errors = [PreflightError(["foo_bins"], "foo_bins has invalid arch 'x86'")]
+        doomed = preflight_plan(plan, closures, errors)
+        plan, new = replan_failed(plan, closures, set(doomed))
+        self.assertEqual(new, [("bar", "libs", ["bar_libs", "libc6_libs"])])
+        self.assertEqual(preflight_plan(new, closures, errors), {})
+
+    def test_preflight_arch(self):
+        """
+        Test preflight_arch()
+        """
+        closures = {
+            "foo_bins": {"foo_bins", "bar_libs", "libc6_libs"},
+            "baz_bins": {"baz_bins", "libc6_libs"},
+        }
+        plan = [("foo", "bins", ["foo_bins"]), ("baz", "bins", ["baz_bins"])]
+        self.assertEqual(
+            preflight_arch(plan, closures, {"foo", "baz", "libc6"}),
+            {"foo_bins": "foo_bins needs bar_libs, whose package is not in the archive"},
+        )
+        self.assertEqual(preflight_arch(plan, closures, {"foo", "bar", "baz", "libc6"}), {})
+
+    def test_essential_closures(self):
+        """
+        Test essential_closures()
+        """
+        packages = [
+            Package("foo", ["bins", "libs"], {
+                "bins": {"foo_libs": [], "baz_libs": ["arm64"]},
+                "libs": {"bar_libs": []},
+            }),
+            Package("bar", ["libs"], {"libs": {"foo_libs": []}}),
+            Package("baz", ["libs"]),
+        ]
+        closures = essential_closures(packages, "amd64")
+        self.assertEqual(
+            closures,
+            {
+                "foo_bins": {"foo_bins", "foo_libs", "bar_libs"},
+                "foo_libs": {"foo_libs", "bar_libs"},
+                "bar_libs": {"bar_libs", "foo_libs"},
+                "baz_libs": {"baz_libs"},
+            },
+        )
+        closures = essential_closures(packages, "arm64")
+        self.assertEqual(
+            closures["foo_bins"], {"foo_bins", "foo_libs", "bar_libs", "baz_libs"}
+        )
+
+    def test_plan_installation(self):
+        """
+        Test plan_installation()
+        """
+        closures = {
+            "foo_bins": {"foo_bins", "foo_libs", "bar_libs"},
+            "foo_libs": {"foo_libs", "bar_libs"},
+            "bar_libs": {"bar_libs"},
+            "baz_libs": {"baz_libs"},
+        }
+        plan = plan_installation(
+            [("foo", "bins"), ("foo", "libs"), ("bar", "libs"), ("baz", "libs")],
+            closures,
+        )
+        self.assertEqual(
+            plan,
+            [
+                ("foo", "bins", ["bar_libs", "foo_bins", "foo_libs"]),
+                ("baz", "libs", ["baz_libs"]),
+            ],
+        )
+        # essentials outside of the wanted slices are not accounted for
+        plan = plan_installation([("foo", "libs"), ("baz", "libs")], closures)
+        self.assertEqual(
+            plan,
+            [("baz", "libs", ["baz_libs"]), ("foo", "libs", ["foo_libs"])],
+        )
+
+    def test_replan_failed(self):
+        """
+        Test replan_failed()
+        """
+        closures = {
+            "foo_bins": {"foo_bins", "foo_libs", "bar_libs"},
+            "foo_libs": {"foo_libs", "bar_libs"},
+            "bar_libs": {"bar_libs"},
+            "baz_libs": {"baz_libs"},
+        }
+        plan = [
+            ("foo", "bins", ["bar_libs", "foo_bins", "foo_libs"]),
+            ("baz", "libs", ["baz_libs"]),
+        ]
+        # the slices covered by a failed cut are planned again
+        plan, new = replan_failed(plan, closures, {"foo_bins", "baz_libs"})
+        self.assertEqual(
+            plan, [("foo", "bins", ["foo_bins"]), ("baz", "libs", ["baz_libs"])]
+        )
+        self.assertEqual(new, [("foo", "libs", ["bar_libs", "foo_libs"])])
+        # ... until every slice has its own cut
+        plan, new = replan_failed(plan + new, closures, {"foo_libs"})
+        self.assertEqual(plan[-1], ("foo", "libs", ["foo_libs"]))
+        self.assertEqual(new, [("bar", "libs", ["bar_libs"])])
+        self.assertEqual(replan_failed(plan, closures, {"foo_libs"}), (plan, []))
+
+    def test_impacted_slices(self):
+        """
+        Test reverse_essentials() and impacted_slices()
+        """
+        closures = {
+            "foo_bins": {"foo_bins", "foo_libs", "bar_libs"},
+            "foo_libs": {"foo_libs", "bar_libs"},
+            "bar_libs": {"bar_libs"},
+            "bar_config": {"bar_config"},
+            "baz_libs": {"baz_libs", "qux_libs"},
+        }
+        self.assertEqual(
+            reverse_essentials(closures),
+            {
+                "foo": {"foo_bins", "foo_libs"},
+                "bar": {"foo_bins", "foo_libs", "bar_libs", "bar_config"},
+                "baz": {"baz_libs"},
+                "qux": {"baz_libs"},
+            },
+        )
+        self.assertEqual(impacted_slices({"foo"}, closures), {"foo_bins", "foo_libs"})
+        self.assertEqual(
+            impacted_slices({"bar"}, closures),
+            {"foo_bins", "foo_libs", "bar_libs", "bar_config"},
+        )
+        # qux was deleted, so it has no slices of its own
+        self.assertEqual(impacted_slices({"qux", "none"}, closures), {"baz_libs"})
+
+    def test_changed_slice_definitions(self):
+        """
+        Test changed_slice_definitions()
+        """
+        with tempfile.TemporaryDirectory() as tmpfs:
+
+            def git(*args):
+                subprocess.run(
+                    ["git", "-C", tmpfs, "-c", "user.name=test",
+                     "-c", "user.email=test@example.com", *args],
+                    check=True,
+                    capture_output=True,
+                )
+
+            def write(path, content):
+                os.makedirs(os.path.dirname(os.path.join(tmpfs, path)), exist_ok=True)
+                with open(os.path.join(tmpfs, path), "w", encoding="utf-8") as f:
+                    f.write(content)
+
+            git("init", "-q")
+            write("chisel.yaml", "format: v1\n")
+            write("slices/foo.yaml", "package: foo\n")
+            write("slices/bar.yaml", "package: bar\n")
+            write("slices/baz.yaml", "package: baz\n")
+            git("add", ".")
+            git("commit", "-q", "-m", "initial")
+            write("chisel.yaml", "format: v2\n")
+            write("slices/foo.yaml", "package: foo\nslices: {}\n")
+            write("slices/sub/qux.yaml", "package: qux\n")
+            os.unlink(os.path.join(tmpfs, "slices/bar.yaml"))
+            git("add", ".")
+            files, deleted = changed_slice_definitions(tmpfs + "/", "HEAD")
+        self.assertEqual(
+            files,
+            [tmpfs + "/slices/foo.yaml", tmpfs + "/slices/sub/qux.yaml"],
+        )
+        self.assertEqual(deleted, {"bar"})
+
+    def test_report_installation(self):
+        """
+        Test report_installation()
+        """
+        plan = [
+            ("foo", "bins", ["foo_bins", "foo_libs"]),
+            ("bar", "libs", ["bar_libs", "bar_data"]),
+            ("baz", "libs", ["baz_libs"]),
+        ]
+        results = [
+            CutResult("foo_bins", ["foo_bins", "foo_libs"], arch="amd64"),
+            CutResult("bar_libs", ["bar_libs", "bar_data"], "error", arch="amd64"),
+            CutResult("baz_libs", ["baz_libs"], cached=True, arch="amd64"),
+            CutResult("foo_bins", ["foo_bins", "foo_libs"], arch="arm64"),
+        ]
+        plans = {
+            "amd64": plan + [("qux", "libs", ["qux_libs"])],
+            "arm64": [("foo", "bins", ["foo_bins", "foo_libs"])],
+        }
+        with tempfile.TemporaryDirectory() as tmpfs:
+            report_path = os.path.join(tmpfs, "report.json")
+            report_installation(plans, results, report_path)
+            with open(report_path, "r", encoding="utf-8") as f:
+                report = json.load(f)
+
+        def entry(slice, arch, status, installed_by):
+            return {"slice": slice, "arch": arch, "status": status, "installed_by": installed_by}
+
+        self.assertEqual(
+            report["slices"],
+            [
+                entry("bar_data", "amd64", "untested", "bar_libs"),
+                entry("bar_libs", "amd64", "failed", "bar_libs"),
+                entry("baz_libs", "amd64", "cached pass", "baz_libs"),
+                entry("foo_bins", "amd64", "installed", "foo_bins"),
+                entry("foo_bins", "arm64", "installed", "foo_bins"),
+                entry("foo_libs", "amd64", "installed", "foo_bins"),
+                entry("foo_libs", "arm64", "installed", "foo_bins"),
+                entry("qux_libs", "amd64", "not verified", "qux_libs"),
+            ],
+        )
+        self.assertEqual(
+            report["matrix"],
+            {
+                "bar_data": {"amd64": "untested"},
+                "bar_libs": {"amd64": "failed"},
+                "baz_libs": {"amd64": "cached pass"},
+                "foo_bins": {"amd64": "installed", "arm64": "installed"},
+                "foo_libs": {"amd64": "installed", "arm64": "installed"},
+                "qux_libs": {"amd64": "not verified"},
+            },
+        )
+
+    def test_bisect_cut(self):
+        """
+        Test bisect_cut()
+        """
+        entries = [(pkg, "libs", [f"{pkg}_libs"]) for pkg in "abcdefgh"]
+        cuts = []
+
+        checked = []
+
+        async def cut(batch, unchecked):
+            names = {pkg for pkg, _, _ in batch}
+            cuts.append(names)
+            if "c" in names:
+                return "c is broken", {}
+            if {"e", "h"} <= names or {"a", "d"} <= names:
+                return "conflict", {}
+            checked.extend(pkg for pkg, _, _ in unchecked)
+            errors = {"g_libs": "g has a copyright file"}
+            return None, {k: v for k, v in errors.items() if k[0] in checked}
+
+        results, conflicts = asyncio.run(bisect_cut(entries, cut))
+        self.assertEqual(
+            [(r.slice_name, r.error) for r in results],
+            [
+                ("a_libs", None),
+                ("b_libs", None),
+                ("c_libs", "c is broken"),
+                ("d_libs", None),
+                ("e_libs", None),
+                ("f_libs", None),
+                ("g_libs", "g has a copyright file"),
+                ("h_libs", None),
+            ],
+        )
+        # a and d conflict, although c fails on its own in the same half
+        self.assertEqual(
+            conflicts,
+            [
+                Conflict(("a_libs", "d_libs"), "conflict"),
+                Conflict(("e_libs", "h_libs"), "conflict"),
+            ],
+        )
+        # every slice that installs is checked once
+        self.assertEqual(sorted(checked), list("abdefgh"))
+        # a batch that installs only takes one cut, even if the checks fail
+        cuts.clear()
+        results, conflicts = asyncio.run(bisect_cut(entries[5:7], cut))
+        self.assertEqual(len(cuts), 1)
+        self.assertEqual(results[1].error, "g has a copyright file")
+        results, conflicts = asyncio.run(bisect_cut(entries[:2], cut))
+        self.assertEqual(conflicts, [])
+        self.assertEqual([r.covered for r in results], [["a_libs"], ["b_libs"]])
+
+    def test_batch_sizer(self):
+        """
+        Test BatchSizer
+        """
+        sizer = BatchSizer(32)
+        self.assertEqual(sizer.size, 32)
+        sizer.update([CutResult(f"{i}_libs", []) for i in range(99)])
+        sizer.update([CutResult("bad_libs", [], "error")])
+        self.assertEqual(sizer.size, 10)
+        sizer.update([CutResult("bad_libs", [], "error")] * 100)
+        self.assertEqual(sizer.size, 1)
+
+    @unittest.mock.patch("os.getloadavg")
+    def test_concurrency_controller(self, mock_getloadavg):
+        """
+        Test ConcurrencyController
+        """
+        mock_getloadavg.return_value = (0.0, 0.0, 0.0)
+        controller = ConcurrencyController(4, 2, 6)
+        # cuts without trouble raise the limit by one per round of cuts
+        for _ in range(4):
+            controller.record_latency(1.0)
+        self.assertEqual(int(controller.limit), 4)
+        for _ in range(5):
+            controller.record_latency(1.0)
+        self.assertEqual(int(controller.limit), 5)
+        # ... but not when the CPUs are saturated
+        mock_getloadavg.return_value = (1000.0, 0.0, 0.0)
+        limit = controller.limit
+        controller.record_latency(1.0)
+        self.assertEqual(controller.limit, limit)
+        # archive errors halve the limit, within the bounds
+        controller._latency_slow = 0
+        controller.record_retry()
+        self.assertEqual(int(controller.limit), 2)
+        controller.record_retry()
+        self.assertEqual(int(controller.limit), 2)
+        self.assertEqual([limit for _, limit in controller.history], [4, 5, 2])
+
+        async def run():
+            running = []
+            peak = 0
+
+            async def cut():
+                nonlocal peak
+                async with controller.slot():
+                    running.append(1)
+                    peak = max(peak, len(running))
+                    await asyncio.sleep(0.01)
+                    running.pop()
+
+            await asyncio.gather(*(cut() for _ in range(6)))
+            return peak
+
+        controller = ConcurrencyController(3, 3, 3)
+        self.assertEqual(asyncio.run(run()), 3)
+
+        async def run_workers():
+            active = []
+
+            async def worker():
+                async with controller.worker():
+                    active.append(controller.active)
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(*(worker() for _ in range(6)))
+            return max(active)
+
+        # only as many workers as the limit hold work
+        controller = ConcurrencyController(2, 2, 6)
+        self.assertEqual(asyncio.run(run_workers()), 2)
+
+    def test_group_by_affinity(self):
+        """
+        Test group_by_affinity()
+        """
+        plan = [
+            ("foo", "bins", ["foo_bins"]),
+            ("bar", "bins", ["bar_bins"]),
+            ("foo", "config", ["foo_config"]),
+            ("baz", "bins", ["baz_bins"]),
+        ]
+        groups = group_by_affinity(plan)
+        self.assertEqual(
+            groups,
+            [
+                [("foo", "bins", ["foo_bins"]), ("foo", "config", ["foo_config"])],
+                [("bar", "bins", ["bar_bins"])],
+                [("baz", "bins", ["baz_bins"])],
+            ],
+        )
+        # bar and baz share libbar, foo only shares libc6 with them
+        closures = {
+            "foo_bins": {"foo_bins", "libc6_libs"},
+            "foo_config": {"foo_config"},
+            "bar_bins": {"bar_bins", "libbar_libs", "libc6_libs"},
+            "baz_bins": {"baz_bins", "libbar_libs", "libc6_libs"},
+        }
+        groups = group_by_affinity(plan, closures)
+        self.assertEqual(
+            groups,
+            [
+                [("foo", "bins", ["foo_bins"]), ("foo", "config", ["foo_config"])],
+                [("bar", "bins", ["bar_bins"]), ("baz", "bins", ["baz_bins"])],
+            ],
+        )
+        # large groups are split for other workers to share them
+        plan = [("foo", slice, [f"foo_{slice}"]) for slice in ["a", "b", "c"]]
+        self.assertEqual(group_by_affinity(plan, max_size=2), [plan[:2], plan[2:]])
+        self.assertEqual(group_by_affinity(plan, max_size=3), [plan])
+
+    def test_cache_stats(self):
+        """
+        Test CacheStats
+        """
+        def info(pkg):
+            return PackageInfo(pkg, "1", "amd64", "jammy", "main", "", f"{pkg}-sha256", 1, 1)
+
+        with tempfile.TemporaryDirectory() as pkg_cache:
+            stats = CacheStats(
+                {"foo_bins": {"foo_bins", "libc6_libs", "bar_libs"}},
+                {"foo": info("foo"), "libc6": info("libc6")},
+                pathlib.Path(pkg_cache),
+            )
+            # packages that are not in the index are not accounted for
+            self.assertEqual(stats.lookup(["foo_bins"]), (set(), {"foo", "libc6"}))
+            # a deb in the cache is a hit, whoever downloaded it
+            pathlib.Path(pkg_cache, "libc6-sha256").touch()
+            self.assertEqual(stats.lookup(["foo_bins"]), ({"libc6"}, {"foo"}))
+            self.assertEqual(stats.lookup(["libc6_libs"]), ({"libc6"}, set()))
+        self.assertEqual(
+            stats.summary(),
+            {
+                "foo": {"hits": 0, "misses": 2, "hit_rate": 0.0},
+                "libc6": {"hits": 2, "misses": 1, "hit_rate": 0.667},
+            },
+        )
+
+    def test_estimate_durations(self):
+        """
+        Test estimate_durations()
+        """
+
+        def info(pkg, size, installed_size):
+            return PackageInfo(pkg, "1", "amd64", "jammy", "main", "", "", size, installed_size)
+
+        plan = [
+            ("foo", "bins", ["foo_bins"]),
+            ("bar", "bins", ["bar_bins"]),
+            ("baz", "bins", ["baz_bins"]),
+        ]
+        closures = {"foo_bins": {"foo_bins", "libc6_libs"}}
+        index = {
+            "foo": info("foo", 10, 90),
+            "bar": info("bar", 100, 900),
+            "libc6": info("libc6", 1000, 9000),
+        }
+        durations = estimate_durations(plan, closures, index)
+        self.assertEqual(
+            durations, {"foo_bins": 10100.0, "bar_bins": 1000.0, "baz_bins": 0.0}
+        )
+        # sizes are converted to seconds using the history
+        durations = estimate_durations(plan, closures, index, {"bar_bins": 2.0})
+        self.assertEqual(
+            durations, {"foo_bins": 20.2, "bar_bins": 2.0, "baz_bins": 0.0}
+        )
+
+    def test_order_longest_first(self):
+        """
+        Test order_longest_first()
+        """
+        groups = [
+            [("foo", "bins", ["foo_bins"]), ("foo", "libs", ["foo_libs"])],
+            [("bar", "bins", ["bar_bins"])],
+            [("baz", "bins", ["baz_bins"])],
+        ]
+        durations = {"foo_bins": 1.0, "foo_libs": 2.0, "bar_bins": 4.0}
+        self.assertEqual(
+            order_longest_first(groups, durations),
+            [groups[1], groups[0], groups[2]],
+        )
+
+    def test_tracer(self):
+        """
+        Test Tracer
+        """
+        tracer = Tracer()
+        with tracer.span("ignored", "cut"):
+            pass
+        self.assertEqual(tracer.events, [])
+
+        tracer.enabled = True
+
+        async def worker(name):
+            install_slices._trace_worker.set(name)
+            with tracer.span("chisel cut", "cut", attempt=1) as args:
+                await asyncio.sleep(0.01)
+                args["returncode"] = 0
+            tracer.instant("retry", "retry")
+
+        async def run():
+            await asyncio.gather(worker("worker 1"), worker("worker 2"))
+
+        asyncio.run(run())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "trace.json")
+            tracer.save(path)
+            with open(path, encoding="utf-8") as f:
+                events = json.load(f)["traceEvents"]
+        names = {e["args"]["name"]: e["tid"] for e in events if e["ph"] == "M"}
+        self.assertEqual(set(names), {"worker 1", "worker 2"})
+        spans = [e for e in events if e["ph"] == "X"]
+        self.assertEqual(len(spans), 2)
+        self.assertEqual({e["tid"] for e in spans}, set(names.values()))
+        for span in spans:
+            self.assertGreaterEqual(span["dur"], 10000)
+            self.assertEqual(span["args"], {"attempt": 1, "returncode": 0})
+        self.assertEqual(len([e for e in events if e["ph"] == "i"]), 2)
+
+    def test_result_cache_key(self):
+        """
+        Test result_cache_key()
+        """
+
+        entry = ("foo", "bins", ["foo_bins"])
+        closures = {
+            "foo_bins": {"foo_bins", "libc6_libs"},
+            "base-files_chisel": {"base-files_chisel"},
+        }
+        packages = {
+            "foo": Package("foo", ["bins"], digest="a"),
+            "libc6": Package("libc6", ["libs"], digest="b"),
+            "base-files": Package("base-files", ["chisel"], digest="d"),
+        }
+        versions = {"foo": "1", "libc6": "2", "base-files": "4"}
+        key = result_cache_key(entry, closures, packages, versions, "ctx")
+        self.assertIsNotNone(key)
+        self.assertEqual(key, result_cache_key(entry, closures, packages, versions, "ctx"))
+        # the key changes with the context, the essentials and the versions
+        self.assertNotEqual(key, result_cache_key(entry, closures, packages, versions, "x"))
+        packages["libc6"] = Package("libc6", ["libs"], digest="c")
+        key2 = result_cache_key(entry, closures, packages, versions, "ctx")
+        self.assertNotEqual(key, key2)
+        versions["libc6"] = "3"
+        key3 = result_cache_key(entry, closures, packages, versions, "ctx")
+        self.assertNotEqual(key2, key3)
+        # ... and with the slice that generates the manifest
+        manifest_key = result_cache_key(
+            entry, closures, packages, versions, "ctx", "base-files_chisel"
+        )
+        self.assertNotIn(manifest_key, (None, key3))
+        versions["base-files"] = "5"
+        self.assertNotEqual(
+            manifest_key,
+            result_cache_key(entry, closures, packages, versions, "ctx", "base-files_chisel"),
+        )
+        # a package missing from the archive cannot be cached
+        del versions["libc6"]
+        self.assertIsNone(result_cache_key(entry, closures, packages, versions, "ctx"))
+
+    def test_result_cache_context(self):
+        """
+        Test result_cache_context()
+        """
+        with tempfile.TemporaryDirectory() as release:
+            chisel_yaml = os.path.join(release, "chisel.yaml")
+            with open(chisel_yaml, "w", encoding="utf-8") as f:
+                f.write("format: v1\n")
+            chisels = {"main": "chisel"}
+            context = result_cache_context("amd64", DEFAULT_ARCHIVE, chisels, release)
+            self.assertEqual(
+                context, result_cache_context("amd64", DEFAULT_ARCHIVE, chisels, release)
+            )
+            self.assertNotEqual(
+                context, result_cache_context("arm64", DEFAULT_ARCHIVE, chisels, release)
+            )
+            # the context changes with chisel.yaml ...
+            with open(chisel_yaml, "w", encoding="utf-8") as f:
+                f.write("format: v2\n")
+            context2 = result_cache_context("amd64", DEFAULT_ARCHIVE, chisels, release)
+            self.assertNotEqual(context, context2)
+            # ... and with the sources of the checks
+            with unittest.mock.patch.object(install_slices, "__file__", chisel_yaml):
+                self.assertNotEqual(
+                    context2,
+                    result_cache_context("amd64", DEFAULT_ARCHIVE, chisels, release),
+                )
+
+    def test_availability_versions(self):
+        """
+        Test Availability.versions()
+        """
+        availability = Availability(
+            "ubuntu-22.04",
+            ["amd64", "arm64"],
+            {
+                "hello": {
+                    "jammy": {"2.10-2ubuntu4": ["amd64", "arm64"]},
+                    "jammy-updates": {"2.10-2ubuntu4.1": ["amd64"]},
+                },
+                "foo123": {},
+            },
+        )
+        self.assertEqual(availability.versions("amd64"), {"hello": "2.10-2ubuntu4.1"})
+        self.assertEqual(availability.versions("arm64"), {"hello": "2.10-2ubuntu4"})
+
+    def test_result_cache(self):
+        """
+        Test ResultCache
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ResultCache(tmpdir, 2)
+            self.assertFalse(cache.get("aa01"))
+            for i, key in enumerate(["aa01", "bb02", "cc03"]):
+                cache.add(key, [f"foo_{key}"])
+                os.utime(os.path.join(tmpdir, key[:2], key), (i, i))
+            # a lookup marks the entry as recently used
+            self.assertTrue(cache.get("aa01"))
+            self.assertEqual(cache.prune(), 1)
+            self.assertTrue(cache.get("aa01"))
+            self.assertFalse(cache.get("bb02"))
+            self.assertTrue(cache.get("cc03"))
+
+    def test_execution_plan(self):
+        """
+        Test execution_plan()
+        """
+
+        def info(pkg, size):
+            return PackageInfo(pkg, "1", "amd64", "jammy", "main", "", pkg * 4, size, 2 * size)
+
+        work = [
+            ("amd64", [("foo", "bins", ["foo_bins"]), ("foo", "libs", ["foo_libs"])]),
+            ("amd64", [("bar", "bins", ["bar_bins"])]),
+            ("arm64", [("bar", "bins", ["bar_bins"])]),
+        ]
+        closure = {
+            "foo_bins": {"foo_bins", "libc6_libs"},
+            "foo_libs": {"foo_libs"},
+            "bar_bins": {"bar_bins", "libc6_libs"},
+        }
+        closures = {"amd64": closure, "arm64": closure}
+        index = {"foo": info("foo", 10), "bar": info("bar", 20), "libc6": info("libc6", 100)}
+        indices = {"amd64": index, "arm64": index}
+        durations = {"foo_bins": 3.0, "foo_libs": 1.0, "bar_bins": 2.0}
+        with tempfile.TemporaryDirectory() as pkg_cache:
+            # libc6 is already in the cache
+            pathlib.Path(pkg_cache, "libc6" * 4).touch()
+            plan = execution_plan(
+                work,
+                closures,
+                indices,
+                {"amd64": durations, "arm64": durations},
+                2,
+                pathlib.Path(pkg_cache),
+            )
+        self.assertEqual(
+            [(c["arch"], c["slice"], c["packages"], c["cache_hits"]) for c in plan["cuts"]],
+            [
+                ("amd64", "foo_bins", ["foo", "libc6"], ["libc6"]),
+                ("amd64", "foo_libs", ["foo"], ["foo"]),
+                ("amd64", "bar_bins", ["bar", "libc6"], ["libc6"]),
+                ("arm64", "bar_bins", ["bar", "libc6"], ["libc6"]),
+            ],
+        )
+        self.assertEqual(plan["download_bytes"], {"amd64": 30, "arm64": 20})
+        self.assertEqual(plan["cache"], {"hits": 4, "misses": 3})
+        self.assertEqual(plan["packages"]["arm64"]["bar"], {"version": "1", "size": 20, "installed_size": 40})
+        self.assertEqual(plan["cut_seconds"], 8.0)
+        # foo (4s) on the first worker, bar on amd64 then arm64 on the second
+        self.assertEqual(plan["estimated_seconds"], 4.0)
+        # without a history for arm64, the duration is unknown
+        plan = execution_plan(work, closures, indices, {"amd64": durations}, 2)
+        self.assertIsNone(plan["cuts"][3]["estimated_seconds"])
+        self.assertIsNone(plan["estimated_seconds"])
+
+    def test_prefetcher(self):
+        """
+        Test Prefetcher with a local HTTP mirror
+        """
+        with tempfile.TemporaryDirectory() as mirror, tempfile.TemporaryDirectory() as cache:
+            index = {}
+            for pkg in ["foo", "libc6"]:
+                content = f"{pkg} deb".encode()
+                with open(os.path.join(mirror, f"{pkg}.deb"), "wb") as f:
+                    f.write(content)
+                index[pkg] = PackageInfo(
+                    pkg,
+                    "1",
+                    "amd64",
+                    "jammy",
+                    "main",
+                    f"{pkg}.deb",
+                    hashlib.sha256(content).hexdigest(),
+                    len(content),
+                    0,
+                )
+            handler = functools.partial(
+                http.server.SimpleHTTPRequestHandler, directory=mirror
+            )
+            server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                prefetcher = Prefetcher(
+                    index,
+                    {"foo_bins": {"foo_bins", "libc6_libs", "bar_libs"}},
+                    pathlib.Path(cache),
+                    f"http://127.0.0.1:{server.server_port}",
+                    2,
+                )
+
+                async def run():
+                    task = asyncio.create_task(prefetcher.run(["foo_bins"]))
+                    await asyncio.sleep(0)
+                    await prefetcher.wait(["foo_bins"])
+                    self.assertEqual(
+                        sorted(os.listdir(cache)),
+                        sorted(info.sha256 for info in index.values()),
+                    )
+                    await task
+
+                asyncio.run(run())
+            finally:
+                server.shutdown()
+        self.assertEqual(
+            {pkg: d["status"] for pkg, d in prefetcher.downloads.items()},
+            {"foo": "downloaded", "libc6": "downloaded"},
+        )
+        self.assertEqual(prefetcher.downloads["foo"]["bytes"], 7)
+
+    def test_prefetcher_error(self):
+        """
+        Test that Prefetcher does not leave the cuts waiting when a download
+        fails unexpectedly
+        """
+        info = PackageInfo("foo", "1", "amd64", "jammy", "main", "foo.deb", "0", 1, 0)
+        with tempfile.TemporaryDirectory() as cache:
+            prefetcher = Prefetcher(
+                {"foo": info, "libc6": info},
+                {"foo_bins": {"foo_bins", "libc6_libs"}},
+                pathlib.Path(cache),
+                "http://127.0.0.1:1",
+                1,
+            )
+
+            async def run():
+                task = asyncio.create_task(prefetcher.run(["foo_bins"]))
+                await asyncio.sleep(0)
+                await asyncio.wait_for(prefetcher.wait(["foo_bins"]), 5)
+                with self.assertRaises(RuntimeError):
+                    await task
+
+            with unittest.mock.patch.object(
+                Prefetcher, "_download", side_effect=RuntimeError("boom")
+            ):
+                asyncio.run(run())
+
     def test_query_package_existence(self):
         """
         Test query_package_existence()
@@ -190,6 +1212,145 @@ class TestScriptMethods(unittest.TestCase):
         except SystemExit as e:
             self.assertEqual(e.code, 1)
 
+    @unittest.mock.patch("subprocess.run")
+    def test_query_availability(self, mock_run):
+        """
+        Test query_availability() and Availability
+        """
+        mock_run.return_value = subprocess.CompletedProcess(
+            [],
+            0,
+            " hello | 2.10-2ubuntu4 | jammy | amd64, arm64\n"
+            " hello | 2.10-2ubuntu4.1 | jammy-updates | amd64\n"
+            " tzdata | 2022a | jammy/universe | all\n",
+        )
+        availability = query_availability(
+            ["hello", "tzdata", "foo123"], DEFAULT_ARCHIVE, ["amd64", "i386"]
+        )
+        self.assertEqual(
+            availability,
+            Availability(
+                "ubuntu-22.04",
+                ["amd64", "i386"],
+                {
+                    "hello": {
+                        "jammy": {"2.10-2ubuntu4": ["amd64"]},
+                        "jammy-updates": {"2.10-2ubuntu4.1": ["amd64"]},
+                    },
+                    "tzdata": {"jammy": {"2022a": ["amd64", "i386"]}},
+                    "foo123": {},
+                },
+            ),
+        )
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(availability.architectures("tzdata"), {"amd64", "i386"})
+        self.assertEqual(availability.architectures("foo123"), set())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "availability.json")
+            availability.save(path)
+            self.assertEqual(Availability.load(path), availability)
+
+        # The matrix answers for the packages it covers, the others are
+        # queried.
+        mock_run.reset_mock()
+        mock_run.return_value = subprocess.CompletedProcess(
+            [], 0, " libc6 | 2.35-0ubuntu3 | jammy | amd64, i386\n"
+        )
+        self.assertEqual(
+            query_package_architectures(
+                ["hello", "foo123", "libc6"],
+                DEFAULT_ARCHIVE,
+                ["i386"],
+                availability=availability,
+            ),
+            {"libc6": {"i386"}},
+        )
+        self.assertEqual(mock_run.call_args.args[0][-1], "libc6")
+        # Architectures not in the matrix are queried.
+        mock_run.reset_mock()
+        query_package_architectures(
+            ["hello"], DEFAULT_ARCHIVE, ["s390x"], availability=availability
+        )
+        self.assertEqual(mock_run.call_count, 1)
+        with self.assertRaises(SystemExit):
+            query_package_architectures(
+                ["hello"],
+                dataclasses.replace(DEFAULT_ARCHIVE, version="24.04"),
+                ["amd64"],
+                availability=availability,
+            )
+
+        # Packages the matrix does not find are looked for on any
+        # architecture, like without the matrix.
+        mock_run.reset_mock()
+        mock_run.return_value = subprocess.CompletedProcess(
+            [], 0, " foo123 | 1.0 | jammy | s390x\n"
+        )
+        ensure_package_existence(["hello", "foo123"], DEFAULT_ARCHIVE, availability)
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(mock_run.call_args.args[0][0], "rmadison")
+        self.assertNotIn("--architecture", mock_run.call_args.args[0])
+        self.assertEqual(mock_run.call_args.args[0][-1], "foo123")
+        mock_run.return_value = subprocess.CompletedProcess([], 0, "")
+        with self.assertRaises(SystemExit):
+            ensure_package_existence(["hello", "foo123"], DEFAULT_ARCHIVE, availability)
+        # A matrix of every architecture answers alone.
+        mock_run.reset_mock()
+        with self.assertRaises(SystemExit):
+            ensure_package_existence(
+                ["hello", "foo123"],
+                DEFAULT_ARCHIVE,
+                dataclasses.replace(availability, arches=list(CHISEL_ARCHES)),
+            )
+        mock_run.assert_not_called()
+
+    def test_availability_from_table(self):
+        """
+        Test Availability.from_table()
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for suite, arch, version in [
+                ("jammy", "amd64", "2.10-2ubuntu4"),
+                ("jammy", "arm64", "2.10-2ubuntu4"),
+                ("jammy-updates", "amd64", "2.10-2ubuntu4.1"),
+            ]:
+                path = os.path.join(tmpdir, "dists", suite, "main", f"binary-{arch}")
+                os.makedirs(path, exist_ok=True)
+                with open(os.path.join(path, "Packages.gz"), "wb") as f:
+                    f.write(gzip.compress(f"Package: hello\nVersion: {version}\n".encode()))
+            path = os.path.join(tmpdir, "dists", "jammy-updates", "main", "binary-arm64")
+            os.makedirs(path)
+            with open(os.path.join(path, "Packages.gz"), "wb") as f:
+                f.write(gzip.compress(b""))
+            table_path = os.path.join(tmpdir, "packages.table")
+            build_package_table(
+                table_path,
+                "ubuntu-22.04",
+                ["jammy", "jammy-updates"],
+                ["main"],
+                ["arm64", "amd64"],
+                base_url=tmpdir,
+            )
+            with PackageTable(table_path) as table:
+                self.assertEqual(
+                    Availability.from_table(table, ["hello", "foo123"]),
+                    Availability(
+                        "ubuntu-22.04",
+                        ["amd64", "arm64"],
+                        {
+                            "hello": {
+                                "jammy": {"2.10-2ubuntu4": ["amd64", "arm64"]},
+                                "jammy-updates": {"2.10-2ubuntu4.1": ["amd64"]},
+                            },
+                            "foo123": {},
+                        },
+                    ),
+                )
+                self.assertEqual(
+                    Availability.from_table(table, ["hello"], ["arm64"]).packages,
+                    {"hello": {"jammy": {"2.10-2ubuntu4": ["arm64"]}}},
+                )
+
     def test_ignore_missing_packages(self):
         """
         Test ignore_missing_packages()
@@ -212,64 +1373,710 @@ class TestScriptMethods(unittest.TestCase):
             ],
         )
 
-    def test_install_slice(self):
+    def test_chisel_cut(self):
         """
-        Test install_slice()
+        Test chisel_cut()
         """
-        mock_missing_copyright = set()
-        install_slice("libc6", "libs", "amd64", "ubuntu-22.04", mock_missing_copyright)
-        assert mock_missing_copyright == set()
-        #
-        try:
-            install_slice(
-                "foo123", "bar", "amd64", "ubuntu-22.04", mock_missing_copyright
+        with tempfile.TemporaryDirectory() as tmpdir:
+            chisel = os.path.join(tmpdir, "chisel")
+            with open(chisel, "w", encoding="utf-8") as f:
+                f.write(
+                    "#!/bin/sh\n"
+                    'echo "$@" >> "$XDG_CACHE_HOME/calls"\n'
+                    'test "$(wc -l < "$XDG_CACHE_HOME/calls")" -gt 1 && exit 0\n'
+                    'echo "error: cannot fetch from archive" >&2\n'
+                    "exit 1\n"
+                )
+            os.chmod(chisel, 0o755)
+            usage = CutUsage()
+            retries = []
+            engine = RetryEngine(default_retry_policies(0))
+            slots = ConcurrencyController(1, 1, 1)
+            err = asyncio.run(
+                chisel_cut(
+                    arch="amd64",
+                    release="ubuntu-22.04",
+                    root="/root",
+                    slice_names=["hello_bins"],
+                    chisel_version="v1.4.2",
+                    cache_dir=tmpdir,
+                    chisel=chisel,
+                    retries=engine,
+                    slots=slots,
+                    on_retry=lambda: retries.append(True),
+                    usage=usage,
+                )
+            )
+            self.assertIsNone(err)
+            self.assertEqual(len(retries), 1)
+            # every attempt takes a slot of its own
+            self.assertEqual(slots._samples, 2)
+            self.assertEqual(slots.in_flight, 0)
+            with open(os.path.join(tmpdir, "calls"), encoding="utf-8") as f:
+                self.assertEqual(
+                    f.read().splitlines(),
+                    [
+                        "cut --arch amd64 --release ubuntu-22.04 --root /root "
+                        "--ignore=unstable hello_bins"
+                    ]
+                    * 2,
+                )
+            self.assertGreater(usage.max_rss, 0)
+            self.assertEqual(
+                [(d["class"], d["decision"]) for d in engine.decisions],
+                [("fetch", "retry")],
+            )
+            # the error of the last attempt is returned
+            err = asyncio.run(
+                chisel_cut(
+                    arch="amd64",
+                    release="ubuntu-22.04",
+                    root="/root",
+                    slice_names=["hello_bins"],
+                    chisel_version="v1.4.2",
+                    cache_dir=tmpdir,
+                    chisel="false",
+                    retries=engine,
+                )
+            )
+            self.assertEqual(err, "")
+            self.assertEqual(engine.decisions[-1]["decision"], "not retriable")
+
+    def test_classify_error(self):
+        """
+        Test classify_error()
+        """
+        self.assertEqual(
+            classify_error("error: cannot fetch from archive: 503"), "fetch"
+        )
+        self.assertEqual(
+            classify_error("error: cannot talk to archive: timeout"), "talk"
+        )
+        self.assertEqual(
+            classify_error("error: cannot find archive data"), "missing data"
+        )
+        self.assertEqual(
+            classify_error("error: slices foo_a and bar_b conflict on /x"),
+            "non-retriable",
+        )
+
+    def test_retry_engine(self):
+        """
+        Test RetryEngine
+        """
+        policy = RetryPolicy(3, 1.0, 3.0)
+        rng = random.Random(0)
+        for attempt, cap in [(1, 1.0), (2, 2.0), (3, 3.0), (10, 3.0)]:
+            delays = [policy.delay(attempt, rng) for _ in range(100)]
+            self.assertTrue(all(0 <= d <= cap for d in delays))
+            self.assertGreater(max(delays), cap / 2)
+        engine = RetryEngine({"fetch": policy}, budget=2, seed=0)
+        self.assertIsNotNone(engine.decide("fetch", 1, ["a_bins"]))
+        self.assertIsNotNone(engine.decide("fetch", 2, ["a_bins"]))
+        # the attempts of the policy are spent
+        self.assertIsNone(engine.decide("fetch", 3, ["a_bins"]))
+        # the budget is spent
+        self.assertIsNone(engine.decide("fetch", 1, ["b_bins"]))
+        self.assertIsNone(engine.decide("non-retriable", 1, ["c_bins"]))
+        summary = engine.summary()
+        self.assertEqual((summary["budget"], summary["used"]), (2, 2))
+        self.assertEqual(
+            summary["classes"],
+            {
+                "fetch": {"retry": 2, "give up": 1, "budget exhausted": 1},
+                "non-retriable": {"not retriable": 1},
+            },
+        )
+        self.assertEqual(
+            [d["slices"] for d in summary["decisions"]],
+            [["a_bins"], ["a_bins"], ["a_bins"], ["b_bins"], ["c_bins"]],
+        )
+
+    def test_circuit_breaker(self):
+        """
+        Test CircuitBreaker
+        """
+
+        async def run():
+            breaker = CircuitBreaker(window=4, threshold=0.5, cooldown=0.05)
+            for error in [True, False, False, True]:
+                await breaker.record(error)
+            self.assertEqual(breaker.state, "open")
+            start = time.monotonic()
+            # one probe goes once the cooldown is over, the others wait for it
+            waiters = [asyncio.create_task(breaker.wait()) for _ in range(3)]
+            await asyncio.sleep(0.1)
+            self.assertEqual(sum(w.done() for w in waiters), 1)
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+            self.assertEqual(breaker.state, "half-open")
+            probes = [w for w in waiters if w.done()]
+            probe = probes[0].result()
+            self.assertIsNotNone(probe)
+            # the outcomes of other processes do not count
+            await breaker.record(False)
+            self.assertEqual(breaker.state, "half-open")
+            # the probe failed: open for twice as long
+            await breaker.record(True, probe)
+            self.assertEqual((breaker.state, breaker.cooldown), ("open", 0.1))
+            await asyncio.sleep(0.15)
+            self.assertEqual(sum(w.done() for w in waiters), 2)
+            # the probe was cancelled: another one goes
+            probes += [w for w in waiters if w.done() and w not in probes]
+            await breaker.release(probes[-1].result())
+            await asyncio.sleep(0.01)
+            self.assertEqual(sum(w.done() for w in waiters), 3)
+            probe = next(w for w in waiters if w not in probes).result()
+            # the probe passed: everyone goes
+            await breaker.record(False, probe)
+            await asyncio.wait_for(asyncio.gather(*waiters), 1)
+            self.assertEqual((breaker.state, breaker.cooldown), ("closed", 0.05))
+            # releasing a probe that recorded its outcome does nothing
+            await breaker.release(probe)
+            self.assertEqual(await breaker.wait(), None)
+            return breaker.history
+
+        history = asyncio.run(run())
+        self.assertEqual(
+            [h["state"] for h in history],
+            ["open", "half-open", "open", "half-open", "closed"],
+        )
+
+    def test_cut_usage(self):
+        """
+        Test CutUsage
+        """
+        usage = CutUsage(1.0, 0.5, 100, 4096, 300, 200, {"main": ChiselTimings([1.5])})
+        usage.add(
+            CutUsage(2.0, 0.5, 50, 0, 600, 100, {"main": ChiselTimings([0.5, 2.0], 1, 2, 1)})
+        )
+        self.assertEqual(
+            usage,
+            CutUsage(
+                3.0, 1.0, 100, 4096, 600, 300, {"main": ChiselTimings([1.5, 0.5, 2.0], 1, 2, 1)}
+            ),
+        )
+        self.assertEqual(
+            usage.share(3),
+            CutUsage(
+                1.0, 0.333, 100, 1365, 200, 100, {"main": ChiselTimings([0.5, 0.167, 0.667], 1, 2, 1)}
+            ),
+        )
+
+    def test_slice_timings(self):
+        """
+        Test slice_timings()
+        """
+        usage = CutUsage(
+            chisel={"v1.2.0": ChiselTimings([1.0, 2.0], 1, 0, 2), "main": ChiselTimings([1.5])}
+        )
+        results = [
+            CutResult("foo_bins", ["foo_bins"], "error", 5.0, arch="amd64", usage=usage),
+            CutResult("bar_libs", ["bar_libs"], cached=True, arch="amd64"),
+        ]
+        self.assertEqual(
+            slice_timings(results),
+            [
+                SliceTiming("amd64", "foo_bins", "v1.2.0", 5.0, 3.0, [1.0, 2.0], 1, 0, 2, True),
+                SliceTiming("amd64", "foo_bins", "main", 5.0, 1.5, [1.5], 0, 0, 0, True),
+            ],
+        )
+
+    def test_cache_lock(self):
+        """
+        Test cache_lock()
+        """
+
+        async def hold(events, name):
+            async with cache_lock("/cache", name):
+                events.append(f"{name} in")
+                await asyncio.sleep(0.01)
+                events.append(f"{name} out")
+
+        async def run():
+            events = []
+            await asyncio.gather(hold(events, "foo"), hold(events, "foo"))
+            self.assertEqual(events, ["foo in", "foo out", "foo in", "foo out"])
+            events = []
+            await asyncio.gather(hold(events, "foo"), hold(events, "bar"))
+            self.assertEqual(events, ["foo in", "bar in", "foo out", "bar out"])
+
+        asyncio.run(run())
+
+    @unittest.mock.patch("install_slices.chisel_cut")
+    def test_chisel_cut_shared_cache(self, mock_chisel_cut):
+        """
+        Test chisel_cut_shared_cache()
+        """
+
+        async def cut(cache_dir):
+            return await chisel_cut_shared_cache(
+                arch="amd64",
+                pkgs=["hello"],
+                cache_dir=cache_dir,
+                slots=ConcurrencyController(1, 1, 1),
+                slice_names=["hello_bins"],
+                root="/",
             )
-            assert False
-        except SystemExit as e:
-            self.assertEqual(e.code, 1)
 
-    @unittest.mock.patch("os.popen")
-    @unittest.mock.patch("pathlib.Path.rglob")
-    @unittest.mock.patch("apt.debfile.DebPackage.__new__")
-    @unittest.mock.patch("magic.from_file")
-    def test_deb_has_copyright_file(
-        self, mock_magic, mock_debpackage, mock_rglob, mock_popen
-    ):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            ready = os.path.join(cache_dir, ".index-ready-amd64")
+            # a cut failing with an archive error does not mark the indices
+            # as ready
+            mock_chisel_cut.return_value = "cannot fetch from archive"
+            err = asyncio.run(cut(cache_dir))
+            self.assertEqual(err, "cannot fetch from archive")
+            self.assertFalse(os.path.exists(ready))
+            mock_chisel_cut.assert_called_once_with(
+                arch="amd64",
+                cache_dir=cache_dir,
+                slice_names=["hello_bins"],
+                slots=unittest.mock.ANY,
+                on_retry=unittest.mock.ANY,
+                usage=None,
+                root="/",
+            )
+            # a cut failing for the slices does, since chisel fetched the
+            # indices before failing
+            mock_chisel_cut.return_value = "slice hello_bins has no contents"
+            err = asyncio.run(cut(cache_dir))
+            self.assertEqual(err, "slice hello_bins has no contents")
+            self.assertTrue(os.path.exists(ready))
+            # and so does a successful cut
+            os.remove(ready)
+            mock_chisel_cut.return_value = None
+            err = asyncio.run(cut(cache_dir))
+            self.assertIsNone(err)
+            self.assertTrue(os.path.exists(ready))
+
+    @unittest.mock.patch("install_slices.chisel_cut")
+    def test_install_all_slices(self, mock_chisel_cut):
+        """
+        Test install_all_slices()
+        """
+
+        async def chisel_cut(*, slice_names, **kwargs):
+            await asyncio.sleep(0.01)
+            return "error" if "bar_libs" in slice_names else None
+
+        mock_chisel_cut.side_effect = chisel_cut
+        groups = [
+            ("amd64", [(pkg, "libs", [f"{pkg}_libs"])]) for pkg in ["foo", "bar", "baz", "qux"]
+        ] + [("arm64", [("foo", "libs", ["foo_libs"]), ("bar", "libs", ["bar_libs"])])]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            results, conflicts, _ = asyncio.run(
+                install_all_slices(
+                    groups,
+                    False,
+                    "ubuntu-22.04",
+                    {"unknown": "chisel"},
+                    cache_dir,
+                    ConcurrencyController(2, 2, 2),
+                    batch_size=2,
+                )
+            )
+        # every slice is attempted on every architecture, even after a failure
+        self.assertEqual(
+            sorted((r.arch, r.slice_name, r.error) for r in results),
+            [
+                ("amd64", "bar_libs", "error"),
+                ("amd64", "baz_libs", None),
+                ("amd64", "foo_libs", None),
+                ("amd64", "qux_libs", None),
+                ("arm64", "bar_libs", "error"),
+                ("arm64", "foo_libs", None),
+            ],
+        )
+        self.assertEqual(conflicts, [])
+        # slices of different architectures are never cut together
+        for call in mock_chisel_cut.call_args_list:
+            arches = {arch for arch, group in groups for pkg, _, _ in group
+                      if f"{pkg}_libs" in call.kwargs["slice_names"]}
+            self.assertIn(call.kwargs["arch"], arches)
+
+    @unittest.mock.patch("install_slices.chisel_cut")
+    def test_install_all_slices_replan(self, mock_chisel_cut):
+        """
+        Test install_all_slices() with the slices of failed cuts planned again
+        """
+
+        async def chisel_cut(*, slice_names, **kwargs):
+            return "error" if "foo_bins" in slice_names else None
+
+        mock_chisel_cut.side_effect = chisel_cut
+        plans = {"amd64": [("foo", "bins", ["foo_bins", "foo_libs"])]}
+        closures = {"foo_bins": {"foo_bins", "foo_libs"}, "foo_libs": {"foo_libs"}}
+
+        def replan(round_results):
+            failed = {r.slice_name for r in round_results if r.error}
+            plan, new = replan_failed(plans["amd64"], closures, failed)
+            plans["amd64"] = plan + new
+            return [("amd64", [entry]) for entry in new]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            results, _, _ = asyncio.run(
+                install_all_slices(
+                    [("amd64", plans["amd64"])],
+                    False,
+                    "ubuntu-22.04",
+                    {"unknown": "chisel"},
+                    cache_dir,
+                    ConcurrencyController(2, 2, 2),
+                    batch_size=1,
+                    replan=replan,
+                )
+            )
+        self.assertEqual(
+            [(r.slice_name, r.error) for r in results],
+            [("foo_bins", "error"), ("foo_libs", None)],
+        )
+        self.assertEqual(
+            plans["amd64"],
+            [("foo", "bins", ["foo_bins"]), ("foo", "libs", ["foo_libs"])],
+        )
+
+    @unittest.mock.patch("install_slices.chisel_cut")
+    def test_install_all_slices_limit(self, mock_chisel_cut):
+        """
+        Test that install_all_slices() only hands the groups out to as many
+        workers as the concurrency limit
+        """
+        controller = ConcurrencyController(1, 1, 4)
+        active = []
+
+        async def chisel_cut(*, slice_names, **kwargs):
+            active.append(controller.active)
+            await asyncio.sleep(0.01)
+            return None
+
+        mock_chisel_cut.side_effect = chisel_cut
+        groups = [("amd64", [(pkg, "libs", [f"{pkg}_libs"])]) for pkg in ["foo", "bar", "baz"]]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            asyncio.run(
+                install_all_slices(
+                    groups,
+                    False,
+                    "ubuntu-22.04",
+                    {"unknown": "chisel"},
+                    cache_dir,
+                    controller,
+                    batch_size=1,
+                )
+            )
+        self.assertEqual(active, [1, 1, 1])
+        # the groups are cut in the order of the queue, the longest first
+        self.assertEqual(
+            [call.kwargs["slice_names"] for call in mock_chisel_cut.call_args_list],
+            [["foo_libs"], ["bar_libs"], ["baz_libs"]],
+        )
+
+    @unittest.mock.patch("install_slices.chisel_cut")
+    def test_install_all_slices_chisels(self, mock_chisel_cut):
+        """
+        Test install_all_slices() with several chisel versions
+        """
+
+        async def chisel_cut(*, root, chisel_version, **kwargs):
+            os.makedirs(os.path.join(root, "usr/bin"))
+            with open(os.path.join(root, "usr/bin/foo"), "w", encoding="utf-8") as f:
+                f.write("foo")
+            if chisel_version == "main":
+                os.symlink("foo", os.path.join(root, "usr/bin/bar"))
+            return None
+
+        mock_chisel_cut.side_effect = chisel_cut
+        chisels = {"v1.2.0": "/v1.2.0/chisel", "v1.4.2": "/v1.4.2/chisel", "main": "chisel"}
+        with tempfile.TemporaryDirectory() as cache_dir:
+            results, _, divergences = asyncio.run(
+                install_all_slices(
+                    [("amd64", [("foo", "bins", ["foo_bins"])])],
+                    False,
+                    "ubuntu-22.04",
+                    chisels,
+                    cache_dir,
+                    ConcurrencyController(1, 1, 1),
+                    batch_size=1,
+                )
+            )
+        self.assertEqual([(r.slice_name, r.error) for r in results], [("foo_bins", None)])
+        # the files installed by the first version are accounted for
+        self.assertEqual(results[0].usage.root_bytes, 3)
+        self.assertEqual(
+            [call.kwargs["chisel"] for call in mock_chisel_cut.call_args_list],
+            list(chisels.values()),
+        )
+        self.assertEqual(
+            divergences,
+            [
+                Divergence(
+                    ["foo_bins"],
+                    "amd64",
+                    ("v1.2.0", "main"),
+                    ["/usr/bin/bar: only in the second tree"],
+                )
+            ],
+        )
+
+    @unittest.mock.patch("install_slices.chisel_cut")
+    def test_install_all_slices_manifest(self, mock_chisel_cut):
+        """
+        Test install_all_slices() with the slice that generates the manifest
+        """
+
+        async def chisel_cut(*, slice_names, root, **kwargs):
+            await asyncio.sleep(0.01)
+            if "base-files_chisel" in slice_names and "bar_libs" in slice_names:
+                return "error"
+            if "baz_libs" in slice_names:
+                # baz installs the manifest slice, in a manifest that misses it
+                entries = [{"jsonwall": "1.0", "schema": "1.0", "count": 1}]
+                os.makedirs(os.path.join(root, "var/lib/chisel"))
+                with open(os.path.join(root, "var/lib/chisel/manifest.wall"), "wb") as f:
+                    f.write(
+                        zstandard.ZstdCompressor().compress(
+                            "".join(json.dumps(e) + "\n" for e in entries).encode()
+                        )
+                    )
+            return None
+
+        def run(pkgs, manifest_cut, batch_size):
+            mock_chisel_cut.reset_mock()
+            with tempfile.TemporaryDirectory() as cache_dir:
+                results, _, _ = asyncio.run(
+                    install_all_slices(
+                        [("amd64", [(pkg, "libs", [f"{pkg}_libs"])]) for pkg in pkgs],
+                        False,
+                        "ubuntu-22.04",
+                        {"unknown": "chisel"},
+                        cache_dir,
+                        ConcurrencyController(1, 1, 1),
+                        batch_size=batch_size,
+                        manifest=("base-files_chisel", "/var/lib/chisel/manifest.wall"),
+                        manifest_cut=manifest_cut,
+                    )
+                )
+            return (
+                [call.kwargs["slice_names"] for call in mock_chisel_cut.call_args_list],
+                sorted((r.slice_name, r.error) for r in results),
+            )
+
+        mock_chisel_cut.side_effect = chisel_cut
+        # only the cuts that generate the manifest are checked against it
+        calls, results = run(["foo", "baz"], False, 1)
+        self.assertEqual(calls, [["foo_libs"], ["baz_libs"]])
+        self.assertEqual(
+            results, [("baz_libs", "baz_libs is not in the manifest"), ("foo_libs", None)]
+        )
+        # with manifest_cut, the others are cut again with the manifest slice,
+        # and one by one if they cannot all be cut with it
+        calls, results = run(["foo", "bar"], True, 2)
+        self.assertEqual(
+            calls,
+            [
+                ["foo_libs", "bar_libs"],
+                ["foo_libs", "bar_libs", "base-files_chisel"],
+                ["foo_libs", "base-files_chisel"],
+                ["bar_libs", "base-files_chisel"],
+            ],
+        )
+        self.assertEqual(
+            results,
+            [
+                (
+                    "bar_libs",
+                    "cannot be installed with base-files_chisel to check the manifest: error",
+                ),
+                ("foo_libs", None),
+            ],
+        )
+
+    def test_diff_trees(self):
+        """
+        Test snapshot_tree() and diff_trees()
+        """
+        with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+            for root in (a, b):
+                os.makedirs(os.path.join(root, "etc"))
+                with open(os.path.join(root, "etc/foo"), "w", encoding="utf-8") as f:
+                    f.write("foo")
+                os.chmod(os.path.join(root, "etc/foo"), 0o644)
+            self.assertEqual(diff_trees(snapshot_tree(a), snapshot_tree(b)), [])
+            os.chmod(os.path.join(b, "etc/foo"), 0o755)
+            os.symlink("foo", os.path.join(a, "etc/bar"))
+            os.symlink("baz", os.path.join(b, "etc/bar"))
+            os.mkdir(os.path.join(a, "etc/baz"))
+            with open(os.path.join(b, "etc/baz"), "w", encoding="utf-8") as f:
+                f.write("baz")
+            tree_a = snapshot_tree(a)
+            self.assertEqual(tree_a["/etc"][0], "dir")
+            self.assertEqual(tree_a["/etc/bar"], ("symlink", tree_a["/etc/bar"][1], "foo"))
+            self.assertEqual(
+                diff_trees(tree_a, snapshot_tree(b)),
+                [
+                    "/etc/bar: target foo != baz",
+                    "/etc/baz: dir != file",
+                    "/etc/foo: mode 0644 != 0755",
+                ],
+            )
+
+    def test_install_slices(self):
+        """
+        Test install_slices()
+        """
+        with tempfile.TemporaryDirectory() as cache_dir:
+            results, _, _ = asyncio.run(
+                install_all_slices(
+                    [("amd64", [("libc6", "libs", ["libc6_libs"])])],
+                    False,
+                    "ubuntu-22.04",
+                    {"unknown": "chisel"},
+                    cache_dir,
+                    ConcurrencyController(1, 1, 1),
+                    batch_size=1,
+                )
+            )
+            self.assertEqual(
+                results, [CutResult("libc6_libs", ["libc6_libs"], arch="amd64")]
+            )
+            # the package is left in the shared cache
+            self.assertTrue(
+                any(pathlib.Path(cache_dir, "chisel", "sha256").iterdir())
+            )
+
+    def test_deb_index(self):
+        """
+        Test DebIndex
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pkg_cache = pathlib.Path(tmpdir, "sha256")
+            pkg_cache.mkdir()
+            shas = {}
+            for pkg, version, files in [
+                ("foo", "1.0", ["usr/share/doc/foo/copyright"]),
+                ("foo", "1.0~rc1", []),
+                ("bar", "2.0", ["usr/bin/bar"]),
+            ]:
+                shas[pkg, version] = write_cached_deb(pkg_cache, pkg, version, files)
+            (pkg_cache / ("0" * 64)).write_bytes(b"Package: foo\n")
+            (pkg_cache / "partial").write_bytes(b"!<arch>\n")
+            path = pathlib.Path(tmpdir, "index.sqlite")
+            index = DebIndex(path, pkg_cache)
+            self.assertEqual(index.update(), 3)
+            # the files are only read once
+            self.assertEqual(index.update(), 0)
+            entry = index.get(shas["bar", "2.0"])
+            self.assertEqual(
+                (entry.package, entry.version), ("bar", "2.0")
+            )
+            self.assertTrue(index.contains(entry, "usr/bin/bar"))
+            self.assertIsNone(index.get("0" * 64))
+            self.assertEqual(
+                [e.version for e in index.find("foo")], ["1.0", "1.0~rc1"]
+            )
+            copyright_file = "usr/share/doc/foo/copyright"
+            self.assertTrue(index.has_file("foo", copyright_file))
+            self.assertFalse(
+                index.has_file("foo", copyright_file, shas["foo", "1.0~rc1"])
+            )
+            # the digest of another package is not trusted
+            self.assertTrue(
+                index.has_file("foo", copyright_file, shas["bar", "2.0"])
+            )
+            self.assertFalse(index.has_file("baz", copyright_file))
+            index.close()
+            # the index persists, with the paths already looked up
+            index = DebIndex(path, pkg_cache)
+            self.assertEqual(index.update(), 0)
+            self.assertEqual(len(index.find("foo")), 2)
+            (pkg_cache / shas["bar", "2.0"]).unlink()
+            self.assertTrue(index.contains(entry, "usr/bin/bar"))
+            self.assertFalse(index.contains(entry, "usr/bin/baz"))
+            index.close()
+
+    def test_deb_has_copyright_file(self):
         """
         Test deb_has_copyright_file()
         """
-        # No files, nothing to do
-        mock_rglob.return_value = []
-        assert deb_has_copyright_file("mock_pkg") == False
-        mock_debpackage.assert_not_called()
-
-        # If SHA exists but is not a deb, we skip
-        mock_rglob.return_value = ["fake_sha"]
-        mock_magic.return_value = "not-a-deb"
-        assert deb_has_copyright_file("mock_pkg") == False
-        mock_magic.assert_called_once_with("fake_sha", mime=True)
-        mock_popen.assert_not_called()
-
-        # If the deb exists but the pkg doesn't match, we skip
-        mock_magic.return_value = "debian.binary-package"
-        mock_popen.return_value.read.return_value = "bad-pkg-name"
-        assert deb_has_copyright_file("mock_pkg") == False
-        mock_popen.assert_called_once_with(
-            f"dpkg-deb -f {str(CHISEL_PKG_CACHE) + '/fake_sha'} Package"
-        )
-        mock_debpackage.assert_not_called()
-
-        # If the deb exists and matches, then return True is copyright exists
-        mock_popen.return_value.read.return_value = "mock_pkg"
-        mock_deb = unittest.mock.MagicMock()
-        mock_deb.filelist = "no\ncopyright\nfile"
-        mock_debpackage.return_value = mock_deb
-        assert deb_has_copyright_file("mock_pkg") == False
-        mock_debpackage.assert_called_once()
-
-        mock_deb.filelist = "something\nusr/share/doc/mock_pkg/copyright\nextra"
-        mock_debpackage.return_value = mock_deb
-        assert deb_has_copyright_file("mock_pkg") == True
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pkg_cache = pathlib.Path(tmpdir)
+            # No files, nothing to do
+            self.assertFalse(deb_has_copyright_file("mock-pkg", pkg_cache))
+            write_cached_deb(pkg_cache, "bad-pkg", "1.0", [])
+            self.assertFalse(deb_has_copyright_file("mock-pkg", pkg_cache))
+            sha = write_cached_deb(pkg_cache, "mock-pkg", "1.0", ["usr/bin/mock"])
+            self.assertFalse(deb_has_copyright_file("mock-pkg", pkg_cache))
+            write_cached_deb(
+                pkg_cache, "mock-pkg", "1.1", ["usr/share/doc/mock-pkg/copyright"]
+            )
+            self.assertTrue(deb_has_copyright_file("mock-pkg", pkg_cache))
+            # the deb installed by chisel, given by its digest
+            self.assertFalse(deb_has_copyright_file("mock-pkg", pkg_cache, sha256=sha))
+
+    def test_find_manifest_slice(self):
+        """
+        Test find_manifest_slice()
+        """
+        base_files = Package(
+            "base-files",
+            ["bin", "chisel"],
+            contents={
+                "bin": {"/usr/bin/": PathInfo("dir")},
+                "chisel": {"/var/lib/chisel/**": PathInfo("generate", "manifest")},
+            },
+        )
+        self.assertEqual(
+            find_manifest_slice([DEFAULT_PACKAGE, base_files]),
+            ("base-files_chisel", "/var/lib/chisel/manifest.wall"),
+        )
+        self.assertIsNone(find_manifest_slice([base_files], "base-files_bin"))
+        self.assertIsNone(find_manifest_slice([DEFAULT_PACKAGE]))
+
+    def test_verify_manifest(self):
+        """
+        Test verify_manifest()
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            pkg_cache = pathlib.Path(tmpdir, "sha256")
+            pkg_cache.mkdir()
+            with_copyright = write_cached_deb(
+                pkg_cache, "foo", "1.0", ["usr/bin/foo", "usr/share/doc/foo/copyright"]
+            )
+            without_copyright = write_cached_deb(pkg_cache, "bar", "1.0", ["usr/bin/bar"])
+            root = os.path.join(tmpdir, "root")
+            os.makedirs(os.path.join(root, "usr", "bin"))
+            for name, content in [("foo", b"foo"), ("bar", b"bar!")]:
+                with open(os.path.join(root, "usr", "bin", name), "wb") as f:
+                    f.write(content)
+            entries = [
+                {"jsonwall": "1.0", "schema": "1.0", "count": 8},
+                {"kind": "package", "name": "bar", "version": "1.0", "sha256": without_copyright},
+                {"kind": "package", "name": "foo", "version": "1.0", "sha256": with_copyright},
+                {"kind": "path", "path": "/usr/bin/", "mode": "0755", "slices": ["foo_bins"]},
+                {"kind": "path", "path": "/usr/bin/bar", "slices": ["bar_bins"], "size": 3},
+                {"kind": "path", "path": "/usr/bin/foo", "slices": ["foo_bins"], "size": 3},
+                {"kind": "path", "path": "/usr/bin/baz", "slices": ["foo_bins"], "size": 3},
+                {"kind": "slice", "name": "bar_bins"},
+                {"kind": "slice", "name": "foo_bins"},
+            ]
+            manifest_file = pathlib.Path(tmpdir, "manifest.wall")
+            manifest_file.write_bytes(
+                zstandard.ZstdCompressor().compress(
+                    "".join(json.dumps(e) + "\n" for e in entries).encode()
+                )
+            )
+            index = DebIndex(":memory:", pkg_cache)
+            self.assertEqual(
+                verify_manifest(
+                    manifest_file, root, ["foo_bins", "bar_bins", "baz_bins"], index
+                ),
+                [
+                    "/usr/bin/bar has 4 bytes instead of 3 in the manifest",
+                    "/usr/bin/baz is in the manifest but was not installed",
+                    "baz_bins is not in the manifest",
+                    # the deb chisel installed is read, by its digest
+                    "foo has a copyright file but it wasn't installed.",
+                ],
+            )
+            index.close()
 
     def test_main(self):
         """
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+
+"""
+Tests for package_table.py script
+"""
+
+import gzip
+import lzma
+import os
+import tempfile
+import unittest
+
+from package_table import (
+    PackageTable,
+    PackageTableError,
+    TableEntry,
+    build_package_table,
+)
+
+
+def write_mirror(mirror: str, indices: dict[tuple[str, str, str], list[tuple[str, str]]]) -> None:
+    """
+    Write a local mirror with the Packages indices of (suite, component,
+    arch), listing (package, version) pairs. The jammy indices are
+    compressed with xz, the others with gzip.
+    """
+    for (suite, component, arch), packages in indices.items():
+        text = "\n".join(
+            f"Package: {pkg}\nArchitecture: {arch}\nVersion: {version}\n"
+            f"Installed-Size: 2\nSize: {len(pkg)}\nFilename: pool/{pkg}.deb\n"
+            for pkg, version in packages
+        )
+        path = os.path.join(mirror, "dists", suite, component, f"binary-{arch}")
+        os.makedirs(path)
+        if suite == "jammy":
+            with open(os.path.join(path, "Packages.xz"), "wb") as f:
+                f.write(lzma.compress(text.encode()))
+        else:
+            with open(os.path.join(path, "Packages.gz"), "wb") as f:
+                f.write(gzip.compress(text.encode()))
+
+
+class TestScriptMethods(unittest.TestCase):
+    """
+    Test the methods of package_table
+    """
+
+    def test_package_table(self):
+        """
+        Test build_package_table() with a local mirror, and PackageTable
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mirror = os.path.join(tmpdir, "mirror")
+            write_mirror(
+                mirror,
+                {
+                    ("jammy", "main", "amd64"): [("libc6", "2.35-0ubuntu3"), ("hello", "2.10-2")],
+                    ("jammy", "main", "s390x"): [("libc6", "2.35-0ubuntu3")],
+                    ("jammy", "universe", "amd64"): [("zstd", "1.4.8")],
+                    ("jammy", "universe", "s390x"): [],
+                    ("jammy-updates", "main", "amd64"): [("libc6", "2.35-0ubuntu3.8")],
+                    ("jammy-updates", "main", "s390x"): [],
+                    ("jammy-updates", "universe", "amd64"): [],
+                    ("jammy-updates", "universe", "s390x"): [],
+                },
+            )
+            path = os.path.join(tmpdir, "packages.table")
+            count = build_package_table(
+                path,
+                "ubuntu-22.04",
+                ["jammy", "jammy-updates"],
+                ["main", "universe"],
+                ["amd64", "s390x"],
+                base_url=mirror,
+            )
+            self.assertEqual(count, 3)
+            # no temporary file is left behind
+            self.assertEqual(sorted(os.listdir(tmpdir)), ["mirror", "packages.table"])
+            with PackageTable(path) as table:
+                self.assertEqual(table.release, "ubuntu-22.04")
+                self.assertEqual(table.arches, ["amd64", "s390x"])
+                self.assertEqual(len(table), 3)
+                self.assertEqual(list(table), ["hello", "libc6", "zstd"])
+                self.assertIn("zstd", table)
+                self.assertNotIn("foo", table)
+                self.assertNotIn("a", table)
+                self.assertNotIn("zz", table)
+                self.assertEqual(table.architectures("libc6"), {"amd64", "s390x"})
+                self.assertEqual(table.architectures("hello"), {"amd64"})
+                self.assertEqual(table.architectures("foo"), set())
+                self.assertEqual(
+                    table.entries("libc6"),
+                    [
+                        TableEntry("amd64", "jammy", "main", "2.35-0ubuntu3", 5, 2048),
+                        TableEntry("amd64", "jammy-updates", "main", "2.35-0ubuntu3.8", 5, 2048),
+                        TableEntry("s390x", "jammy", "main", "2.35-0ubuntu3", 5, 2048),
+                    ],
+                )
+                self.assertEqual(table.entries("foo"), [])
+
+            with open(path, "r+b") as f:
+                f.truncate(100)
+            with self.assertRaises(PackageTableError):
+                PackageTable(path)
+            with open(path, "wb") as f:
+                f.write(b"Package: hello\n")
+            with self.assertRaises(PackageTableError):
+                PackageTable(path)
+            with self.assertRaises(PackageTableError):
+                PackageTable(os.path.join(tmpdir, "missing.table"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+"""
+Tests for timing_db.py script
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from timing_db import (
+    SliceTiming,
+    Regression,
+    connect,
+    record_run,
+    compare_run,
+)
+
+
+class TestScriptMethods(unittest.TestCase):
+    """
+    Test the methods of timing_db
+    """
+
+    def test_record_run(self):
+        """
+        Test record_run()
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "timings.db")
+            timing = SliceTiming(
+                "amd64", "foo_bins", "main", 3.0, 2.5, [0.5, 2.0], 1, 2, 1
+            )
+            self.assertEqual(record_run(path, "abc", "ubuntu-22.04", [timing], 10.0), 1)
+            self.assertEqual(record_run(path, "def", "ubuntu-22.04", []), 2)
+            db = connect(path)
+            try:
+                self.assertEqual(
+                    db.execute("SELECT * FROM runs WHERE id = 1").fetchone(),
+                    (1, "abc", "ubuntu-22.04", 10.0),
+                )
+                row = db.execute("SELECT * FROM timings").fetchone()
+            finally:
+                db.close()
+            self.assertEqual(
+                row, (1, "amd64", "foo_bins", "main", 3.0, 2.5, "[0.5, 2.0]", 1, 2, 1, 0)
+            )
+            self.assertEqual(json.loads(row[6]), timing.attempts)
+
+    def test_compare_run(self):
+        """
+        Test compare_run()
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "timings.db")
+
+            def run(release, **seconds):
+                record_run(
+                    path,
+                    "abc",
+                    release,
+                    [
+                        SliceTiming("amd64", name, "main", s, s, [s])
+                        for name, s in seconds.items()
+                    ],
+                )
+
+            db = connect(path)
+            try:
+                # nothing to compare to
+                self.assertEqual(compare_run(db), [])
+                for foo in [10.0, 11.0, 40.0]:
+                    run("ubuntu-22.04", foo_bins=foo, bar_libs=2.0)
+                # runs of other releases are not part of the baseline
+                run("ubuntu-24.04", foo_bins=100.0, bar_libs=100.0)
+                # bar_libs is slower, but by less than min_seconds;
+                # baz_libs has no baseline
+                run("ubuntu-22.04", foo_bins=20.0, bar_libs=2.9, baz_libs=50.0)
+                self.assertEqual(
+                    compare_run(db),
+                    [
+                        Regression("amd64", "foo_bins", "main", 20.0, 11.0),
+                        Regression("amd64", "", "main", 22.9, 13.0),
+                    ],
+                )
+                self.assertEqual(compare_run(db, window=1, threshold=2.0), [])
+                self.assertEqual(compare_run(db, run=4), [])
+                with self.assertRaises(ValueError):
+                    compare_run(db, run=42)
+            finally:
+                db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+
+"""
+Keep the timings of the install_slices runs in a SQLite database, and flag
+the slices and runs that got slower than the previous runs.
+
+Usage
+-----
+timing_db compare [-h] [--run RUN] [--window WINDOW]
+                  [--threshold THRESHOLD] [--min-seconds MIN_SECONDS]
+                  db
+
+positional arguments:
+  db                  Timing database written by install_slices --timings
+
+options:
+  -h, --help          show this help message and exit
+  --run RUN           Run to compare to the previous ones (default: the last
+                      run)
+  --window WINDOW     Number of previous runs of the same release making up
+                      the baseline (default: 10)
+  --threshold THRESHOLD
+                      Flag the slices and runs that took more than this many
+                      times the baseline (default: 1.5)
+  --min-seconds MIN_SECONDS
+                      Ignore the slices that took less than this many seconds
+                      more than the baseline (default: 1.0)
+
+Exits with 1 if there are regressions.
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import statistics
+import sys
+import time
+
+from dataclasses import dataclass, field
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    commit_id TEXT NOT NULL,
+    release TEXT NOT NULL,
+    started REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS timings (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    arch TEXT NOT NULL,
+    slice TEXT NOT NULL,
+    chisel_version TEXT NOT NULL,
+    -- Seconds spent installing the slice, with all the chisel versions.
+    total REAL NOT NULL,
+    -- Seconds spent in the chisel processes of this version.
+    seconds REAL NOT NULL,
+    -- JSON list of the seconds of every chisel process of this version.
+    attempts TEXT NOT NULL,
+    retries INTEGER NOT NULL,
+    cache_hits INTEGER NOT NULL,
+    cache_misses INTEGER NOT NULL,
+    failed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_key ON timings (arch, slice, chisel_version);
+"""
+
+
+@dataclass
+class SliceTiming:
+    """
+    Time it took to install a slice on an architecture with a chisel version.
+    """
+
+    arch: str
+    slice: str
+    chisel_version: str
+    total: float
+    seconds: float
+    attempts: list[float] = field(default_factory=list)
+    retries: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    failed: bool = False
+
+
+@dataclass
+class Regression:
+    """
+    Slice, or whole run if slice is empty, that took longer than its baseline.
+    """
+
+    arch: str
+    slice: str
+    chisel_version: str
+    seconds: float
+    baseline: float
+
+    def __str__(self) -> str:
+        what = self.slice or "run"
+        return (
+            f"{what} on {self.arch} with chisel {self.chisel_version}: "
+            f"{self.seconds:.2f}s, baseline {self.baseline:.2f}s "
+            f"(x{self.seconds / self.baseline:.2f})"
+        )
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Open the database at path, creating its tables if needed.
+    """
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def record_run(
+    path: str,
+    commit_id: str,
+    release: str,
+    timings: list[SliceTiming],
+    started: float | None = None,
+) -> int:
+    """
+    Append the timings of a run of the release at the given commit to the
+    database at path, and return the id of the run.
+    """
+    db = connect(path)
+    try:
+        with db:
+            run = db.execute(
+                "INSERT INTO runs (commit_id, release, started) VALUES (?, ?, ?)",
+                (commit_id, release, started if started is not None else time.time()),
+            ).lastrowid
+            db.executemany(
+                "INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run,
+                        t.arch,
+                        t.slice,
+                        t.chisel_version,
+                        t.total,
+                        t.seconds,
+                        json.dumps(t.attempts),
+                        t.retries,
+                        t.cache_hits,
+                        t.cache_misses,
+                        int(t.failed),
+                    )
+                    for t in timings
+                ],
+            )
+    finally:
+        db.close()
+    return run
+
+
+def compare_run(
+    db: sqlite3.Connection,
+    run: int | None = None,
+    window: int = 10,
+    threshold: float = 1.5,
+    min_seconds: float = 1.0,
+) -> list[Regression]:
+    """
+    Compare the chisel timings of a run, the last one by default, to the
+    median of the same slice, architecture and chisel version over the
+    previous window runs of the same release. Failed cuts are left out.
+
+    A slice regressed if it took more than threshold times its baseline and
+    at least min_seconds more. A run regressed, per architecture and chisel
+    version, if its slices that have a baseline took more than threshold
+    times their baselines together, which is not thrown off by the runs
+    installing different subsets of the slices.
+    """
+    if run is None:
+        row = db.execute("SELECT MAX(id) FROM runs").fetchone()
+        run = row[0]
+        if run is None:
+            return []
+    row = db.execute("SELECT release FROM runs WHERE id = ?", (run,)).fetchone()
+    if row is None:
+        raise ValueError(f"no run {run}")
+    previous = [
+        r[0]
+        for r in db.execute(
+            "SELECT id FROM runs WHERE release = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (row[0], run, window),
+        )
+    ]
+    history: dict[tuple[str, str, str], list[float]] = {}
+    if previous:
+        placeholders = ",".join("?" * len(previous))
+        for arch, slice, version, seconds in db.execute(
+            "SELECT arch, slice, chisel_version, seconds FROM timings "
+            f"WHERE failed = 0 AND run IN ({placeholders})",
+            previous,
+        ):
+            history.setdefault((arch, slice, version), []).append(seconds)
+
+    regressions = []
+    totals: dict[tuple[str, str], list[float]] = {}
+    for arch, slice, version, seconds in db.execute(
+        "SELECT arch, slice, chisel_version, seconds FROM timings "
+        "WHERE failed = 0 AND run = ? ORDER BY arch, chisel_version, slice",
+        (run,),
+    ):
+        if (arch, slice, version) not in history:
+            continue
+        baseline = statistics.median(history[arch, slice, version])
+        total = totals.setdefault((arch, version), [0.0, 0.0])
+        total[0] += seconds
+        total[1] += baseline
+        if seconds > threshold * baseline and seconds - baseline >= min_seconds:
+            regressions.append(Regression(arch, slice, version, seconds, baseline))
+    for (arch, version), (seconds, baseline) in totals.items():
+        if baseline and seconds > threshold * baseline:
+            regressions.append(Regression(arch, "", version, seconds, baseline))
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Flag the slices and runs that got slower than the previous runs."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compare = subparsers.add_parser(
+        "compare", help="Compare a run to the previous runs of its release"
+    )
+    compare.add_argument("db", help="Timing database written by install_slices --timings")
+    compare.add_argument(
+        "--run",
+        type=int,
+        default=None,
+        help="Run to compare to the previous ones (default: the last run)",
+    )
+    compare.add_argument(
+        "--window",
+        type=int,
+        default=10,
+        help="Number of previous runs of the same release making up the "
+        "baseline (default: 10)",
+    )
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="Flag the slices and runs that took more than this many times "
+        "the baseline (default: 1.5)",
+    )
+    compare.add_argument(
+        "--min-seconds",
+        type=float,
+        default=1.0,
+        help="Ignore the slices that took less than this many seconds more "
+        "than the baseline (default: 1.0)",
+    )
+    cli_args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+    db = connect(cli_args.db)
+    try:
+        regressions = compare_run(
+            db,
+            cli_args.run,
+            cli_args.window,
+            cli_args.threshold,
+            cli_args.min_seconds,
+        )
+    except ValueError as e:
+        logging.error("%s", e)
+        sys.exit(1)
+    finally:
+        db.close()
+    for regression in regressions:
+        logging.warning("Slower: %s", regression)
+    if regressions:
+        sys.exit(1)
+    logging.info("No slowdown found")
+
+
+if __name__ == "__main__":
+    main()